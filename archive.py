@@ -0,0 +1,252 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
+import discord
+
+from snapshot import DEFAULT_CODEC, compress, decompress
+from store import CODEC_SUFFIX, run_io, write_atomic
+
+# メッセージ履歴のアーカイブ。チャンネル（スレッド・フォーラム投稿を含む）ごとに
+#   <root>/<guild_id>/<channel_id>/checkpoint.json            最後に保存したメッセージ ID と segment 一覧
+#   <root>/<guild_id>/<channel_id>/<first_id>-<last_id>.ndjson.gz|.zst  1 行 1 メッセージ（古い順）
+# segment を書いてから checkpoint を更新するので、途中で止まっても checkpoint の位置から再開できる。
+# 2 回目以降は checkpoint より新しいメッセージだけを取得する。
+
+ARCHIVE_CONCURRENCY = int(os.getenv('ARCHIVE_CONCURRENCY', '4'))
+SEGMENT_MESSAGES = int(os.getenv('ARCHIVE_SEGMENT_MESSAGES', '1000'))
+
+_CHECKPOINT = 'checkpoint.json'
+
+
+def serialize_message(msg: discord.Message) -> dict:
+    author = msg.author
+    return {
+        'id': msg.id,
+        'type': msg.type.name,
+        'author': {
+            'id': author.id,
+            'name': author.name,
+            'display_name': author.display_name,
+            'avatar': author.display_avatar.url,
+            'bot': author.bot,
+        },
+        'content': msg.content,
+        'created_at': msg.created_at.isoformat(),
+        'edited_at': msg.edited_at.isoformat() if msg.edited_at else None,
+        'pinned': msg.pinned,
+        'attachments': [
+            {'id': a.id, 'filename': a.filename, 'url': a.url, 'size': a.size,
+             'content_type': a.content_type, 'description': a.description}
+            for a in msg.attachments
+        ],
+        'embeds': [e.to_dict() for e in msg.embeds],
+        'stickers': [{'id': s.id, 'name': s.name} for s in msg.stickers],
+        'reactions': [{'emoji': str(r.emoji), 'count': r.count} for r in msg.reactions],
+        'reference': msg.reference.message_id if msg.reference else None,
+    }
+
+
+def channel_info(channel) -> dict:
+    if isinstance(channel, discord.Thread):
+        parent = channel.parent
+        return {
+            'id': channel.id,
+            'name': channel.name,
+            'kind': 'forum_post' if isinstance(parent, discord.ForumChannel) else 'thread',
+            'parent_id': channel.parent_id,
+            'parent': getattr(parent, 'name', None),
+            'category': parent.category.name if getattr(parent, 'category', None) else None,
+        }
+    return {
+        'id': channel.id,
+        'name': channel.name,
+        'kind': 'text',
+        'category': channel.category.name if channel.category else None,
+    }
+
+
+class MessageArchive:
+    def __init__(self, root: str, codec: str = DEFAULT_CODEC):
+        self.root = root
+        self.codec = codec
+
+    def _channel_dir(self, guild_id, channel_id) -> str:
+        return os.path.join(self.root, str(guild_id), str(channel_id))
+
+    def checkpoint(self, guild_id, channel_id) -> dict | None:
+        path = os.path.join(self._channel_dir(guild_id, channel_id), _CHECKPOINT)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list_channels(self, guild_id) -> list[dict]:
+        base = os.path.join(self.root, str(guild_id))
+        if not os.path.isdir(base):
+            return []
+        out = []
+        for name in sorted(os.listdir(base)):
+            cp = self.checkpoint(guild_id, name)
+            if cp is not None:
+                out.append(cp)
+        return out
+
+    def commit(self, guild_id, info: dict, messages: list[dict]) -> dict:
+        # segment → checkpoint の順に書く。checkpoint に載っていない segment は読まれない
+        directory = self._channel_dir(guild_id, info['id'])
+        checkpoint = self.checkpoint(guild_id, info['id']) or {'segments': [], 'count': 0, 'last_id': None}
+        name = f"{messages[0]['id']}-{messages[-1]['id']}.ndjson{CODEC_SUFFIX[self.codec]}"
+        raw = ''.join(json.dumps(m, ensure_ascii=False, separators=(',', ':')) + '\n' for m in messages)
+        write_atomic(os.path.join(directory, name), compress(self.codec, raw.encode('utf-8')))
+        checkpoint.update(info)
+        checkpoint['segments'] = checkpoint['segments'] + [name]
+        checkpoint['count'] += len(messages)
+        checkpoint['last_id'] = messages[-1]['id']
+        checkpoint['updated_at'] = time.time()
+        write_atomic(os.path.join(directory, _CHECKPOINT),
+                      json.dumps(checkpoint, ensure_ascii=False, indent=2).encode('utf-8'))
+        return checkpoint
+
+    def read_segment(self, guild_id, channel_id, name: str) -> list[dict]:
+        codec = 'zstd' if name.endswith(CODEC_SUFFIX['zstd']) else 'gzip'
+        with open(os.path.join(self._channel_dir(guild_id, channel_id), name), 'rb') as f:
+            raw = decompress(codec, f.read()).decode('utf-8')
+        return [json.loads(line) for line in raw.splitlines() if line]
+
+    def segments(self, guild_id, channel_id, after: int | None = None) -> list[str]:
+        # after より新しいメッセージを含む segment だけ（名前の末尾が segment 内の最後の ID）
+        checkpoint = self.checkpoint(guild_id, channel_id)
+        names = (checkpoint or {}).get('segments', [])
+        if after is None:
+            return list(names)
+        return [name for name in names if int(name.split('-', 1)[1].split('.', 1)[0]) > after]
+
+    def iter_messages(self, guild_id, channel_id, after: int | None = None):
+        # 古い順に 1 件ずつ返す。メモリに載るのは 1 segment 分だけ
+        for name in self.segments(guild_id, channel_id, after):
+            for msg in self.read_segment(guild_id, channel_id, name):
+                if after is None or msg['id'] > after:
+                    yield msg
+
+
+async def iter_threads(guild: discord.Guild):
+    # スレッドを順に返す：アクティブなもの → アーカイブ済み（親チャンネルごとに 100 件ずつページングして遅延取得）
+    seen = set()
+    try:
+        active = await guild.active_threads()
+    except discord.HTTPException:
+        active = list(guild.threads)
+    for thread in active:
+        seen.add(thread.id)
+        yield thread
+    forums = [c for c in guild.channels if isinstance(c, discord.ForumChannel)]
+    for parent in [*guild.text_channels, *forums]:
+        # フォーラムには非公開スレッドが無い。非公開スレッドの一覧にはスレッド管理権限が要る
+        for private in (False, True) if isinstance(parent, discord.TextChannel) else (False,):
+            try:
+                async for thread in parent.archived_threads(limit=None, private=private):
+                    if thread.id not in seen:
+                        seen.add(thread.id)
+                        yield thread
+            except (discord.Forbidden, discord.NotFound):
+                continue
+
+
+async def iter_targets(guild: discord.Guild):
+    # アーカイブ対象を順に返す：テキストチャンネル → スレッド
+    for channel in guild.text_channels:
+        yield channel
+    async for thread in iter_threads(guild):
+        yield thread
+
+
+@dataclass
+class ArchiveReport:
+    channels: int = 0
+    up_to_date: int = 0
+    messages: int = 0
+    active: dict = field(default_factory=dict)
+    failures: list = field(default_factory=list)  # (チャンネル名, 理由)
+
+    def progress(self) -> str:
+        working = '、'.join(f'#{name}' for name in list(self.active.values())[:3])
+        return (f'📝 メッセージを保存中… チャンネル {self.channels} 件済み・新規 {self.messages} 件'
+                + (f'（処理中: {working}）' if working else ''))
+
+    def summary(self) -> str:
+        text = (f'メッセージ: チャンネル {self.channels} 件（更新なし {self.up_to_date} 件）・'
+                f'新規 {self.messages} 件を保存')
+        if self.failures:
+            names = '、'.join(f'#{name}（{reason}）' for name, reason in self.failures[:5])
+            more = f' ほか {len(self.failures) - 5} 件' if len(self.failures) > 5 else ''
+            text += f'\n⚠️ 保存できなかったチャンネル {len(self.failures)} 件: {names}{more}'
+        return text
+
+
+async def archive_channel(archive: MessageArchive, guild_id, channel, report: ArchiveReport,
+                          segment_messages: int = SEGMENT_MESSAGES) -> int:
+    info = channel_info(channel)
+    checkpoint = await run_io(archive.checkpoint, guild_id, channel.id)
+    last_id = (checkpoint or {}).get('last_id')
+    # 最後のメッセージが保存済みなら履歴を取りに行かない（last_message_id が分からないときは取りに行く）
+    if last_id is not None and channel.last_message_id is not None and channel.last_message_id <= last_id:
+        report.up_to_date += 1
+        return 0
+    after = discord.Object(id=last_id) if last_id else None
+    buffer = []
+    saved = 0
+    async for msg in channel.history(limit=None, after=after, oldest_first=True):
+        buffer.append(serialize_message(msg))
+        if len(buffer) >= segment_messages:
+            await run_io(archive.commit, guild_id, info, buffer)
+            saved += len(buffer)
+            report.messages += len(buffer)
+            buffer = []
+    if buffer:
+        await run_io(archive.commit, guild_id, info, buffer)
+        saved += len(buffer)
+        report.messages += len(buffer)
+    if saved == 0:
+        report.up_to_date += 1
+    return saved
+
+
+async def archive_guild(archive: MessageArchive, guild: discord.Guild, concurrency: int = ARCHIVE_CONCURRENCY,
+                        progress=None) -> ArchiveReport:
+    # 対象の列挙は遅延させ、固定数のワーカーでチャンネルを並列に処理する。
+    # 履歴取得のルートはチャンネルごとにバケットが分かれるので、並列にしても同じバケットを取り合わない
+    report = ArchiveReport()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def _worker():
+        while True:
+            channel = await queue.get()
+            if channel is None:
+                return
+            report.active[channel.id] = channel.name
+            try:
+                await archive_channel(archive, guild.id, channel, report)
+            except discord.HTTPException as e:
+                report.failures.append((channel.name, f'{e.status} {e.text or type(e).__name__}'))
+            except Exception as e:
+                report.failures.append((channel.name, f'{type(e).__name__}: {e}'))
+            finally:
+                report.active.pop(channel.id, None)
+                report.channels += 1
+                if progress is not None:
+                    progress.update(report.progress())
+
+    workers = [asyncio.create_task(_worker()) for _ in range(max(1, concurrency))]
+    try:
+        async for channel in iter_targets(guild):
+            await queue.put(channel)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for w in workers:
+            w.cancel()
+    return report
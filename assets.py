@@ -0,0 +1,340 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+import aiohttp
+import discord
+
+from ratelimit import ROUTE_ROLE_EDIT
+from store import run_io, write_atomic
+
+# 画像などのアセット（カスタム絵文字・スタンプ・サーバーアイコン/バナー・ロールアイコン・添付ファイル）。
+#   <root>/ab/<sha256>   中身（内容アドレス。チャンネル・スナップショットをまたいで 1 回だけ保存）
+#   <root>/keys.json     安定したキー（emoji:<id> など）→ sha256。既に持っているキーは再ダウンロードしない
+# どの絵文字・スタンプがどのアセットかはスナップショットの assets セクションに持つ。
+
+ASSET_CONCURRENCY = int(os.getenv('ASSET_CONCURRENCY', '8'))
+ASSET_MAX_BYTES = int(os.getenv('ASSET_MAX_BYTES', str(25 * 1024 * 1024)))
+DOWNLOAD_CHUNK = 64 * 1024
+
+ROUTE_EMOJI_CREATE = 'emoji_create'
+ROUTE_STICKER_CREATE = 'sticker_create'
+ROUTE_GUILD_EDIT = 'guild_edit'
+
+
+class AssetStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._keys: dict[str, str] | None = None
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _keys_path(self) -> str:
+        return os.path.join(self.root, 'keys.json')
+
+    def keys(self) -> dict[str, str]:
+        with self._lock:
+            if self._keys is None:
+                path = self._keys_path()
+                if os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        self._keys = json.load(f)
+                else:
+                    self._keys = {}
+            return self._keys
+
+    def digest_for(self, key: str) -> str | None:
+        digest = self.keys().get(key)
+        if digest is not None and os.path.exists(self._path(digest)):
+            return digest
+        return None
+
+    def put(self, key: str | None, data: bytes) -> tuple[str, bool]:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        new = not os.path.exists(path)
+        if new:
+            write_atomic(path, data)
+        if key is not None:
+            keys = self.keys()
+            with self._lock:
+                keys[key] = digest
+        return digest, new
+
+    def save_keys(self):
+        keys = self.keys()
+        with self._lock:
+            data = json.dumps(keys, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        write_atomic(self._keys_path(), data)
+
+    def get(self, digest: str) -> bytes:
+        with open(self._path(digest), 'rb') as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f'アセット {digest[:12]} のチェックサムが一致しません（破損しています）')
+        return data
+
+    def get_key(self, key: str) -> bytes | None:
+        digest = self.digest_for(key)
+        return self.get(digest) if digest is not None else None
+
+
+@dataclass
+class DownloadReport:
+    requested: int = 0
+    cached: int = 0
+    downloaded: int = 0
+    new: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+    failures: list = field(default_factory=list)  # (キー, 理由)
+
+    def summary(self) -> str:
+        return (f'アセット {self.requested} 件（取得済み {self.cached} 件・ダウンロード {self.downloaded} 件・'
+                f'新規保存 {self.new} 件・{self.bytes / 1024 / 1024:.1f} MiB・失敗 {len(self.failures)} 件）')
+
+
+class AssetDownloader:
+    # 1 つのセッション（コネクションプール）を使い回し、同時ダウンロード数を絞る
+    def __init__(self, store: AssetStore, concurrency: int = ASSET_CONCURRENCY, retries: int = 3,
+                 session: aiohttp.ClientSession | None = None):
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self._session = session
+        self._own_session = session is None
+        self._sem = asyncio.Semaphore(self.concurrency)
+
+    async def __aenter__(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=120),
+            )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+        return False
+
+    async def _download(self, url: str) -> bytes:
+        attempt = 0
+        while True:
+            async with self._sem:
+                async with self._session.get(url) as resp:
+                    if resp.status == 200:
+                        if resp.content_length and resp.content_length > ASSET_MAX_BYTES:
+                            raise ValueError(f'サイズ上限を超えています（{resp.content_length} bytes）')
+                        # Content-Length が無い・偽っている応答もあるので、読みながら上限で打ち切る
+                        data = bytearray()
+                        async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK):
+                            data += chunk
+                            if len(data) > ASSET_MAX_BYTES:
+                                raise ValueError(f'サイズ上限（{ASSET_MAX_BYTES} bytes）を超えています')
+                        return bytes(data)
+                    retry = resp.status == 429 or resp.status >= 500
+                    if not retry or attempt >= self.retries:
+                        raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status,
+                                                          message=resp.reason or '')
+                    try:
+                        delay = float(resp.headers.get('Retry-After', 0))
+                    except ValueError:
+                        delay = 0.0
+            attempt += 1
+            await asyncio.sleep(max(delay, 0.5 * 2 ** (attempt - 1)))
+
+    async def fetch_all(self, items) -> DownloadReport:
+        # items: (キー, URL) の列。キーが既にあればダウンロードしない。同じ URL は 1 回だけ取得する
+        report = DownloadReport()
+        start = time.perf_counter()
+        todo: dict[str, list[str]] = {}
+        seen = set()
+        for key, url in items:
+            if not url or key in seen:
+                continue
+            seen.add(key)
+            report.requested += 1
+            if self.store.digest_for(key) is not None:
+                report.cached += 1
+                continue
+            todo.setdefault(url, []).append(key)
+
+        async def _one(url, keys):
+            try:
+                data = await self._download(url)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                report.failures.extend((key, str(e) or type(e).__name__) for key in keys)
+                return
+            for key in keys:
+                _, new = await run_io(self.store.put, key, data)
+                report.new += new
+            report.downloaded += 1
+            report.bytes += len(data)
+
+        await asyncio.gather(*(_one(url, keys) for url, keys in todo.items()))
+        if todo:
+            await run_io(self.store.save_keys)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+
+def collect_guild_assets(guild: discord.Guild) -> tuple[list, list]:
+    # スナップショットの assets セクション（type ごとの項目の列）と、ダウンロードする (キー, URL) の一覧を作る
+    entries = []
+    downloads = []
+
+    def _add(entry: dict, key: str, url: str):
+        downloads.append((key, url))
+        entries.append(dict(entry, asset=key))
+
+    if guild.icon is not None:
+        _add({'type': 'icon'}, f'icon:{guild.id}:{guild.icon.key}', guild.icon.url)
+    if guild.banner is not None:
+        _add({'type': 'banner'}, f'banner:{guild.id}:{guild.banner.key}', guild.banner.url)
+    for emoji in guild.emojis:
+        # 使えるロールは ID で持つ（同名のロールを取り違えない。名前は表示用）
+        _add({'type': 'emoji', 'name': emoji.name, 'animated': emoji.animated,
+              'role_ids': [str(r.id) for r in emoji.roles], 'roles': [r.name for r in emoji.roles]},
+             f'emoji:{emoji.id}', emoji.url)
+    for sticker in guild.stickers:
+        _add({'type': 'sticker', 'name': sticker.name, 'description': sticker.description, 'emoji': sticker.emoji,
+              'format': sticker.format.name}, f'sticker:{sticker.id}', sticker.url)
+    for role in guild.roles:
+        icon = role.display_icon
+        if isinstance(icon, discord.Asset):
+            _add({'type': 'role_icon', 'id': str(role.id), 'name': role.name}, f'role_icon:{role.id}:{icon.key}', icon.url)
+    return entries, downloads
+
+
+def collect_attachments(archive, guild_id, channels=None, after: dict | None = None):
+    # アーカイブ済みメッセージの添付ファイル (キー, URL)。添付 ID は変わらないのでキーに使う。
+    # after（チャンネル ID → メッセージ ID）を渡すと、それより新しいメッセージを含む segment だけを読む
+    for checkpoint in archive.list_channels(guild_id):
+        if channels is not None and checkpoint['id'] not in channels:
+            continue
+        for msg in archive.iter_messages(guild_id, checkpoint['id'], (after or {}).get(checkpoint['id'])):
+            for a in msg.get('attachments') or []:
+                yield f"attachment:{a['id']}", a.get('url')
+
+
+@dataclass
+class UploadReport:
+    emojis: int = 0
+    stickers: int = 0
+    role_icons: int = 0
+    guild: int = 0
+    skipped: int = 0
+    missing: list = field(default_factory=list)
+
+    def summary(self) -> str:
+        text = (f'アセット復元: 絵文字 {self.emojis} 件・スタンプ {self.stickers} 件・ロールアイコン {self.role_icons} 件'
+                f'・アイコン/バナー {self.guild} 件（既存 {self.skipped} 件はスキップ）')
+        if self.missing:
+            text += f'・手元に無いアセット {len(self.missing)} 件'
+        return text
+
+
+async def restore_assets(guild: discord.Guild, entries: list, store: AssetStore, executor, progress=None,
+                         idmap=None) -> UploadReport:
+    # 既にあるもの（同名の絵文字・スタンプ）は作らない。アップロードは executor のバケットで絞る。
+    # ロール（絵文字を使えるロール・ロールアイコン）は元の ID から ID 対応表（idmap）で引く
+    report = UploadReport()
+
+    async def _load(key):
+        if not key:
+            return None
+        data = await run_io(store.get_key, key)
+        if data is None:
+            report.missing.append(key)
+        return data
+
+    by_type: dict[str, list] = {}
+    for entry in entries or []:
+        by_type.setdefault(entry.get('type'), []).append(entry)
+
+    # アイコン・バナーは 1 回の編集にまとめる
+    fields = {}
+    for name in ('icon', 'banner'):
+        if not by_type.get(name) or (name == 'banner' and 'BANNER' not in guild.features):
+            continue
+        data = await _load(by_type[name][0].get('asset'))
+        if data is not None:
+            fields[name] = data
+    if fields:
+        try:
+            await executor.run(ROUTE_GUILD_EDIT, lambda: guild.edit(**fields), 'guild')
+            report.guild += len(fields)
+        except Exception:
+            pass
+
+    if progress is not None:
+        await progress(f'😀 絵文字・スタンプを復元中…（{len(by_type.get("emoji", []))} / {len(by_type.get("sticker", []))} 件）')
+
+    existing = {e.name for e in guild.emojis}
+    roles_by_name = {r.name: r for r in guild.roles}
+
+    def _role(old_id, name):
+        if old_id is None:
+            # ID を持たない古いスナップショットだけ名前で引く
+            return roles_by_name.get(name)
+        new_id = idmap.get('roles', old_id) if idmap is not None else None
+        return guild.get_role(int(new_id or old_id))
+
+    async def _emoji(entry):
+        if entry['name'] in existing:
+            report.skipped += 1
+            return
+        data = await _load(entry.get('asset'))
+        if data is None:
+            return
+        if 'role_ids' in entry:
+            emoji_roles = [_role(old_id, None) for old_id in entry['role_ids']]
+        else:
+            emoji_roles = [_role(None, name) for name in entry.get('roles') or []]
+        emoji_roles = [r for r in emoji_roles if r is not None]
+        await executor.run(ROUTE_EMOJI_CREATE, lambda: guild.create_custom_emoji(
+            name=entry['name'], image=data, roles=emoji_roles or discord.utils.MISSING), f":{entry['name']}:")
+        report.emojis += 1
+
+    existing_stickers = {s.name for s in guild.stickers}
+
+    async def _sticker(entry):
+        if entry['name'] in existing_stickers:
+            report.skipped += 1
+            return
+        data = await _load(entry.get('asset'))
+        if data is None:
+            return
+        ext = 'json' if entry.get('format') == 'lottie' else ('gif' if entry.get('format') == 'gif' else 'png')
+        await executor.run(ROUTE_STICKER_CREATE, lambda: guild.create_sticker(
+            name=entry['name'], description=entry.get('description') or '', emoji=entry.get('emoji') or '⭐',
+            file=discord.File(io.BytesIO(data), filename=f"{entry['name']}.{ext}")), entry['name'])
+        report.stickers += 1
+
+    async def _role_icon(entry):
+        name = entry['name']
+        role = _role(entry.get('id'), name)
+        if role is None or 'ROLE_ICONS' not in guild.features or role.display_icon is not None:
+            report.skipped += role is not None
+            return
+        data = await _load(entry.get('asset'))
+        if data is None:
+            return
+        await executor.run(ROUTE_ROLE_EDIT, lambda: role.edit(display_icon=data), f'@{name}')
+        report.role_icons += 1
+
+    jobs = [_emoji(e) for e in by_type.get('emoji', [])]
+    jobs += [_sticker(e) for e in by_type.get('sticker', [])]
+    jobs += [_role_icon(e) for e in by_type.get('role_icon', [])]
+    # 失敗は executor.failures に記録される
+    await asyncio.gather(*jobs, return_exceptions=True)
+    return report
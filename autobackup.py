@@ -0,0 +1,233 @@
+import asyncio
+import collections
+import os
+import time
+
+import discord
+from discord.ext import tasks
+
+from codec import OverwriteCodec
+from metrics import api_metrics
+from serialize import SERIALIZERS
+from shards import ShardQueues
+from snapshot import SECTIONS
+from store import run_io, section_digest
+
+# ゲートウェイのイベントから「どのセクションが変わったか」を記録し、
+# 定期バックアップでは変わったセクションだけを直列化し直す（他は前回のオブジェクトを参照する）。
+
+INTERVAL_MINUTES = float(os.getenv('AUTO_BACKUP_INTERVAL_MINUTES', '60'))
+BUSY_THRESHOLD = int(os.getenv('AUTO_BACKUP_BUSY_THRESHOLD', '20'))
+QUIET_SECONDS = float(os.getenv('AUTO_BACKUP_QUIET_SECONDS', '60'))
+
+CHANNEL_SECTIONS = ('categories', 'text', 'forum', 'voice')
+
+
+def _channel_section(ch) -> str | None:
+    if isinstance(ch, discord.CategoryChannel):
+        return 'categories'
+    if isinstance(ch, discord.ForumChannel):
+        return 'forum'
+    if isinstance(ch, discord.VoiceChannel):
+        return 'voice'
+    if isinstance(ch, discord.TextChannel):
+        return 'text'
+    return None
+
+
+class ChangeJournal:
+    def __init__(self, maxlen: int = 500):
+        self.maxlen = maxlen
+        self.dirty: dict[int, set] = {}
+        self.entries: dict[int, collections.deque] = {}
+        self.last_change: dict[int, float] = {}
+
+    def record(self, guild_id: int, sections, event: str, obj=None):
+        sections = set(sections)
+        if not sections:
+            return
+        self.dirty.setdefault(guild_id, set()).update(sections)
+        log = self.entries.setdefault(guild_id, collections.deque(maxlen=self.maxlen))
+        log.append({
+            't': time.time(),
+            'event': event,
+            'sections': sorted(sections),
+            'id': str(getattr(obj, 'id', '')) or None,
+            'name': getattr(obj, 'name', None),
+        })
+        self.last_change[guild_id] = time.monotonic()
+
+    def pending(self, guild_id: int) -> set:
+        return set(self.dirty.get(guild_id, ()))
+
+    def changes(self, guild_id: int) -> int:
+        return len(self.entries.get(guild_id, ()))
+
+    def take(self, guild_id: int) -> tuple[set, list]:
+        sections = self.dirty.pop(guild_id, set())
+        entries = list(self.entries.pop(guild_id, ()))
+        return sections, entries
+
+    def restore(self, guild_id: int, sections: set, entries: list):
+        # スナップショットに失敗したときに取り出した変更を戻す
+        self.dirty.setdefault(guild_id, set()).update(sections)
+        log = self.entries.setdefault(guild_id, collections.deque(maxlen=self.maxlen))
+        log.extendleft(reversed(entries))
+
+
+async def take_snapshot(store, guild: discord.Guild, sections=None, base: dict | None = None, meta: dict | None = None) -> dict:
+    # sections が None なら全セクション、それ以外は指定セクションだけ直列化し、残りは base から引き継ぐ
+    snap = store.writer(guild.id, meta=dict(meta or {}, guild_id=guild.id, guild_name=guild.name))
+    codec = OverwriteCodec()
+    try:
+        for name in SECTIONS:
+            if sections is None or base is None or name in sections or name not in base['sections']:
+                await run_io(snap.add, name, SERIALIZERS[name](guild, codec))
+            else:
+                await run_io(snap.link, name, base['sections'][name])
+        # assets などの追加セクションは手動バックアップでしか作らないので、前回のものを引き継ぐ
+        for name, entry in (base or {}).get('sections', {}).items():
+            if name not in SECTIONS:
+                await run_io(snap.link, name, entry)
+        entry = await run_io(snap.close)
+    except Exception:
+        snap.abort()
+        raise
+    await run_io(store.apply_retention, guild.id)
+    return entry
+
+
+class AutoBackup:
+    def __init__(self, bot, store, interval_minutes: float = INTERVAL_MINUTES,
+                 busy_threshold: int = BUSY_THRESHOLD, quiet_seconds: float = QUIET_SECONDS):
+        self.bot = bot
+        self.store = store
+        self.interval_minutes = interval_minutes
+        self.busy_threshold = busy_threshold
+        self.quiet_seconds = quiet_seconds
+        self.journal = ChangeJournal()
+        self.stats = {'full': 0, 'incremental': 0, 'skipped': 0, 'failed': 0}
+        # 起動後に前回のスナップショットと突き合わせたギルド。まだのギルドは停止中の変更が分からないので、
+        # 初回は最新のスナップショットと比べて変わったセクションを求める（_seed）
+        self._primed: set[int] = set()
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._flushes: dict[int, asyncio.Task] = {}
+        # 定期バックアップはシャードごとのキューで処理する（このプロセスが受け持つシャードのギルドだけが来る）
+        self.queues = ShardQueues(lambda guild: self.backup_guild(guild, trigger='scheduled'))
+        self.loop = tasks.loop(minutes=interval_minutes)(self._tick) if interval_minutes > 0 else None
+
+        for name in ('on_guild_channel_create', 'on_guild_channel_delete', 'on_guild_channel_update',
+                     'on_guild_role_create', 'on_guild_role_delete', 'on_guild_role_update'):
+            bot.add_listener(getattr(self, name), name)
+
+    def start(self):
+        if self.loop is not None and not self.loop.is_running():
+            self.loop.start()
+
+    def lock(self, guild_id: int) -> asyncio.Lock:
+        lock = self._locks.get(guild_id)
+        if lock is None:
+            lock = self._locks[guild_id] = asyncio.Lock()
+        return lock
+
+    # --- イベント ---
+
+    def _record(self, guild: discord.Guild, sections, event: str, obj=None):
+        self.journal.record(guild.id, sections, event, obj)
+        if self.busy_threshold > 0 and self.journal.changes(guild.id) >= self.busy_threshold:
+            self._schedule_flush(guild)
+
+    async def on_guild_channel_create(self, channel):
+        self._record(channel.guild, [s for s in (_channel_section(channel),) if s], 'channel_create', channel)
+
+    async def on_guild_channel_delete(self, channel):
+        self._record(channel.guild, [s for s in (_channel_section(channel),) if s], 'channel_delete', channel)
+
+    async def on_guild_channel_update(self, before, after):
+        sections = {s for s in (_channel_section(before), _channel_section(after)) if s}
+        # カテゴリ名は配下チャンネルの 'category' に入っているので、改名時は全チャンネルが変わる
+        if isinstance(after, discord.CategoryChannel) and before.name != after.name:
+            sections.update(CHANNEL_SECTIONS)
+        self._record(after.guild, sections, 'channel_update', after)
+
+    async def on_guild_role_create(self, role):
+        self._record(role.guild, ['roles'], 'role_create', role)
+
+    async def on_guild_role_delete(self, role):
+        # 削除されたロール宛ての上書きはチャンネル側からも消える（上書きはロール ID で保存しているので改名は影響しない）
+        self._record(role.guild, ('roles',) + CHANNEL_SECTIONS, 'role_delete', role)
+
+    async def on_guild_role_update(self, before, after):
+        self._record(after.guild, ('roles',), 'role_update', after)
+
+    # --- スナップショット ---
+
+    def _schedule_flush(self, guild: discord.Guild):
+        task = self._flushes.get(guild.id)
+        if task is not None and not task.done():
+            return
+        self._flushes[guild.id] = asyncio.create_task(self._flush_when_quiet(guild))
+
+    async def _flush_when_quiet(self, guild: discord.Guild):
+        # 変更が続いている間は待ち、quiet_seconds 静かになったら増分スナップショットを取る
+        while True:
+            last = self.journal.last_change.get(guild.id, 0.0)
+            wait = last + self.quiet_seconds - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        try:
+            await self.backup_guild(guild, trigger='events')
+        except Exception:
+            # 失敗は backup_guild が stats と /metrics（auto_backup_errors_total）に記録済み。変更はジャーナルに戻してあり次の回に取る
+            pass
+
+    async def _tick(self):
+        # 前回の分がまだ処理待ちのギルドは積み直さない
+        for guild in list(self.bot.guilds):
+            self.queues.submit(guild)
+
+    def claim(self, guild_id: int) -> list:
+        # 手動の全体バックアップを取る直前に呼ぶ。それまでの変更はそのスナップショットに含まれる
+        self._primed.add(guild_id)
+        return self.journal.take(guild_id)[1]
+
+    async def _seed(self, guild: discord.Guild, base: dict) -> set:
+        # キャッシュから直列化したものを最新のスナップショットのオブジェクトと比べ、違うセクションを返す
+        # （再起動のたびに全ギルドの全セクションを取り直さない。直列化はキャッシュだけで REST は使わない）
+        codec = OverwriteCodec()
+        changed = set()
+        for name in SECTIONS:
+            entry = base['sections'].get(name)
+            items = SERIALIZERS[name](guild, codec)
+            if entry is None or await run_io(section_digest, items) != entry['object']:
+                changed.add(name)
+        return changed
+
+    def _count(self, trigger: str, result: str, error: BaseException | None = None):
+        self.stats[result] += 1
+        api_metrics.auto_backup(trigger, result, error)
+
+    async def backup_guild(self, guild: discord.Guild, trigger: str = 'scheduled') -> dict | None:
+        async with self.lock(guild.id):
+            base = await run_io(self.store.latest, guild.id)
+            sections, entries = self.journal.take(guild.id)
+            full = base is None
+            try:
+                if not full and guild.id not in self._primed:
+                    sections |= await self._seed(guild, base)
+                if not full and not sections:
+                    self._primed.add(guild.id)
+                    self._count(trigger, 'skipped')
+                    return None
+                meta = {'trigger': trigger, 'changes': entries[-100:]}
+                if not full:
+                    meta['incremental'] = sorted(sections)
+                entry = await take_snapshot(self.store, guild, None if full else sections, base, meta)
+            except Exception as e:
+                self._count(trigger, 'failed', e)
+                self.journal.restore(guild.id, sections, entries)
+                raise
+            self._primed.add(guild.id)
+            self._count(trigger, 'full' if full else 'incremental')
+            return entry
@@ -0,0 +1,665 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+import aiohttp
+import discord
+import yarl
+from discord.gateway import DiscordWebSocket
+from discord.http import HTTPClient, Route
+
+from codec import OverwriteCodec, CategoryRecord, TextRecord, VoiceRecord
+from archive import MessageArchive
+from assets import AssetDownloader, AssetStore
+from mock_discord import CATEGORY, FORUM, TEXT, VOICE, MockCDN, MockDiscord
+from ratelimit import RestoreExecutor, ROUTE_CHANNEL_CREATE, ROUTE_ROLE_CREATE
+from metrics import LoopLagMonitor
+from replay import ChannelTarget, ReplayJournal, replay_all
+from store import SnapshotStore, run_io
+from snapshot import LEGACY_FILES, SnapshotReader, load_legacy, write_snapshot, zstandard
+
+GUILD_ID = 1
+
+
+async def _client(base_url: str) -> HTTPClient:
+    Route.BASE = base_url
+    http = HTTPClient(asyncio.get_running_loop())
+    await http.static_login('mock-token')
+    return http
+
+
+async def _sequential(http: HTTPClient, channels: int, roles: int):
+    for i in range(roles):
+        await http.create_role(GUILD_ID, name=f'role-{i}')
+    for i in range(channels):
+        await http.create_channel(GUILD_ID, 0, name=f'text-{i}')
+
+
+async def _concurrent(http: HTTPClient, channels: int, roles: int, concurrency: int):
+    executor = RestoreExecutor(concurrency=concurrency)
+    await asyncio.gather(
+        executor.run_all(ROUTE_ROLE_CREATE, [
+            (f'role-{i}', lambda i=i: http.create_role(GUILD_ID, name=f'role-{i}')) for i in range(roles)
+        ]),
+        executor.run_all(ROUTE_CHANNEL_CREATE, [
+            (f'text-{i}', lambda i=i: http.create_channel(GUILD_ID, 0, name=f'text-{i}')) for i in range(channels)
+        ]),
+    )
+    return executor
+
+
+async def bench_restore(args):
+    mock = MockDiscord(bucket_limit=args.bucket_limit, bucket_window=args.bucket_window, latency=args.latency)
+    base_url = await mock.start()
+    try:
+        for label in ('sequential', 'concurrent'):
+            mock.reset_stats()
+            http = await _client(base_url)
+            try:
+                start = time.perf_counter()
+                if label == 'sequential':
+                    await _sequential(http, args.channels, args.roles)
+                else:
+                    await _concurrent(http, args.channels, args.roles, args.concurrency)
+                elapsed = time.perf_counter() - start
+            finally:
+                await http.close()
+            print(f'{label:<11} wall={elapsed:7.2f}s requests={mock.requests:5d} 429={mock.rate_limited:4d}')
+    finally:
+        await mock.stop()
+
+
+def synthetic_backup(channels: int, roles: int = 250, seed: int = 0) -> dict:
+    # 実際の backup_slash と同じ形のデータを作る。上書きは少数のパターンを使い回す
+    rng = random.Random(seed)
+    role_names = [f'role-{i}' for i in range(roles)]
+    patterns = [
+        {'target_type': 'role', 'allow': rng.getrandbits(40), 'deny': rng.getrandbits(40)}
+        for _ in range(16)
+    ]
+
+    def overwrites():
+        return {rng.choice(role_names): dict(rng.choice(patterns)) for _ in range(rng.randint(0, 4))}
+
+    n_cat = max(1, channels // 50)
+    data = {
+        'roles': [
+            {'name': name, 'color': rng.getrandbits(24), 'hoist': rng.random() < 0.2, 'mentionable': False,
+             'permissions': rng.getrandbits(40), 'position': i + 1}
+            for i, name in enumerate(role_names)
+        ],
+        'categories': [{'name': f'category-{i}', 'position': i, 'overwrites': overwrites()} for i in range(n_cat)],
+        'text': [],
+        'forum': [],
+        'voice': [],
+    }
+    for i in range(channels):
+        cat = f'category-{i % n_cat}'
+        kind = rng.random()
+        if kind < 0.7:
+            data['text'].append({'name': f'text-{i}', 'category': cat, 'position': i, 'nsfw': False,
+                                 'topic': f'topic for channel {i}', 'slowmode_delay': 0, 'overwrites': overwrites()})
+        elif kind < 0.8:
+            data['forum'].append({'name': f'forum-{i}', 'category': cat, 'position': i, 'nsfw': False, 'topic': None,
+                                  'default_thread_slowmode_delay': 0, 'default_reaction_emoji': None,
+                                  'default_layout': 'list_view', 'default_sort_order': None, 'overwrites': overwrites(),
+                                  'available_tags': [{'name': f'tag-{t}', 'emoji': None, 'moderated': False} for t in range(3)]})
+        else:
+            data['voice'].append({'name': f'voice-{i}', 'category': cat, 'position': i, 'bitrate': 64000,
+                                  'user_limit': 0, 'overwrites': overwrites()})
+    return data
+
+
+def _timed(func, repeat: int = 5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def bench_snapshot(args):
+    data = synthetic_backup(args.channels)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, filename in LEGACY_FILES.items():
+            with open(os.path.join(tmp, filename), 'w', encoding='utf-8') as f:
+                json.dump(data[name], f, ensure_ascii=False, indent=2)
+        legacy_size = sum(os.path.getsize(os.path.join(tmp, f)) for f in LEGACY_FILES.values())
+        legacy_load = _timed(lambda: load_legacy(tmp))
+        print(f'legacy 5 files   size={legacy_size / 1024:9.1f} KiB  load={legacy_load * 1000:8.1f} ms')
+
+        for codec in ('gzip', 'zstd'):
+            if codec == 'zstd' and zstandard is None:
+                print('zstd             (zstandard 未インストールのためスキップ)')
+                continue
+            path = os.path.join(tmp, f'snapshot.{codec}.dbak')
+            write = _timed(lambda: write_snapshot(path, data, codec=codec), repeat=1)
+            reader = SnapshotReader(path)
+            load = _timed(lambda: reader.load())
+            roles_only = _timed(lambda: reader.read_section('roles'))
+            verify = _timed(lambda: reader.verify())
+            print(f'snapshot {codec:<7} size={os.path.getsize(path) / 1024:9.1f} KiB  load={load * 1000:8.1f} ms  '
+                  f'roles only={roles_only * 1000:6.1f} ms  verify={verify * 1000:6.1f} ms  write={write * 1000:7.1f} ms')
+
+
+async def bench_looplag(args):
+    # 同じバックアップ（保存 → 読み込み）をループ上で同期実行した場合とスレッドプールへ逃がした場合で、
+    # イベントループの遅延（= ゲートウェイのハートビートが止まる時間）を比べる
+    data = synthetic_backup(args.channels)
+    monitor = LoopLagMonitor(interval=0.01).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ('blocking', 'off-loop'):
+            store = SnapshotStore(os.path.join(tmp, label))
+            await asyncio.sleep(0.1)
+            mark = monitor.mark()
+            start = time.perf_counter()
+            for guild_id in range(args.guilds):
+                sections = dict(data, roles=data['roles'] + [{'name': f'guild-{guild_id}'}])
+                if label == 'blocking':
+                    store.add_snapshot(guild_id, sections)
+                    store.load(guild_id)
+                else:
+                    await run_io(store.add_snapshot, guild_id, sections)
+                    await run_io(store.load, guild_id)
+                await asyncio.sleep(0)
+            elapsed = time.perf_counter() - start
+            await asyncio.sleep(0.05)
+            stats = monitor.stats(mark)
+            print(f'{label:<9} wall={elapsed:6.2f}s  loop lag max={stats["max"] * 1000:7.1f} ms  '
+                  f'p99={stats["p99"] * 1000:7.1f} ms  samples={stats["samples"]}')
+    monitor.stop()
+
+
+async def bench_snapdiff(args):
+    # 1 万チャンネルのスナップショット 2 つの差分。索引あり・索引の作り直し・全件読み込みで比べる
+    data = synthetic_backup(args.channels)
+    ids = iter(range(10 ** 17, 10 ** 18))
+    for items in data.values():
+        for item in items:
+            item['id'] = next(ids)
+    after = json.loads(json.dumps(data))
+    rng = random.Random(1)
+    for item in rng.sample(after['text'], args.changes):
+        item['topic'] = 'changed'
+        for perm in item['overwrites'].values():
+            perm['allow'] ^= 1 << rng.randrange(40)
+    after['roles'][0]['permissions'] ^= 1 << 3
+    after['text'].append(dict(after['text'][0], id=next(ids), name='added'))
+    del after['voice'][0]
+    if args.shift:
+        # 先頭に 1 件挿入して後ろ全部の位置がずれた状態
+        for item in after['text']:
+            item['position'] += 1
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SnapshotStore(tmp)
+        a = store.add_snapshot(GUILD_ID, data)['id']
+        b = store.add_snapshot(GUILD_ID, after)['id']
+        indexed = _timed(lambda: store.diff(GUILD_ID, a, b))
+        diff = store.diff(GUILD_ID, a, b)
+
+        def rebuilt():
+            shutil.rmtree(store.indexes_dir, ignore_errors=True)
+            store.diff(GUILD_ID, a, b)
+
+        rebuild = _timed(rebuilt, repeat=3)
+        full = _timed(lambda: (store.load(GUILD_ID, a), store.load(GUILD_ID, b)), repeat=3)
+    print(diff.summary())
+    print(f'indexed={indexed * 1000:7.1f} ms  (deep compared {diff.deep_compared})  '
+          f'rebuild index={rebuild * 1000:7.1f} ms  load both snapshots={full * 1000:7.1f} ms')
+
+
+def _synthetic_guild(data: dict) -> dict:
+    # synthetic_backup と同じ内容を discord.py のオブジェクト（ロール・上書き）で組み立て直す
+    guild = SimpleNamespace(id=0)
+    roles = {
+        r['name']: discord.Role(guild=guild, state=None, data={
+            'id': (i + 1) << 22, 'name': r['name'], 'permissions': str(r['permissions']), 'position': r['position'],
+            'color': r['color'], 'hoist': r['hoist'], 'managed': False, 'mentionable': False,
+        })
+        for i, r in enumerate(data['roles'])
+    }
+
+    def overwrites(stored):
+        return {
+            roles[name]: discord.PermissionOverwrite.from_pair(discord.Permissions(p['allow']), discord.Permissions(p['deny']))
+            for name, p in stored.items()
+        }
+
+    channels = {}
+    category_ids = {c['name']: (i + 1) << 32 for i, c in enumerate(data['categories'])}
+    for section in ('categories', 'text', 'voice'):
+        channels[section] = [
+            SimpleNamespace(**dict(item, id=((i + 1) << 24) + len(channels),
+                                   category=SimpleNamespace(name=item['category']) if item.get('category') else None,
+                                   category_id=category_ids.get(item.get('category')),
+                                   overwrites=overwrites(item['overwrites'])))
+            for i, item in enumerate(data[section])
+        ]
+    return roles, channels
+
+
+def _legacy_encode(overwrites) -> dict:
+    # 共通化前の backup_slash と同じ書き方（pair() を 2 回呼び、毎回 dict を作る）
+    out = {}
+    for target, perm in overwrites.items():
+        if isinstance(target, discord.Role):
+            key = target.name
+            ttype = 'role'
+        else:
+            key = str(target.id)
+            ttype = 'member'
+        out[key] = {'target_type': ttype, 'allow': perm.pair()[0].value, 'deny': perm.pair()[1].value}
+    return out
+
+
+def _legacy_decode(stored: dict, roles: dict) -> dict:
+    out = {}
+    for key, perm in stored.items():
+        target = roles.get(key)
+        if target is None:
+            continue
+        out[target] = discord.PermissionOverwrite.from_pair(
+            discord.Permissions(int(perm.get('allow', 0))), discord.Permissions(int(perm.get('deny', 0))))
+    return out
+
+
+async def bench_codec(args):
+    data = synthetic_backup(args.channels)
+    roles, channels = _synthetic_guild(data)
+    records = {'categories': CategoryRecord, 'text': TextRecord, 'voice': VoiceRecord}
+    stored = [item['overwrites'] for section in records for item in data[section]]
+    n = sum(len(items) for items in channels.values())
+
+    def legacy_serialize():
+        for section, items in channels.items():
+            for ch in items:
+                _legacy_encode(ch.overwrites)
+
+    def codec_serialize():
+        codec = OverwriteCodec()
+        for section, items in channels.items():
+            for ch in items:
+                records[section].from_channel(ch, codec).to_dict()
+
+    def legacy_deserialize():
+        for item in stored:
+            _legacy_decode(item, roles)
+
+    async def codec_deserialize():
+        codec = OverwriteCodec()
+        for item in stored:
+            await codec.decode(item, roles, None)
+
+    results = [(label, _timed(func)) for label, func in (
+        ('legacy serialize', legacy_serialize), ('codec serialize', codec_serialize), ('legacy deserialize', legacy_deserialize))]
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        await codec_deserialize()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    results.append(('codec deserialize', best))
+    for label, elapsed in results:
+        print(f'{label:<19} {elapsed * 1000:8.1f} ms  {n / elapsed:10.0f} channels/s')
+    codec = OverwriteCodec()
+    for item in stored:
+        codec.normalize(item)
+    print(f'overwrite entries={sum(len(item) for item in stored)} distinct pairs={codec.stats()["encoded"]}')
+
+
+async def bench_assets(args):
+    # 同じ画像を複数チャンネルで使い回している想定：ユニークなファイルは unique 個、参照は items 個
+    rng = random.Random(0)
+    fixtures = {f'files/{i}.png': rng.randbytes(args.size) for i in range(args.unique)}
+    names = list(fixtures)
+    cdn = MockCDN(fixtures, latency=args.latency, flaky=args.flaky)
+    await cdn.start()
+    items = [(f'attachment:{i}', cdn.url(f'{rng.choice(names)}?ex={i}')) for i in range(args.items)]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = AssetStore(tmp)
+            for label, concurrency in (('sequential', 1), ('pooled', args.concurrency), ('re-run', args.concurrency)):
+                if label != 're-run':
+                    store = AssetStore(os.path.join(tmp, label))
+                cdn.requests = 0
+                async with AssetDownloader(store, concurrency=concurrency) as downloader:
+                    report = await downloader.fetch_all(items)
+                stored = sum(len(files) for _, _, files in os.walk(store.root)) - 1
+                print(f'{label:<10} wall={report.elapsed:6.2f}s  requests={cdn.requests:5d}  downloaded={report.downloaded:5d}  '
+                      f'cached={report.cached:5d}  stored files={stored:4d}  failed={len(report.failures)}')
+    finally:
+        await cdn.stop()
+
+
+def _synthetic_archive(root: str, channels: int, messages: int) -> MessageArchive:
+    archive = MessageArchive(root)
+    next_id = 1000
+    for c in range(channels):
+        batch = []
+        for m in range(messages):
+            next_id += 1
+            batch.append({'id': next_id, 'type': 'default', 'content': f'message {m} in channel {c}',
+                          'author': {'id': m % 7, 'name': f'user{m % 7}', 'display_name': f'User {m % 7}',
+                                     'avatar': None, 'bot': False},
+                          'attachments': [], 'embeds': []})
+        archive.commit(GUILD_ID, {'id': c + 1, 'name': f'text-{c}', 'kind': 'text', 'category': None}, batch)
+    return archive
+
+
+async def bench_replay(args):
+    # 復元先チャンネルごとの Webhook（= 独立したバケット）にメッセージを流す。
+    # 逐次（キュー 1 本）と Webhook ごとの並列キュー、中断後の再実行（送信済みは送らない）を比べる
+    mock = MockDiscord(latency=args.latency, webhook_limit=args.webhook_limit, webhook_window=args.webhook_window)
+    base_url = await mock.start()
+    Route.BASE = base_url
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = _synthetic_archive(os.path.join(tmp, 'messages'), args.channels, args.messages)
+            sources = archive.list_channels(GUILD_ID)
+            async with aiohttp.ClientSession() as session:
+                for label, concurrency, journal_dir in (('sequential', 1, 'seq'), ('parallel', args.channels, 'par'),
+                                                        ('re-run', args.channels, 'par')):
+                    mock.reset_stats()
+                    journal = ReplayJournal(os.path.join(tmp, 'replay', journal_dir))
+                    targets = [ChannelTarget(source, discord.Webhook.partial(10 + i, f'token-{i}', session=session))
+                               for i, source in enumerate(sources)]
+                    report = await replay_all(archive, GUILD_ID, targets, journal, 2, concurrency=concurrency)
+                    print(f'{label:<10} wall={report.elapsed:6.2f}s  messages={report.messages:5d}  '
+                          f'{report.rate:6.1f} msg/s  requests={mock.requests:5d}  429={mock.rate_limited:4d}')
+    finally:
+        await mock.stop()
+
+
+def _seed_guild(mock: MockDiscord, data: dict, name: str):
+    # synthetic_backup と同じ構成をモックのギルドに作る（上書きのロール名は ID に置き換える）
+    guild = mock.add_guild(name)
+    role_ids = {
+        r['name']: guild.add_role(r['name'], color=r['color'], hoist=r['hoist'], permissions=r['permissions'],
+                                  position=r['position'])['id']
+        for r in data['roles']
+    }
+
+    def overwrites(stored):
+        return [{'id': role_ids[key], 'type': 0, 'allow': p['allow'], 'deny': p['deny']} for key, p in stored.items()]
+
+    category_ids = {
+        c['name']: guild.add_channel(c['name'], CATEGORY, position=c['position'],
+                                     permission_overwrites=overwrites(c['overwrites']))['id']
+        for c in data['categories']
+    }
+    for section, ctype in (('text', TEXT), ('forum', FORUM), ('voice', VOICE)):
+        for item in data[section]:
+            fields = {k: v for k, v in item.items() if k in ('position', 'nsfw', 'topic', 'bitrate', 'user_limit')}
+            if section == 'forum':
+                fields['available_tags'] = item['available_tags']
+            guild.add_channel(item['name'], ctype, parent_id=category_ids[item['category']],
+                              permission_overwrites=overwrites(item['overwrites']), **fields)
+    # コマンドを実行するチャンネル（一括削除でも残る）
+    control = guild.add_channel('bench-control', TEXT, position=len(guild.channels))
+    return guild, control
+
+
+def _structure(guild) -> collections.Counter:
+    # ID を除いたギルドの構成（種類・名前・カテゴリ・上書き）。復元後に元と比べる。
+    # 同じものが重複して作られた・足りないものも数えられるよう、集合ではなく個数で持つ
+    roles = {r['id']: r['name'] for r in guild.roles.values()}
+    names = {c['id']: c['name'] for c in guild.channels.values()}
+    structure = collections.Counter(
+        (c['type'], c['name'], names.get(c.get('parent_id')),
+         # synthetic_backup の allow/deny は重なることがあり、重なったビットは discord.py の上書きで deny になる
+         frozenset((roles.get(o['id'], o['id']), int(o['allow']) & ~int(o['deny']), int(o['deny']))
+                   for o in c['permission_overwrites']))
+        for c in guild.channels.values()
+    )
+    structure.update(('role', r['name'], int(r['permissions']), r['color']) for r in guild.roles.values())
+    return structure
+
+
+def _mismatched(expected: collections.Counter, actual: collections.Counter) -> int:
+    # 足りないもの + 余分なもの（重複を含む）
+    return sum((expected - actual).values()) + sum((actual - expected).values())
+
+
+class _CommandWaiter:
+    # スラッシュコマンドの終了（app_command_completion / tree.on_error）を interaction ID ごとに待つ
+    def __init__(self, client):
+        self.results: dict[int, BaseException | None] = {}
+        self._changed = asyncio.Condition()
+        client.add_listener(self._completed, 'on_app_command_completion')
+        client.tree.on_error = self._failed
+
+    async def _set(self, interaction_id: int, error):
+        async with self._changed:
+            self.results[interaction_id] = error
+            self._changed.notify_all()
+
+    async def _completed(self, interaction, command):
+        await self._set(interaction.id, None)
+
+    async def _failed(self, interaction, error):
+        await self._set(interaction.id, error)
+
+    async def wait(self, interaction_id: int, timeout: float):
+        async with self._changed:
+            await asyncio.wait_for(self._changed.wait_for(lambda: interaction_id in self.results), timeout)
+        error = self.results.pop(interaction_id)
+        if error is not None:
+            raise error
+
+
+def _button_enabled(message: dict, custom_id: str) -> bool:
+    return any(c.get('custom_id') == custom_id and not c.get('disabled')
+               for row in message.get('components') or () for c in row.get('components') or ())
+
+
+async def _measure(mock: MockDiscord, func) -> dict:
+    mock.reset_stats()
+    start = time.perf_counter()
+    await func()
+    return {'wall': round(time.perf_counter() - start, 3), 'requests': mock.requests, '429': mock.rate_limited,
+            'routes': dict(mock.routes)}
+
+
+def _regressions(results: list[dict], baseline: list[dict], tolerance: float, wall_tolerance: float) -> list[str]:
+    # リクエスト数・429 はほぼ決定的なので厳しめに、実時間はマシンの差があるので緩めに比べる
+    base = {(r['channels'], r['command']): r for r in baseline}
+    out = []
+    for r in results:
+        b = base.get((r['channels'], r['command']))
+        if b is None:
+            continue
+        for key, tol, slack in (('requests', tolerance, 0), ('429', tolerance, 2), ('wall', wall_tolerance, 0.5),
+                                ('mismatched', 0, 0)):
+            if key in r and r[key] > b.get(key, 0) * (1 + tol) + slack:
+                out.append(f"channels={r['channels']} {r['command']}: {key} {b[key]} → {r[key]}")
+    return out
+
+
+async def bench_e2e(args):
+    # モックの REST + ゲートウェイに bot.py の Bot をそのまま接続し、スラッシュコマンドを
+    # INTERACTION_CREATE で実行する。サイズごとに backup → nuke_all → restore → 部分復元 → 空のギルドへの複製を順に流し、
+    # リクエスト数・429・実時間を測る（--baseline で前回の結果と比べて悪化していれば終了コード 1）
+    tmp = tempfile.mkdtemp(prefix='bench-e2e-')
+    os.environ.update({
+        'BACKUP_DIR': tmp, 'GUILD_ID': '', 'OWNER_ID': '', 'SHARD_COUNT': '', 'SHARD_IDS': '', 'AUTO_SHARD': '0',
+        'AUTO_BACKUP_INTERVAL_MINUTES': '0', 'AUTO_BACKUP_BUSY_THRESHOLD': '0',
+        # 合成ギルドは Discord の上限（500 チャンネルなど）を超えるので、復元前の検証の上限を外す
+        'GUILD_MAX_CHANNELS': '100000', 'GUILD_MAX_CATEGORY_CHANNELS': '100000', 'GUILD_MAX_ROLES': '100000',
+    })
+    # 環境変数（バックアップの保存先など）を決めてから読み込む
+    import bot as bot_module
+    client = bot_module.bot
+
+    mock = MockDiscord(bucket_limit=args.bucket_limit, bucket_window=args.bucket_window, latency=args.latency)
+    base_url = await mock.start()
+    Route.BASE = base_url
+    DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(mock.gateway_url)
+    sizes = [int(n) for n in args.sizes.split(',')]
+    guilds = {}
+    for n in sizes:
+        data = synthetic_backup(n, roles=args.roles if args.roles is not None else n // 10 + 5)
+        guilds[n] = _seed_guild(mock, data, f'bench-{n}')
+        # /clone の複製先（コマンド用のチャンネルだけがある空のギルド）
+        empty = mock.add_guild(f'bench-{n}-clone')
+        guilds[n] += (empty, empty.add_channel('bench-control', TEXT, position=0))
+
+    waiter = _CommandWaiter(client)
+    results = []
+    connection = None
+    try:
+        await client.login('mock-token')
+        connection = asyncio.create_task(client.connect(reconnect=False))
+        await asyncio.wait_for(client.wait_until_ready(), 60)
+        # on_ready のコマンド同期が測定に混ざらないよう、終わるまで待つ
+        while 'commands_sync' not in mock.routes:
+            await asyncio.sleep(0.05)
+
+        for n in sizes:
+            guild, control, clone_guild, clone_control = guilds[n]
+
+            async def _slash(name, target=None, **options):
+                target_guild, target_control = target or (guild, control)
+                token = await mock.interact(target_guild.id, target_control['id'], name, **options)
+                await waiter.wait(int(mock.interactions[token]['id']), args.timeout)
+                return token
+
+            async def _nuke():
+                token = await _slash('nuke_all')
+                # ボタンが有効になる（5 秒後）まで待ってから押す。測るのは押してから完了までの時間
+                await mock.wait_message(lambda m: m['id'] == mock.interactions[token]['original']
+                                        and _button_enabled(m, 'nuke_confirm'), args.timeout)
+
+                async def _confirm():
+                    await mock.press(token, 'nuke_confirm')
+                    await mock.wait_message(lambda m: m['id'] == mock.interactions[token]['original']
+                                            and m['content'].startswith('🎉'), args.timeout)
+                return await _measure(mock, _confirm)
+
+            async def _partial():
+                # カテゴリ 1 つと配下を消してから、そのカテゴリだけを復元する（/restore categories:…）
+                target = next(c for c in guild.channels.values() if c['type'] == CATEGORY)
+                victims = [c for c in guild.channels.values() if c.get('parent_id') == target['id']] + [target]
+                await asyncio.gather(*(client.http.delete_channel(c['id']) for c in victims))
+                cached = client.get_guild(int(guild.id))
+                while any(cached.get_channel(int(c['id'])) is not None for c in victims):
+                    await asyncio.sleep(0.05)
+                return await _measure(mock, lambda: _slash('restore', categories=target['name']))
+
+            async def _clone():
+                # 元ギルドの構成を空のギルドへ（元を読みながら複製先の作成を進める）
+                return await _measure(mock, lambda: _slash('clone', (clone_guild, clone_control), source=guild.id))
+
+            seeded = len(guild.channels)
+            expected = _structure(guild)
+            for command, run in (('backup', lambda: _measure(mock, lambda: _slash('backup'))),
+                                 ('nuke_all', _nuke),
+                                 ('restore', lambda: _measure(mock, lambda: _slash('restore'))),
+                                 ('partial', _partial),
+                                 ('clone', _clone)):
+                result = dict(channels=n, command=command, **await run(), remaining=len(guild.channels))
+                if command in ('restore', 'partial'):
+                    result['mismatched'] = _mismatched(expected, _structure(guild))
+                elif command == 'clone':
+                    result['remaining'] = len(clone_guild.channels)
+                    result['mismatched'] = _mismatched(expected, _structure(clone_guild))
+                results.append(result)
+                print(f"channels={n:<5d} {command:<8} wall={result['wall']:7.2f}s requests={result['requests']:5d} "
+                      f"429={result['429']:4d} guild channels={result['remaining']}/{seeded}"
+                      + (f" mismatched={result['mismatched']}" if 'mismatched' in result else ''))
+    finally:
+        await client.close()
+        if connection is not None:
+            connection.cancel()
+        await mock.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = _regressions(results, baseline, args.tolerance, args.wall_tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ローカルのモック Discord に対するベンチマーク')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('restore', help='逐次作成と並列スケジューラの比較')
+    p.add_argument('--channels', type=int, default=400)
+    p.add_argument('--roles', type=int, default=50)
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--latency', type=float, default=0.15, help='1 リクエストあたりの遅延（秒）')
+    p.add_argument('--bucket-limit', type=int, default=10)
+    p.add_argument('--bucket-window', type=float, default=1.0)
+    p.set_defaults(func=bench_restore)
+
+    p = sub.add_parser('snapshot', help='旧形式とスナップショット形式のサイズ・読み込み時間の比較')
+    p.add_argument('--channels', type=int, default=10000)
+    p.set_defaults(func=bench_snapshot)
+
+    p = sub.add_parser('looplag', help='保存・読み込み中のイベントループ遅延の比較')
+    p.add_argument('--channels', type=int, default=10000)
+    p.add_argument('--guilds', type=int, default=3)
+    p.set_defaults(func=bench_looplag)
+
+    p = sub.add_parser('codec', help='権限上書きの直列化・復元のスループット比較')
+    p.add_argument('--channels', type=int, default=10000)
+    p.set_defaults(func=bench_codec)
+
+    p = sub.add_parser('snapdiff', help='スナップショット同士の差分（索引あり・なし）')
+    p.add_argument('--channels', type=int, default=10000)
+    p.add_argument('--changes', type=int, default=20, help='トピック・上書きを変えるチャンネル数')
+    p.add_argument('--shift', action='store_true', help='全テキストチャンネルの位置もずらす')
+    p.set_defaults(func=bench_snapdiff)
+
+    p = sub.add_parser('assets', help='アセットのダウンロード（ローカルのスタブ CDN）')
+    p.add_argument('--items', type=int, default=500, help='添付ファイルの件数')
+    p.add_argument('--unique', type=int, default=100, help='そのうち中身が異なるファイルの数')
+    p.add_argument('--size', type=int, default=64 * 1024)
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--latency', type=float, default=0.02)
+    p.add_argument('--flaky', type=float, default=0.1, help='最初の 1 回だけエラーを返すファイルの割合')
+    p.set_defaults(func=bench_assets)
+
+    p = sub.add_parser('replay', help='Webhook によるメッセージ再投稿のスループット')
+    p.add_argument('--channels', type=int, default=6)
+    p.add_argument('--messages', type=int, default=10, help='チャンネルあたりのメッセージ数')
+    p.add_argument('--latency', type=float, default=0.05)
+    p.add_argument('--webhook-limit', type=int, default=5)
+    p.add_argument('--webhook-window', type=float, default=2.0)
+    p.set_defaults(func=bench_replay)
+
+    p = sub.add_parser('e2e', help='bot.py のスラッシュコマンド（backup / nuke_all / restore / clone）をモック Discord で実行')
+    p.add_argument('--sizes', default='10,100,1000', help='ギルドのチャンネル数（カンマ区切り）')
+    p.add_argument('--roles', type=int, default=None, help='ロール数（省略時はチャンネル数 / 10 + 5）')
+    p.add_argument('--latency', type=float, default=0.02)
+    p.add_argument('--bucket-limit', type=int, default=50)
+    p.add_argument('--bucket-window', type=float, default=1.0)
+    p.add_argument('--timeout', type=float, default=600.0, help='1 コマンドあたりの待ち時間の上限（秒）')
+    p.add_argument('--json', help='結果を JSON で書き出すパス')
+    p.add_argument('--baseline', help='前回の --json の結果。悪化していれば終了コード 1')
+    p.add_argument('--tolerance', type=float, default=0.1, help='リクエスト数・429 の許容増加率')
+    p.add_argument('--wall-tolerance', type=float, default=0.5, help='実時間の許容増加率')
+    p.set_defaults(func=bench_e2e)
+
+    args = parser.parse_args()
+    discord.utils.setup_logging(level=40)
+    asyncio.run(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
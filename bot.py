@@ -1,50 +1,47 @@
 import os
-import json
 import asyncio
 from dotenv import load_dotenv
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 
-def _parse_reaction_emoji(s):
-    if not s:
-        return None
-    try:
-        return discord.PartialEmoji.from_str(s)
-    except Exception:
-        return s
-
-def _find_forum(guild: discord.Guild, name: str, category_name: str | None):
-    target_cat_id = None
-    if category_name:
-        cat = discord.utils.get(guild.categories, name=category_name)
-        target_cat_id = getattr(cat, 'id', None)
-    for ch in guild.channels:
-        if isinstance(ch, discord.ForumChannel) and ch.name == name:
-            if (target_cat_id is None and ch.category is None) or (ch.category and ch.category.id == target_cat_id):
-                return ch
-    return None
-
+# 下のモジュールは読み込んだ時点で環境変数（.env の設定）を読むので、先に .env を読む
 load_dotenv()
+
+from ratelimit import RestoreExecutor
+from selection import RestoreFilter
+from snapshot import SnapshotError
+from store import run_io
+from metrics import MetricsServer, api_metrics, loop_lag
+from nuke import collect_targets, nuke
+from progress import ProgressReporter
+from autobackup import AutoBackup
+from clone import clone_source_guild
+from jobs import backups, load_backup, pin_snapshot, plan_text, run_backup, run_clone, run_restore, source_guild
+from templates import export_template
+from shards import STATUS_INTERVAL, ShardStatusBoard, bot_options, build_intents, render_status, shard_status
+
 TOKEN = os.getenv('DISCORD_TOKEN')
 OWNER_ID = os.getenv('OWNER_ID')
 
-intents = discord.Intents.default()
-intents.guilds = True
 enable_members = os.getenv('ENABLE_MEMBERS_INTENT', '0').lower() in ('1', 'true', 'yes')
-intents.members = bool(enable_members)
-intents.message_content = False
+# メッセージ本文のアーカイブ（/backup messages:True）には Message Content Intent が必要
+enable_message_content = os.getenv('ENABLE_MESSAGE_CONTENT_INTENT', '0').lower() in ('1', 'true', 'yes')
+intents = build_intents(bool(enable_members), bool(enable_message_content))
 
-bot = commands.Bot(command_prefix=commands.when_mentioned, intents=intents)
+# SHARD_COUNT / SHARD_IDS / AUTO_SHARD を設定すると AutoShardedBot で起動する
+bot_cls, shard_options = bot_options(intents)
+# Discord API への全リクエストをルート別に計測する（METRICS_PORT を設定すると /metrics で公開）
+bot = bot_cls(command_prefix=commands.when_mentioned, intents=intents, http_trace=api_metrics.trace_config(),
+              **shard_options)
+metrics_server = MetricsServer(api_metrics)
 
-BACKUP_DIR = os.path.join(os.path.dirname(__file__), 'backup')
-ROLE_FILE = os.path.join(BACKUP_DIR, 'roles.json')
-TEXT_FILE = os.path.join(BACKUP_DIR, 'text_channels.json')
-VOICE_FILE = os.path.join(BACKUP_DIR, 'voice_channels.json')
-FORUM_FILE = os.path.join(BACKUP_DIR, 'forum_channels.json')
-CATEGORY_FILE = os.path.join(BACKUP_DIR, 'categories.json')
+auto_backup = AutoBackup(bot, backups().store)
+shard_board = ShardStatusBoard(os.path.join(backups().root, 'shards'))
 
-os.makedirs(BACKUP_DIR, exist_ok=True)
+@tasks.loop(seconds=STATUS_INTERVAL)
+async def publish_shard_status():
+    await run_io(shard_board.write, shard_status(bot, auto_backup.queues))
 
 def guild_only_and_owner():
     def predicate(ctx):
@@ -72,6 +69,14 @@ def app_guild_only_and_owner():
 
 @bot.event
 async def on_ready():
+    loop_lag.start()
+    auto_backup.start()
+    try:
+        await metrics_server.start()
+    except OSError as e:
+        print(f'Failed to start metrics server on port {metrics_server.port}: {e}')
+    if not publish_shard_status.is_running():
+        publish_shard_status.start()
     try:
         guild_id = os.getenv('GUILD_ID')
         if guild_id:
@@ -88,8 +93,20 @@ async def on_ready():
     description='サーバーのロール・チャンネル構成をバックアップします。',
     guild=discord.Object(id=int(os.getenv('GUILD_ID'))) if os.getenv('GUILD_ID') else None,
 )
+@app_commands.describe(
+    messages='チャンネル・スレッドのメッセージ履歴も保存します（2 回目以降は新しいメッセージだけ）',
+    assets='絵文字・スタンプ・アイコン・ロールアイコン（messages と併用で添付ファイルも）を保存します',
+    threads='スレッド・フォーラム投稿（アーカイブ済みを含む）の設定・タグ・最初のメッセージを保存します',
+    mode='ロール・チャンネルの読み方（既定: キャッシュを確かめ、欠けていれば REST で取得）',
+)
+@app_commands.choices(mode=[
+    app_commands.Choice(name='auto（キャッシュ優先・欠けていれば REST）', value='auto'),
+    app_commands.Choice(name='cache（キャッシュのみ・追加リクエストなし）', value='cache'),
+    app_commands.Choice(name='fetch（REST で取得してキャッシュと突き合わせ）', value='fetch'),
+])
 @app_guild_only_and_owner()
-async def backup_slash(interaction: discord.Interaction):
+async def backup_slash(interaction: discord.Interaction, messages: bool = False, assets: bool = False,
+                       threads: bool = False, mode: str | None = None):
     await interaction.response.defer(ephemeral=True)
 
     async def _progress(msg: str):
@@ -104,185 +121,80 @@ async def backup_slash(interaction: discord.Interaction):
     await _progress('🔄 バックアップ開始…')
 
     guild = interaction.guild
-
-    await _progress('🧩 ロールをバックアップ中…')
-    roles = []
-    for role in guild.roles:
-        if role.is_default():
-            continue
-        roles.append({
-            'name': role.name,
-            'color': role.color.value,
-            'hoist': role.hoist,
-            'mentionable': role.mentionable,
-            'permissions': role.permissions.value,
-            'position': role.position,
-        })
-    with open(ROLE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(roles, f, ensure_ascii=False, indent=2)
-    await _progress(f'✅ ロール {len(roles)} 件を保存。次：カテゴリ…')
-
-    await _progress('📁 カテゴリをバックアップ中…')
-
-    categories = []
-    for cat in guild.categories:
-        overwrites = {}
-        for target, perm in cat.overwrites.items():
-            if isinstance(target, discord.Role):
-                key = target.name
-                ttype = 'role'
-            else:
-                key = str(target.id)
-                ttype = 'member'
-            allow = perm.pair()[0].value
-            deny = perm.pair()[1].value
-            overwrites[key] = {
-                'target_type': ttype,
-                'allow': allow,
-                'deny': deny,
-            }
-        categories.append({
-            'name': cat.name,
-            'position': cat.position,
-            'overwrites': overwrites,
-        })
-    with open(CATEGORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(categories, f, ensure_ascii=False, indent=2)
-
-    await _progress(f'✅ カテゴリ {len(categories)} 件を保存。次：テキストチャンネル…')
-
-    await _progress('💬 テキストチャンネルをバックアップ中…')
-    text_channels = []
-    for ch in guild.text_channels:
-        # 特殊板を除外
-        if ch.name in ("moderator-only", "rules"):
-            continue
-        overwrites = {}
-        for target, perm in ch.overwrites.items():
-            key = None
-            ttype = None
-            if isinstance(target, discord.Role):
-                key = target.name
-                ttype = 'role'
-            else:
-                key = str(target.id)
-                ttype = 'member'
-            allow = perm.pair()[0].value
-            deny = perm.pair()[1].value
-            overwrites[key] = {
-                'target_type': ttype,
-                'allow': allow,
-                'deny': deny,
-            }
-        text_channels.append({
-            'name': ch.name,
-            'category': ch.category.name if ch.category else None,
-            'position': ch.position,
-            'nsfw': ch.nsfw,
-            'topic': ch.topic,
-            'slowmode_delay': ch.slowmode_delay,
-            'overwrites': overwrites,
-        })
-    with open(TEXT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(text_channels, f, ensure_ascii=False, indent=2)
-    await _progress(f'✅ テキストチャンネル {len(text_channels)} 件を保存。次：フォーラム…')
-
-    await _progress('📚 フォーラムをバックアップ中…')
-    forum_channels = []
-    for ch in guild.channels:
-        if isinstance(ch, discord.ForumChannel):
-            overwrites = {}
-            for target, perm in ch.overwrites.items():
-                if isinstance(target, discord.Role):
-                    key = target.name
-                    ttype = 'role'
-                else:
-                    key = str(getattr(target, 'id', target))
-                    ttype = 'member'
-                allow = perm.pair()[0].value
-                deny = perm.pair()[1].value
-                overwrites[key] = {
-                    'target_type': ttype,
-                    'allow': allow,
-                    'deny': deny,
-                }
-
-            tags = []
-            for t in getattr(ch, 'available_tags', []) or []:
-                try:
-                    emoji_str = str(t.emoji) if t.emoji else None
-                except Exception:
-                    emoji_str = None
-                tags.append({
-                    'name': t.name,
-                    'emoji': emoji_str,
-                    'moderated': getattr(t, 'moderated', False),
-                })
-
-            try:
-                default_reaction = str(ch.default_reaction_emoji) if ch.default_reaction_emoji else None
-            except Exception:
-                default_reaction = None
-
-            forum_channels.append({
-                'name': ch.name,
-                'category': ch.category.name if ch.category else None,
-                'position': ch.position,
-                'nsfw': ch.nsfw,
-                'topic': getattr(ch, 'topic', None),
-                'default_thread_slowmode_delay': getattr(ch, 'default_thread_slowmode_delay', None),
-                'default_reaction_emoji': default_reaction,
-                'default_layout': getattr(ch.default_layout, 'name', None) if getattr(ch, 'default_layout', None) else None,
-                'default_sort_order': getattr(ch.default_sort_order, 'name', None) if getattr(ch, 'default_sort_order', None) else None,
-                'overwrites': overwrites,
-                'available_tags': tags,
-            })
-    with open(FORUM_FILE, 'w', encoding='utf-8') as f:
-        json.dump(forum_channels, f, ensure_ascii=False, indent=2)
-    await _progress(f'✅ フォーラム {len(forum_channels)} 件を保存。次：ボイスチャンネル…')
-
-    await _progress('🔈 ボイスチャンネルをバックアップ中…')
-    # Voice channels
-    voice_channels = []
-    for ch in guild.voice_channels:
-        overwrites = {}
-        for target, perm in ch.overwrites.items():
-            if isinstance(target, discord.Role):
-                key = target.name
-                ttype = 'role'
-            else:
-                key = str(target.id)
-                ttype = 'member'
-            overwrites[key] = {
-                'target_type': ttype,
-                'allow': perm.pair()[0].value,
-                'deny': perm.pair()[1].value,
-            }
-        voice_channels.append({
-            'name': ch.name,
-            'category': ch.category.name if ch.category else None,
-            'position': ch.position,
-            'bitrate': ch.bitrate,
-            'user_limit': ch.user_limit,
-            'overwrites': overwrites,
-        })
-    with open(VOICE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(voice_channels, f, ensure_ascii=False, indent=2)
-
-    await _progress(f'🎉 バックアップ完了。ロール {len(roles)} 件・カテゴリ {len(categories)} 件・テキスト {len(text_channels)} 件・ボイス {len(voice_channels)} 件を保存しました。')
+    changes = auto_backup.claim(guild.id)
+    await _progress(await run_backup(guild, _progress, messages=messages, assets=assets, threads=threads,
+                                     changes=changes, mode=mode, intents=bot.intents))
     # 追加でログを残したい場合は下記をコメント解除
     # await interaction.followup.send('バックアップ完了（詳細は上の進行メッセージ参照）', ephemeral=True)
 
+async def _open_status(channel, run) -> discord.Message | None:
+    # 進捗はチャンネルのメッセージを Bot のトークンで編集して表示する
+    # （interaction のトークンは 15 分で切れるので、長い復元では途中から更新できなくなる）
+    if run.status:
+        target = bot.get_channel(run.status['channel_id'])
+        if target is not None:
+            try:
+                return await target.get_partial_message(run.status['message_id']).edit(content='🔄 復元を再開します…')
+            except discord.HTTPException:
+                pass
+    if channel is None:
+        return None
+    try:
+        message = await channel.send('🔄 復元開始…')
+    except discord.HTTPException:
+        return None
+    await run_io(run.set_status, message.channel.id, message.id)
+    return message
+
+async def _can_manage(guild: discord.Guild, user_id: int) -> bool:
+    # 別ギルドを操作するとき。OWNER_ID が無ければ、実行した人がそのギルドでサーバー管理の権限を持っていること
+    if OWNER_ID:
+        return str(user_id) == str(OWNER_ID)
+    if guild.owner_id == user_id:
+        return True
+    member = guild.get_member(user_id)
+    if member is None:
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.HTTPException:
+            return False
+    return member.guild_permissions.manage_guild
+
+async def _can_use_source(interaction: discord.Interaction, source_guild_id: int) -> bool:
+    # 別ギルドのスナップショット（ギルドID/スナップショットID）を読む・別ギルドへ複製するとき。そのギルドで _can_manage を満たすこと。
+    # Bot が参加していないなど、確かめられないときは拒否する
+    if source_guild_id == interaction.guild_id:
+        return True
+    source = bot.get_guild(source_guild_id)
+    if source is None:
+        return bool(OWNER_ID) and str(interaction.user.id) == str(OWNER_ID)
+    return await _can_manage(source, interaction.user.id)
+
 @bot.tree.command(
     name='restore',
     description='バックアップからロール・チャンネル構成を復元します。',
     guild=discord.Object(id=int(os.getenv('GUILD_ID'))) if os.getenv('GUILD_ID') else None,
 )
+@app_commands.describe(
+    snapshot='復元するスナップショット ID（省略時は最新）。別ギルドのものは ギルドID/スナップショットID',
+    dry_run='実行せずに復元プランと推定リクエスト数だけを表示します',
+    assets='保存済みの絵文字・スタンプ・アイコン・ロールアイコンも復元します',
+    messages='保存済みのメッセージ履歴を Webhook で再投稿します（中断しても続きから）',
+    threads='保存済みのスレッド・フォーラム投稿を（タグ付きで）作り直します',
+    resume='中断した前回の復元を、同じスナップショット・オプションで続きから再開します',
+    categories='このカテゴリ（名前または元 ID、カンマ区切り）と配下のチャンネルだけを復元します',
+    channels='名前がこのパターン（* ? が使えます、カンマ区切り）に合うチャンネルだけを復元します',
+    kinds='この種類（role, category, text, forum, voice のカンマ区切り）だけを復元します',
+    ids='バックアップ内の元 ID（カンマ区切り）で指定したものだけを復元します',
+)
 @app_guild_only_and_owner()
-async def restore_slash(interaction: discord.Interaction):
+async def restore_slash(interaction: discord.Interaction, snapshot: str | None = None, dry_run: bool = False,
+                        assets: bool = False, messages: bool = False, threads: bool = False, resume: bool = False,
+                        categories: str | None = None, channels: str | None = None, kinds: str | None = None,
+                        ids: str | None = None):
     await interaction.response.defer(ephemeral=True)
 
-    async def _progress(msg: str):
+    async def _reply(msg: str):
         try:
             await interaction.edit_original_response(content=msg)
         except Exception:
@@ -291,269 +203,219 @@ async def restore_slash(interaction: discord.Interaction):
             except Exception:
                 pass
 
-    await _progress('🔄 復元開始…')
+    # 条件を指定したものと、それが参照するロール・カテゴリだけを復元する（部分復元）
+    try:
+        only = RestoreFilter.parse(categories, channels, kinds, ids)
+    except ValueError as e:
+        await _reply(f'❌ {e}')
+        return
 
     guild = interaction.guild
-    role_map = {r.name: r for r in guild.roles}
-    cat_map = {c.name: c for c in guild.categories}
-
-    await _progress('🧩 ロールを復元中…')
-    if os.path.exists(ROLE_FILE):
-        with open(ROLE_FILE, 'r', encoding='utf-8') as f:
-            stored_roles = json.load(f)
-        # 高いpositionから順に処理（上から積む）
-        for r in sorted(stored_roles, key=lambda x: x.get('position', 0), reverse=True):
-            target_pos = int(r.get('position', 0))
-            perms = discord.Permissions(r['permissions'])
-            existing = discord.utils.get(guild.roles, name=r['name'])
-            try:
-                if existing:
-                    try:
-                        await existing.edit(permissions=perms, colour=discord.Colour(r['color']), hoist=r['hoist'], mentionable=r['mentionable'])
-                    except Exception:
-                        pass
-                    try:
-                        if existing.position != target_pos:
-                            await existing.edit(position=target_pos)
-                            await asyncio.sleep(0.15)
-                    except Exception:
-                        pass
-                else:
-                    created = await guild.create_role(
-                        name=r['name'],
-                        permissions=perms,
-                        colour=discord.Colour(r['color']),
-                        hoist=r['hoist'],
-                        mentionable=r['mentionable']
-                    )
-                    try:
-                        if created.position != target_pos:
-                            await created.edit(position=target_pos)
-                            await asyncio.sleep(0.15)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+    run = None
+    if resume:
+        run = await run_io(backups().journal.load, guild.id)
+        if run is None or run.finished:
+            await _reply('再開できる復元はありません（前回の復元は完了しています）。')
+            return
+        snapshot = run.info.get('snapshot')
+        source_guild_id = int(run.info['source_guild_id'])
+        if snapshot is None and run.options.get('clone'):
+            await _reply('複製元のスナップショットが無いため再開できません（テンプレートからの複製か、複製元を読み終える前に中断しました）。'
+                         '`/clone` からやり直してください。')
+            return
     else:
-        stored_roles = []
-
-    await _progress(f'✅ ロール {len(stored_roles) if os.path.exists(ROLE_FILE) else 0} 件を復元。次：カテゴリ…')
-
-    await _progress('📁 カテゴリを復元中…')
-    if os.path.exists(CATEGORY_FILE):
-        with open(CATEGORY_FILE, 'r', encoding='utf-8') as f:
-            stored_categories = json.load(f)
-        stored_categories_sorted = sorted(stored_categories, key=lambda c: c.get('position', 0))
-        for c in stored_categories_sorted:
-            overwrites = {}
-            for target_id, perm in c.get('overwrites', {}).items():
-                if perm.get('target_type') == 'role':
-                    target = role_map.get(target_id)
-                else:
-                    try:
-                        target = guild.get_member(int(target_id)) or await guild.fetch_member(int(target_id))
-                    except Exception:
-                        target = None
-                if target is None:
-                    continue
-                try:
-                    allow_bits = int(perm.get('allow', 0))
-                    deny_bits = int(perm.get('deny', 0))
-                    allow_perm = discord.Permissions(allow_bits)
-                    deny_perm = discord.Permissions(deny_bits)
-                    ow = discord.PermissionOverwrite.from_pair(allow_perm, deny_perm)
-                except Exception:
-                    continue
-                overwrites[target] = ow
-            try:
-                await guild.create_category(
-                    c['name'],
-                    position=c.get('position', None),
-                    overwrites=dict(overwrites),
-                )
-            except Exception:
-                pass
-        cat_count = len(stored_categories)
-    else:
-        stored_categories = []
-        cat_count = 0
-
-    role_map = {r.name: r for r in guild.roles}
-    cat_map = {c.name: c for c in guild.categories}
-
-    await _progress(f'✅ カテゴリ {cat_count} 件を復元。次：テキストチャンネル…')
-
-    await _progress('💬 テキストチャンネルを復元中…')
-    if os.path.exists(TEXT_FILE):
-        with open(TEXT_FILE, 'r', encoding='utf-8') as f:
-            stored_text = json.load(f)
-        for ch in stored_text:
-            category = cat_map.get(ch['category']) if ch['category'] else None
-            overwrites = {}
-            for target_id, perm in ch.get('overwrites', {}).items():
-                if perm.get('target_type') == 'role':
-                    target = role_map.get(target_id)
-                else:
-                    try:
-                        target = guild.get_member(int(target_id)) or await guild.fetch_member(int(target_id))
-                    except Exception:
-                        target = None
-                if target is None:
-                    continue
-                try:
-                    allow_bits = int(perm.get('allow', 0))
-                    deny_bits = int(perm.get('deny', 0))
-                    allow_perm = discord.Permissions(allow_bits)
-                    deny_perm = discord.Permissions(deny_bits)
-                    ow = discord.PermissionOverwrite.from_pair(allow_perm, deny_perm)
-                except Exception:
-                    continue
-                overwrites[target] = ow
-            new = await guild.create_text_channel(
-                ch['name'],
-                category=category,
-                position=ch.get('position', None),
-                nsfw=ch.get('nsfw', False),
-                topic=ch.get('topic'),
-                slowmode_delay=ch.get('slowmode_delay', 0),
-                overwrites=dict(overwrites),
-            )
-    else:
-        stored_text = []
-
-    await _progress(f'✅ テキストチャンネル {len(stored_text) if os.path.exists(TEXT_FILE) else 0} 件を復元。次：フォーラム…')
-
-    await _progress('📚 フォーラムを復元中…')
-    if os.path.exists(FORUM_FILE):
-        with open(FORUM_FILE, 'r', encoding='utf-8') as f:
-            stored_forum = json.load(f)
-        for ch in stored_forum:
-            category = cat_map.get(ch['category']) if ch.get('category') else None
-            if category is None and ch.get('category'):
-                category = discord.utils.get(guild.categories, name=ch.get('category'))
-
-            overwrites = {}
-            for target_id, perm in (ch.get('overwrites') or {}).items():
-                if perm.get('target_type') == 'role':
-                    target = role_map.get(target_id)
-                else:
-                    try:
-                        target = guild.get_member(int(target_id)) or None
-                    except Exception:
-                        target = None
-                if target is None:
-                    continue
-                try:
-                    allow_bits = int(perm.get('allow', 0))
-                    deny_bits = int(perm.get('deny', 0))
-                    allow_perm = discord.Permissions(allow_bits)
-                    deny_perm = discord.Permissions(deny_bits)
-                    ow = discord.PermissionOverwrite.from_pair(allow_perm, deny_perm)
-                    overwrites[target] = ow
-                except Exception:
-                    continue
-
-            tag_objs = []
-            for t in (ch.get('available_tags') or []):
-                try:
-                    emoji_val = _parse_reaction_emoji(t.get('emoji')) if t.get('emoji') else None
-                    tag_objs.append(discord.ForumTag(name=t.get('name'), emoji=emoji_val, moderated=bool(t.get('moderated', False))))
-                except Exception:
-                    pass
-
-            default_reaction = _parse_reaction_emoji(ch.get('default_reaction_emoji'))
-
-            existed = _find_forum(guild, ch['name'], ch.get('category'))
-
-            create_forum_func = getattr(guild, 'create_forum', None) or getattr(guild, 'create_forum_channel', None)
-
-            kwargs = dict(
-                category=category,
-                position=ch.get('position', None),
-                nsfw=ch.get('nsfw', False),
-                topic=ch.get('topic'),
-                default_thread_slowmode_delay=ch.get('default_thread_slowmode_delay'),
-                default_reaction_emoji=default_reaction,
-                available_tags=tag_objs or None,
-                overwrites=dict(overwrites),
-            )
-
-            if hasattr(discord, 'ForumLayout') and ch.get('default_layout'):
-                try:
-                    kwargs['default_layout'] = getattr(discord.ForumLayout, ch['default_layout'])
-                except Exception:
-                    pass
-            if hasattr(discord, 'SortOrder') and ch.get('default_sort_order'):
-                try:
-                    kwargs['default_sort_order'] = getattr(discord.SortOrder, ch['default_sort_order'])
-                except Exception:
-                    pass
+        try:
+            source_guild_id = source_guild(guild.id, snapshot)
+        except ValueError:
+            await _reply('❌ 別ギルドのスナップショットは ギルドID/スナップショットID で指定してください。')
+            return
+    # 読み込み・プレビュー・ID の固定より前に確かめる
+    if not await _can_use_source(interaction, source_guild_id):
+        await _reply(f'❌ 復元元のギルド（{source_guild_id}）でサーバー管理の権限を確認できません。')
+        return
+
+    await _reply('🔄 バックアップを読み込み中…')
+    try:
+        backup = await run_io(load_backup, guild.id, snapshot)
+    except SnapshotError as e:
+        # 破損したスナップショットは API を叩く前に止める
+        await _reply(f'❌ バックアップを読み込めません: {e}')
+        return
 
-            try:
-                if existed:
-                    edit_kwargs = {k: v for k, v in kwargs.items() if k not in ('available_tags', 'default_layout', 'default_sort_order')}
-                    try:
-                        await existed.edit(**edit_kwargs)
-                    except Exception:
-                        pass
-                    if tag_objs:
-                        try:
-                            await existed.set_available_tags(tag_objs)
-                        except Exception:
-                            pass
-                else:
-                    if create_forum_func is not None:
-                        await create_forum_func(ch['name'], **kwargs)
-            except Exception:
-                pass
-    else:
-        stored_forum = []
-
-    await _progress(f'✅ フォーラム {len(stored_forum) if os.path.exists(FORUM_FILE) else 0} 件を復元。次：ボイスチャンネル…')
-
-    await _progress('🔈 ボイスチャンネルを復元中…')
-    if os.path.exists(VOICE_FILE):
-        with open(VOICE_FILE, 'r', encoding='utf-8') as f:
-            stored_voice = json.load(f)
-        for ch in stored_voice:
-            category = cat_map.get(ch['category']) if ch['category'] else None
-            overwrites = {}
-            for target_id, perm in ch.get('overwrites', {}).items():
-                if perm.get('target_type') == 'role':
-                    target = role_map.get(target_id)
-                else:
-                    try:
-                        target = guild.get_member(int(target_id)) or await guild.fetch_member(int(target_id))
-                    except Exception:
-                        target = None
-                if target is None:
-                    continue
-                try:
-                    allow_bits = int(perm.get('allow', 0))
-                    deny_bits = int(perm.get('deny', 0))
-                    allow_perm = discord.Permissions(allow_bits)
-                    deny_perm = discord.Permissions(deny_bits)
-                    ow = discord.PermissionOverwrite.from_pair(allow_perm, deny_perm)
-                except Exception:
-                    continue
-                overwrites[target] = ow
-            new = await guild.create_voice_channel(
-                ch['name'],
-                category=category,
-                bitrate=ch.get('bitrate', None),
-                user_limit=ch.get('user_limit', 0),
-                overwrites=dict(overwrites),
-            )
-    else:
-        stored_voice = []
-
-    await _progress(
-        f'🎉 復元完了。ロール {len(stored_roles) if os.path.exists(ROLE_FILE) else 0} 件・'
-        f'カテゴリ {len(stored_categories) if os.path.exists(CATEGORY_FILE) else 0} 件・'
-        f'テキスト {len(stored_text) if os.path.exists(TEXT_FILE) else 0} 件・'
-        f'フォーラム {len(stored_forum) if os.path.exists(FORUM_FILE) else 0} 件・'
-        f'ボイス {len(stored_voice) if os.path.exists(VOICE_FILE) else 0} 件を復元しました。'
-    )
+    if dry_run:
+        await _reply(await plan_text(guild, backup, source_guild_id, run, only.to_dict() if only else None))
+        return
+
+    if run is None:
+        pinned = await run_io(pin_snapshot, guild.id, snapshot)
+        run = await run_io(backups().journal.begin, guild.id, pinned, source_guild_id,
+                           {'assets': assets, 'messages': messages, 'threads': threads,
+                            'only': only.to_dict() if only else None})
+
+    message = await _open_status(interaction.channel, run)
+
+    async def _progress(msg: str):
+        if message is None:
+            await _reply(msg)
+            return
+        try:
+            await message.edit(content=msg)
+        except discord.HTTPException:
+            pass
+
+    if message is not None:
+        await _reply(f'🔄 復元を{"再開" if resume else "開始"}しました。進捗はこちらに表示します: {message.jump_url}'
+                     + (f'\n前回: {run.summary()}' if resume else ''))
+    try:
+        text = await run_restore(bot, guild, backup, run, _progress,
+                                 authorize=lambda source_guild_id: _can_use_source(interaction, source_guild_id))
+    except Exception as e:
+        await _progress(f'❌ 復元が中断しました: {type(e).__name__}: {e}\n{run.summary()}\n'
+                        '`/restore resume:True` で続きから再開できます。')
+        raise
+    await _progress(text)
+
+@bot.tree.command(
+    name='shards',
+    description='シャードごとのギルド数・レイテンシ・自動バックアップの待ち件数を表示します。',
+    guild=discord.Object(id=int(os.getenv('GUILD_ID'))) if os.getenv('GUILD_ID') else None,
+)
+@app_guild_only_and_owner()
+async def shards_slash(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    # 自分のプロセスは最新の状態を書いてから、全プロセス分の状況ファイルを読む
+    await run_io(shard_board.write, shard_status(bot, auto_backup.queues))
+    statuses = await run_io(shard_board.read_all)
+    await interaction.followup.send(render_status(statuses), ephemeral=True)
+
+@bot.tree.command(
+    name='backup_diff',
+    description='2 つのスナップショットのロール・チャンネル・権限上書きの差分を表示します。',
+    guild=discord.Object(id=int(os.getenv('GUILD_ID'))) if os.getenv('GUILD_ID') else None,
+)
+@app_commands.describe(
+    a='比較元のスナップショット ID。別ギルドのものは ギルドID/スナップショットID',
+    b='比較先のスナップショット ID（省略時は最新）',
+)
+@app_guild_only_and_owner()
+async def backup_diff_slash(interaction: discord.Interaction, a: str, b: str | None = None):
+    await interaction.response.defer(ephemeral=True)
+    for snapshot in (a, b):
+        try:
+            source_guild_id = source_guild(interaction.guild.id, snapshot)
+        except ValueError:
+            await interaction.followup.send('❌ 別ギルドのスナップショットは ギルドID/スナップショットID で指定してください。',
+                                            ephemeral=True)
+            return
+        if not await _can_use_source(interaction, source_guild_id):
+            await interaction.followup.send(f'❌ {source_guild_id} でサーバー管理の権限を確認できません。', ephemeral=True)
+            return
+    try:
+        diff = await run_io(backups().store.diff, interaction.guild.id, a, b)
+    except SnapshotError as e:
+        await interaction.followup.send(f'❌ 差分を計算できません: {e}', ephemeral=True)
+        return
+    await interaction.followup.send(diff.render(), ephemeral=True)
+
+@bot.tree.command(
+    name='clone',
+    description='別のギルド・スナップショット・サーバーテンプレートの構成を、このギルド（または target）に複製します。',
+    guild=discord.Object(id=int(os.getenv('GUILD_ID'))) if os.getenv('GUILD_ID') else None,
+)
+@app_commands.describe(
+    source='複製元。ギルド ID・ギルドID/スナップショットID・テンプレートの URL（https://discord.new/…）',
+    target='複製先のギルド ID（省略時はこのギルド）',
+)
+@app_guild_only_and_owner()
+async def clone_slash(interaction: discord.Interaction, source: str, target: str | None = None):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        target_guild = bot.get_guild(int(target)) if target else interaction.guild
+    except ValueError:
+        target_guild = None
+    if target_guild is None:
+        await interaction.followup.send('❌ 複製先は Bot が参加しているギルドの ID で指定してください。', ephemeral=True)
+        return
+    try:
+        source_guild_id = clone_source_guild(source)
+    except ValueError as e:
+        await interaction.followup.send(f'❌ {e}', ephemeral=True)
+        return
+    # 複製元はスナップショット指定・Bot が抜けたギルドでも、元のギルド ID で確かめる（確かめられなければ拒否）
+    for guild_id in {target_guild.id, source_guild_id} - {None, interaction.guild_id}:
+        if not await _can_use_source(interaction, guild_id):
+            await interaction.followup.send(f'❌ {guild_id} でサーバー管理の権限を確認できません。', ephemeral=True)
+            return
+
+    # 長くかかるので、進捗は実行したチャンネルのメッセージを Bot のトークンで編集して表示する
+    try:
+        message = await interaction.channel.send('🔄 複製開始…')
+    except (AttributeError, discord.HTTPException):
+        message = None
+
+    async def _progress(msg: str):
+        try:
+            if message is not None:
+                await message.edit(content=msg)
+            else:
+                await interaction.edit_original_response(content=msg)
+        except discord.HTTPException:
+            pass
+
+    await interaction.followup.send(f'🔄 {target_guild.name} への複製を開始しました。' +
+                                    (f'進捗はこちらに表示します: {message.jump_url}' if message else ''), ephemeral=True)
+    try:
+        text = await run_clone(bot, source, target_guild, _progress)
+    except (ValueError, SnapshotError, discord.NotFound) as e:
+        await _progress(f'❌ 複製できません: {e}')
+        return
+    except Exception as e:
+        await _progress(f'❌ 複製が中断しました: {type(e).__name__}: {e}\n'
+                        f'{target_guild.name} で `/restore resume:True` を実行すると続きから再開できます。')
+        raise
+    await _progress(text)
+
+@bot.tree.command(
+    name='template_export',
+    description='このギルドの構成を Discord のサーバーテンプレートに書き出します（新しいサーバーは Discord 側で一度に作成）。',
+    guild=discord.Object(id=int(os.getenv('GUILD_ID'))) if os.getenv('GUILD_ID') else None,
+)
+@app_guild_only_and_owner()
+async def template_export_slash(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        template = await export_template(interaction.guild)
+    except discord.HTTPException as e:
+        await interaction.followup.send(f'❌ テンプレートを作成できません（サーバー管理の権限が必要です）: {e}', ephemeral=True)
+        return
+    await interaction.followup.send(
+        f'📐 テンプレートを更新しました: {template.url}\n'
+        f'この URL から新しいサーバーを作成できます。既存のギルドへは `/clone source:{template.url}` で複製できます。',
+        ephemeral=True)
+
+@backup_diff_slash.autocomplete('a')
+@backup_diff_slash.autocomplete('b')
+@restore_slash.autocomplete('snapshot')
+async def restore_snapshot_autocomplete(interaction: discord.Interaction, current: str):
+    if not interaction.guild_id:
+        return []
+    # 'ギルドID/' まで入力されたら、そのギルドで権限を確かめられたときだけ候補を出す
+    try:
+        source_guild_id = source_guild(interaction.guild_id, current)
+    except ValueError:
+        return []
+    if not await _can_use_source(interaction, source_guild_id):
+        return []
+    prefix = f'{source_guild_id}/' if '/' in current else ''
+    current = current[len(prefix):]
+    snapshots = await run_io(backups().store.list_snapshots, source_guild_id)
+    choices = []
+    for snap in reversed(snapshots):
+        if current and not snap['id'].startswith(current):
+            continue
+        counts = sum(s['count'] for s in snap['sections'].values())
+        choices.append(app_commands.Choice(name=f"{prefix}{snap['id']}（{counts} 件）", value=prefix + snap['id']))
+    return choices[:25]
 
 #TODO: デバック用　削除する
 @bot.tree.command(
@@ -570,12 +432,12 @@ async def nuke_all_slash(interaction: discord.Interaction):
         return await interaction.followup.send('ギルド内でのみ使用できます。', ephemeral=True)
 
     # 対象の収集（現在のチャンネルは最後まで残す）
-    keep_channel = interaction.channel
-    text_targets = [c for c in guild.text_channels if c.id != getattr(keep_channel, 'id', None)]
-    forum_targets = [c for c in guild.channels if isinstance(c, discord.ForumChannel) and c.id != getattr(keep_channel, 'id', None)]
-    voice_targets = [c for c in guild.voice_channels if c.id != getattr(keep_channel, 'id', None)]
-    category_targets = list(guild.categories)
-    role_targets = [r for r in guild.roles if (not r.is_default()) and (not r.managed)]  # @everyone と連携ロール除外(権限なしになるので)
+    targets = collect_targets(guild, interaction.channel)
+    text_targets = targets['text']
+    forum_targets = targets['forum']
+    voice_targets = targets['voice']
+    category_targets = targets['category']
+    role_targets = targets['role']
 
     warning = (
         '⚠️ **超危険**: 次のリソースを削除します\n'
@@ -620,69 +482,13 @@ async def nuke_all_slash(interaction: discord.Interaction):
             self.cancel_button.disabled = True
             await _edit(content='🧨 一括削除を開始します…', view=self)
 
-            # 進捗用ヘルパー
-            async def progress(msg: str):
-                await _edit(content=msg, view=self)
-
-            deleted_text = 0
-            for ch in list(text_targets):
-                try:
-                    await ch.delete(reason='nuke_all by owner')
-                    deleted_text += 1
-                    if deleted_text % 5 == 0:
-                        await progress(f'🧹 テキストチャンネル削除中… {deleted_text}/{len(text_targets)}')
-                except Exception:
-                    pass
-            await progress(f'✅ テキストチャンネル {deleted_text}/{len(text_targets)} 削除完了。次：フォーラム…')
-
-            deleted_forum = 0
-            for ch in list(forum_targets):
-                try:
-                    await ch.delete(reason='nuke_all by owner')
-                    deleted_forum += 1
-                    if deleted_forum % 5 == 0:
-                        await progress(f'🧹 フォーラム削除中… {deleted_forum}/{len(forum_targets)}')
-                except Exception:
-                    pass
-            await progress(f'✅ フォーラム {deleted_forum}/{len(forum_targets)} 削除完了。次：ボイスチャンネル…')
-
-            deleted_voice = 0
-            for ch in list(voice_targets):
-                try:
-                    await ch.delete(reason='nuke_all by owner')
-                    deleted_voice += 1
-                    if deleted_voice % 5 == 0:
-                        await progress(f'🧹 ボイスチャンネル削除中… {deleted_voice}/{len(voice_targets)}')
-                except Exception:
-                    pass
-            await progress(f'✅ ボイスチャンネル {deleted_voice}/{len(voice_targets)} 削除完了。次：カテゴリ…')
-
-            deleted_cat = 0
-            # カテゴリは後ろから消すと依存が少ない！
-            for cat in list(sorted(category_targets, key=lambda c: c.position, reverse=True)):
-                try:
-                    await cat.delete(reason='nuke_all by owner')
-                    deleted_cat += 1
-                    if deleted_cat % 5 == 0:
-                        await progress(f'🧹 カテゴリ削除中… {deleted_cat}/{len(category_targets)}')
-                except Exception:
-                    pass
-            await progress(f'✅ カテゴリ {deleted_cat}/{len(category_targets)} 削除完了。次：ロール…')
-
-            # ロール削除（Botの権限階層により失敗する場合あり）
-            deleted_roles = 0
-            for r in list(sorted(role_targets, key=lambda r: r.position)):
-                try:
-                    await r.delete(reason='nuke_all by owner')
-                    deleted_roles += 1
-                    if deleted_roles % 10 == 0:
-                        await progress(f'🧹 ロール削除中… {deleted_roles}/{len(role_targets)}')
-                except Exception:
-                    pass
-            await progress(f'✅ ロール {deleted_roles}/{len(role_targets)} 削除完了。')
+            # 進捗は一定間隔でまとめて反映する（削除と同じレート制限を食わないように）
+            executor = RestoreExecutor()
+            async with ProgressReporter(lambda msg: _edit(content=msg, view=self)) as reporter:
+                report = await nuke(guild, targets, executor, reporter)
 
             # 最後に現在のチャンネルを残す（ログや次操作のため）
-            await _edit(content='🎉 一括削除が完了しました（このチャンネルは残しています）。', view=None)
+            await _edit(content=f'{report.render()}\n{executor.summary()}', view=None)
 
         @discord.ui.button(label='やめる', style=discord.ButtonStyle.secondary, custom_id='nuke_cancel')
         async def cancel_button(self, interaction_btn: discord.Interaction, button: discord.ui.Button):
@@ -699,6 +505,8 @@ if __name__ == '__main__':
     else:
         if enable_members:
             print('WARNING: ENABLE_MEMBERS_INTENT is set. Make sure you enabled "Server Members Intent" in the Discord Developer Portal for this application.')
+        if enable_message_content:
+            print('WARNING: ENABLE_MESSAGE_CONTENT_INTENT is set. Make sure you enabled "Message Content Intent" in the Discord Developer Portal for this application.')
         try:
             bot.run(TOKEN)
         except discord.errors.PrivilegedIntentsRequired as e:
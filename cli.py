@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import discord
+from dotenv import load_dotenv
+
+# 下のモジュールは読み込んだ時点で環境変数（.env の設定）を読むので、先に .env を読む
+load_dotenv()
+
+from journal import PHASES
+from selection import RestoreFilter
+from metrics import api_metrics
+from store import run_io
+from jobs import (backups, load_backup, pin_snapshot, plan_text, run_backup, run_clone, run_restore,
+                  source_guild)
+from templates import export_template
+from guildview import BACKUP_MODES
+
+# スラッシュコマンドを使わずにバックアップ・復元を実行する（cron・CI 向け）。
+#   python -m cli backup 123 456 --messages --json
+#   python -m cli restore 123 --snapshot 20240101-000000-a1b2c3
+#   python -m cli diff 123
+#   python -m cli restore 123 --category Games --kind text   # 一部だけ（依存するロール・カテゴリも）
+#   python -m cli clone 456 --source 123                     # 123 の構成を 456 に複製
+# ログインして指定したギルドを並列に処理し、終わったら終了する。
+# ゲートウェイはギルド（ロール・チャンネル）の情報だけを受け取り、メンバーのチャンクやメッセージのキャッシュはしない。
+
+CLI_CONCURRENCY = int(os.getenv('CLI_CONCURRENCY', '4'))
+READY_TIMEOUT = float(os.getenv('CLI_READY_TIMEOUT_SECONDS', '60'))
+
+
+def _flag(name: str) -> bool:
+    return os.getenv(name, '0').lower() in ('1', 'true', 'yes')
+
+
+def make_client() -> discord.Client:
+    intents = discord.Intents.none()
+    intents.guilds = True
+    # メンバー宛ての上書きの解決・メッセージ本文のアーカイブに要るものだけ、bot.py と同じ設定で有効にする
+    intents.members = _flag('ENABLE_MEMBERS_INTENT')
+    intents.message_content = _flag('ENABLE_MESSAGE_CONTENT_INTENT')
+    return discord.Client(
+        intents=intents,
+        chunk_guilds_at_startup=False,
+        member_cache_flags=discord.MemberCacheFlags.none(),
+        max_messages=None,
+        # 完了メッセージの段階ごとのリクエスト数を数えるため、bot.py と同じく HTTP を計測する
+        http_trace=api_metrics.trace_config(),
+    )
+
+
+class Reporter:
+    # 進捗の出力先。--json なら 1 行 1 イベントの JSON、それ以外は「[ギルドID] メッセージ」
+    def __init__(self, as_json: bool, stream=None):
+        self.as_json = as_json
+        self.stream = stream or sys.stdout
+
+    def emit(self, guild_id, event: str, message: str = '', **extra):
+        if self.as_json:
+            record = {'t': round(time.time(), 3), 'guild_id': str(guild_id) if guild_id else None, 'event': event,
+                      'message': message, **extra}
+            line = json.dumps(record, ensure_ascii=False)
+        else:
+            prefix = f'[{guild_id}] ' if guild_id else ''
+            line = prefix + (message or event)
+        print(line, file=self.stream, flush=True)
+
+    def progress(self, guild_id):
+        async def _progress(msg: str):
+            self.emit(guild_id, 'progress', msg)
+        return _progress
+
+
+async def _backup(client: discord.Client, guild: discord.Guild, args, reporter: Reporter) -> str:
+    return await run_backup(guild, reporter.progress(guild.id), messages=args.messages, assets=args.assets,
+                            threads=args.threads, trigger='cli', mode=args.mode, intents=client.intents)
+
+
+async def _operator(source_guild_id: int) -> bool:
+    # CLI はトークンと backup/ を持つ運用者が実行するので、別ギルドのアーカイブも読んでよい
+    return True
+
+
+async def _restore(client: discord.Client, guild: discord.Guild, args, reporter: Reporter) -> str:
+    run = None
+    snapshot = args.snapshot
+    if args.resume:
+        run = await run_io(backups().journal.load, guild.id)
+        if run is None or run.finished:
+            raise RuntimeError('再開できる復元はありません（前回の復元は完了しています）')
+        snapshot = run.info.get('snapshot')
+        if snapshot is None and run.options.get('clone'):
+            raise RuntimeError('複製元のスナップショットが無いため再開できません（テンプレートからの複製か、複製元を読み終える前に中断しました。'
+                               'clone からやり直してください）')
+        reporter.emit(guild.id, 'resume', f'前回: {run.summary()}', phases=[p for p in PHASES if p in run.phases])
+    backup = await run_io(load_backup, guild.id, snapshot)
+    if run is None:
+        pinned = await run_io(pin_snapshot, guild.id, snapshot)
+        run = await run_io(backups().journal.begin, guild.id, pinned, source_guild(guild.id, snapshot),
+                           {'assets': args.assets, 'messages': args.messages, 'threads': args.threads,
+                            'only': args.only.to_dict() if args.only else None})
+    return await run_restore(client, guild, backup, run, reporter.progress(guild.id), authorize=_operator)
+
+
+async def _diff(client: discord.Client, guild: discord.Guild, args, reporter: Reporter) -> str:
+    backup = await run_io(load_backup, guild.id, args.snapshot)
+    return await plan_text(guild, backup, source_guild(guild.id, args.snapshot),
+                           only=args.only.to_dict() if args.only else None)
+
+
+async def _clone(client: discord.Client, guild: discord.Guild, args, reporter: Reporter) -> str:
+    return await run_clone(client, args.source, guild, reporter.progress(guild.id))
+
+
+async def _template(client: discord.Client, guild: discord.Guild, args, reporter: Reporter) -> str:
+    return (await export_template(guild)).url
+
+
+COMMANDS = {'backup': _backup, 'restore': _restore, 'diff': _diff, 'clone': _clone, 'template': _template}
+
+
+async def run_jobs(client: discord.Client, args, reporter: Reporter) -> int:
+    if args.all:
+        guild_ids = [g.id for g in client.guilds]
+    else:
+        guild_ids = args.guilds
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+    job = COMMANDS[args.command]
+    failed = 0
+
+    async def _one(guild_id: int):
+        nonlocal failed
+        async with sem:
+            guild = client.get_guild(guild_id)
+            if guild is None:
+                failed += 1
+                reporter.emit(guild_id, 'error', 'Bot が参加していないギルドです')
+                return
+            start = time.perf_counter()
+            reporter.emit(guild_id, 'start', f'{args.command} 開始: {guild.name}')
+            try:
+                result = await job(client, guild, args, reporter)
+            except Exception as e:
+                # 1 つのギルドの失敗で他のギルドを止めない
+                failed += 1
+                reporter.emit(guild_id, 'error', f'{type(e).__name__}: {e}')
+                return
+            reporter.emit(guild_id, 'done', result, elapsed=round(time.perf_counter() - start, 3))
+
+    await asyncio.gather(*(_one(guild_id) for guild_id in guild_ids))
+    return 1 if failed else 0
+
+
+async def amain(args) -> int:
+    reporter = Reporter(args.json)
+    client = make_client()
+    async with client:
+        await client.login(os.getenv('DISCORD_TOKEN'))
+        connection = asyncio.create_task(client.connect(reconnect=True))
+        try:
+            ready = asyncio.ensure_future(client.wait_until_ready())
+            await asyncio.wait({ready, connection}, timeout=READY_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+            if connection.done():
+                # ログイン直後に切断された（Privileged intents が無効など）
+                connection.result()
+            if not ready.done():
+                ready.cancel()
+                reporter.emit(None, 'error', f'{READY_TIMEOUT:.0f} 秒以内にゲートウェイの準備が完了しませんでした')
+                return 1
+            reporter.emit(None, 'ready', f'{client.user} としてログイン（ギルド {len(client.guilds)} 件）')
+            return await run_jobs(client, args, reporter)
+        finally:
+            await client.close()
+            connection.cancel()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m cli', description='バックアップ・復元をコマンドラインから実行')
+    parser.add_argument('--json', action='store_true', help='進捗を 1 行 1 イベントの JSON で出力する')
+    parser.add_argument('--concurrency', type=int, default=CLI_CONCURRENCY, help='同時に処理するギルド数')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def _targets(p):
+        p.add_argument('guilds', nargs='*', type=int, help='対象のギルド ID')
+        p.add_argument('--all', action='store_true', help='Bot が参加している全ギルドを対象にする')
+
+    def _only(p):
+        p.add_argument('--category', action='append', help='このカテゴリ（名前または元 ID）と配下だけ（複数指定可）')
+        p.add_argument('--channel', action='append', help='名前がこのパターン（* ?）に合うチャンネルだけ（複数指定可）')
+        p.add_argument('--kind', action='append', help='role / category / text / forum / voice のどれか（複数指定可）')
+        p.add_argument('--id', action='append', help='バックアップ内の元 ID（複数指定可）')
+
+    p = sub.add_parser('backup', help='構成（と任意でメッセージ・アセット・スレッド）を保存')
+    _targets(p)
+    p.add_argument('--messages', action='store_true')
+    p.add_argument('--assets', action='store_true')
+    p.add_argument('--threads', action='store_true')
+    p.add_argument('--mode', choices=BACKUP_MODES, default=None,
+                   help='ロール・チャンネルの読み方（auto: キャッシュ優先 / cache: キャッシュのみ / fetch: REST で取得）')
+    p = sub.add_parser('restore', help='スナップショットから復元（中断したものは --resume で再開）')
+    _targets(p)
+    p.add_argument('--snapshot', help='スナップショット ID（省略時は最新。別ギルドのものは ギルドID/スナップショットID）')
+    p.add_argument('--messages', action='store_true')
+    p.add_argument('--assets', action='store_true')
+    p.add_argument('--threads', action='store_true')
+    p.add_argument('--resume', action='store_true')
+    _only(p)
+    p = sub.add_parser('diff', help='復元した場合の操作（現在のギルドとの差分）を表示')
+    _targets(p)
+    p.add_argument('--snapshot')
+    _only(p)
+    p = sub.add_parser('clone', help='別のギルド・スナップショット・サーバーテンプレートの構成を複製')
+    _targets(p)
+    p.add_argument('--source', required=True,
+                   help='複製元（ギルド ID・ギルドID/スナップショットID・https://discord.new/<コード>）')
+    p = sub.add_parser('template', help='構成を Discord のサーバーテンプレートに書き出して URL を表示')
+    _targets(p)
+    args = parser.parse_args(argv)
+
+    if not args.guilds and not args.all:
+        parser.error('ギルド ID か --all を指定してください')
+    args.only = None
+    if args.command in ('restore', 'diff'):
+        try:
+            args.only = RestoreFilter.parse(args.category, args.channel, args.kind, args.id)
+        except ValueError as e:
+            parser.error(str(e))
+    if not os.getenv('DISCORD_TOKEN'):
+        print('DISCORD_TOKEN が .env に設定されていません', file=sys.stderr)
+        return 2
+    try:
+        return asyncio.run(amain(args))
+    except discord.PrivilegedIntentsRequired:
+        print('起動に失敗しました: Privileged intents が有効になっていません。', file=sys.stderr)
+        return 2
+    except discord.LoginFailure as e:
+        print(f'ログインに失敗しました: {e}', file=sys.stderr)
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import abc
+import asyncio
+
+import discord
+
+from codec import OverwriteCodec
+from serialize import SERIALIZERS
+from snapshot import SECTIONS, SnapshotError
+from store import SnapshotStore, run_io
+from templates import fetch_template, template_code, template_to_backup
+
+# ギルドの複製（/clone）。元の構成をセクションごとに読み、読んだそばから複製先の作成パイプライン
+# （planner.apply_stream）に流す。元は次のどれか:
+#   - Bot が参加しているギルド（キャッシュからセクションを作る）
+#   - 保存済みのスナップショット（ギルドID/スナップショットID、または Bot が参加していないギルドの最新）
+#   - Discord のサーバーテンプレート（https://discord.new/<コード> または template:<コード>）
+# Bot が参加しているギルドは読んだセクションをそのギルドのスナップショットとしてストアにも書き、
+# 書き終えたら on_saved に「ギルドID/スナップショットID」を渡す（中断しても /restore resume:True で再開できる）。
+# テンプレートは保存しない（作者のギルドのスナップショットに紛れる。中断したら clone からやり直す）。
+
+
+class CloneSource(abc.ABC):
+    def __init__(self, guild_id: int, label: str, store: SnapshotStore, meta: dict | None = None):
+        self.guild_id = int(guild_id)
+        self.label = label
+        self.snapshot: str | None = None
+        self.on_saved = None
+        self._writer = store.writer(guild_id, meta) if meta is not None else None
+
+    @abc.abstractmethod
+    def _sections(self):
+        # (セクション名, 項目の列) を順に返す非同期イテレータ
+        ...
+
+    async def _save(self, previous, name: str, items):
+        # セクションの順番どおりに書く（スナップショット ID は順番にも依存する）
+        if previous is not None:
+            await previous
+        await run_io(self._writer.add, name, items)
+
+    async def __aiter__(self):
+        saving = None
+        try:
+            async for name, items in self._sections():
+                if self._writer is not None:
+                    # 保存はスレッドプールで進め、作成のパイプラインは待たせない
+                    saving = asyncio.ensure_future(self._save(saving, name, items))
+                yield name, items
+            if self._writer is not None:
+                if saving is not None:
+                    await saving
+                entry = await run_io(self._writer.close)
+                self.snapshot = f"{self.guild_id}/{entry['id']}"
+        except BaseException:
+            if self._writer is not None:
+                if saving is not None:
+                    await asyncio.gather(saving, return_exceptions=True)
+                self._writer.abort()
+            raise
+        if self.on_saved is not None and self._writer is not None:
+            await self.on_saved(self.snapshot)
+
+
+class LiveSource(CloneSource):
+    def __init__(self, guild: discord.Guild, store: SnapshotStore):
+        super().__init__(guild.id, guild.name, store,
+                         {'guild_id': guild.id, 'guild_name': guild.name, 'trigger': 'clone'})
+        self.guild = guild
+
+    async def _sections(self):
+        codec = OverwriteCodec()
+        for name in SECTIONS:
+            yield name, SERIALIZERS[name](self.guild, codec)
+
+
+class StoredSource(CloneSource):
+    def __init__(self, store: SnapshotStore, guild_id: int, snap: dict):
+        super().__init__(guild_id, f"{guild_id}/{snap['id']}", store)
+        self.store = store
+        self.snap = snap
+        self.snapshot = self.label
+
+    async def _sections(self):
+        # セクションを 1 つずつ読む（読んでいる間も前のセクションの作成は進む）
+        for name in SECTIONS:
+            entry = self.snap['sections'].get(name)
+            if entry is not None:
+                yield name, await run_io(self.store.get_section, entry['object'])
+
+
+class TemplateSource(CloneSource):
+    def __init__(self, data: dict, store: SnapshotStore):
+        source = data['serialized_source_guild']
+        super().__init__(data['source_guild_id'], f"テンプレート {data['code']}（{source.get('name')}）", store)
+        self.backup = template_to_backup(source)
+
+    async def _sections(self):
+        for name in SECTIONS:
+            yield name, self.backup[name]
+
+
+def clone_source_guild(spec: str) -> int | None:
+    # 複製元のギルド ID（テンプレートは公開されているので None）。権限の確認に使う
+    if template_code(spec) is not None:
+        return None
+    try:
+        return int(spec.strip().partition('/')[0])
+    except ValueError:
+        raise ValueError('複製元はギルド ID・ギルドID/スナップショットID・テンプレートの URL のどれかで指定してください')
+
+
+async def open_source(client: discord.Client, store: SnapshotStore, spec: str) -> CloneSource:
+    guild_id = clone_source_guild(spec)
+    if guild_id is None:
+        return TemplateSource(await fetch_template(client, template_code(spec)), store)
+    snapshot_id = spec.strip().partition('/')[2]
+    guild = client.get_guild(guild_id)
+    if guild is not None and not snapshot_id:
+        return LiveSource(guild, store)
+    snap = await run_io(store.find, guild_id, snapshot_id or None)
+    if snap is None:
+        raise SnapshotError(f'ギルド {guild_id} のスナップショット {snapshot_id or "(最新)"} が見つかりません')
+    return StoredSource(store, guild_id, snap)
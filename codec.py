@@ -0,0 +1,264 @@
+from dataclasses import dataclass, field
+
+import discord
+
+# バックアップ 1 件分のレコード型と、権限上書きの符号化・復号。
+# 同じ allow/deny の組は何百チャンネルにも繰り返し現れるので、
+# 符号化した dict と復元用の PermissionOverwrite を組ごとに 1 つだけ作って使い回す
+# （使い回すオブジェクトは読み取り専用として扱うこと）。
+
+ROLE = 'role'
+MEMBER = 'member'
+
+
+class OverwriteCodec:
+    __slots__ = ('_encoded', '_decoded')
+
+    def __init__(self):
+        self._encoded: dict[tuple, dict] = {}
+        self._decoded: dict[tuple, discord.PermissionOverwrite] = {}
+
+    def entry(self, target_type: str, allow: int, deny: int) -> dict:
+        key = (target_type, allow, deny)
+        entry = self._encoded.get(key)
+        if entry is None:
+            entry = self._encoded[key] = {'target_type': target_type, 'allow': allow, 'deny': deny}
+        return entry
+
+    def encode(self, overwrites) -> dict:
+        # channel.overwrites（{Role | Member: PermissionOverwrite}）→ 保存形式
+        out = {}
+        for target, perm in overwrites.items():
+            allow, deny = perm.pair()
+            if isinstance(target, discord.Role):
+                out[role_key(target)] = self.entry(ROLE, allow.value, deny.value)
+            elif getattr(target, 'type', None) is discord.Role:
+                # キャッシュに無いロール（discord.Object）。メンバー宛てと取り違えないよう ID で残す
+                out[str(target.id)] = self.entry(ROLE, allow.value, deny.value)
+            else:
+                out[str(getattr(target, 'id', target))] = self.entry(MEMBER, allow.value, deny.value)
+        return out
+
+    def normalize(self, stored: dict | None, role_keys: dict | None = None) -> dict:
+        # 保存形式を比較用に正規化する。role_keys（保存時のキー → 現在のキー）を渡すと
+        # ロール宛てのキーを付け替え、解決できないロール宛ては落とす
+        out = {}
+        for key, perm in (stored or {}).items():
+            target_type = perm.get('target_type')
+            if target_type == ROLE and role_keys is not None:
+                key = role_keys.get(key)
+                if key is None:
+                    continue
+            try:
+                out[key] = self.entry(target_type, int(perm.get('allow', 0)), int(perm.get('deny', 0)))
+            except (TypeError, ValueError):
+                continue
+        return out
+
+    def overwrite(self, allow: int, deny: int) -> discord.PermissionOverwrite:
+        key = (allow, deny)
+        value = self._decoded.get(key)
+        if value is None:
+            value = self._decoded[key] = discord.PermissionOverwrite.from_pair(
+                discord.Permissions(allow), discord.Permissions(deny)
+            )
+        return value
+
+    async def decode(self, stored: dict | None, roles: dict, members) -> dict:
+        # 保存形式 → {Role | Member: PermissionOverwrite}。
+        # roles は保存時のキー（ロール ID・旧形式では名前）→ Role、members は resolve(id) を持つもの（MemberResolver）
+        overwrites = {}
+        for key, perm in (stored or {}).items():
+            if perm.get('target_type') == ROLE:
+                target = roles.get(key)
+            else:
+                try:
+                    target = await members.resolve(int(key))
+                except (TypeError, ValueError):
+                    target = None
+            if target is None:
+                continue
+            try:
+                overwrites[target] = self.overwrite(int(perm.get('allow', 0)), int(perm.get('deny', 0)))
+            except (TypeError, ValueError):
+                continue
+        return overwrites
+
+    def stats(self) -> dict:
+        return {'encoded': len(self._encoded), 'decoded': len(self._decoded)}
+
+
+def role_key(role: discord.Role) -> str:
+    # 上書きのキー。ロールは ID（同名のロールを区別するため）、@everyone はギルドをまたいで対応するよう名前
+    return '@everyone' if role.is_default() else str(role.id)
+
+
+def _category_name(ch):
+    return ch.category.name if ch.category else None
+
+
+def _str_or_none(value):
+    try:
+        return str(value) if value else None
+    except Exception:
+        return None
+
+
+class _Record:
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**{name: data.get(name) for name in cls.__slots__ if name in data})
+
+
+@dataclass(slots=True)
+class RoleRecord(_Record):
+    name: str
+    id: int | None = None
+    color: int = 0
+    hoist: bool = False
+    mentionable: bool = False
+    permissions: int = 0
+    position: int = 0
+    # 連携・ブースター・Bot のロール（連携側が作るもので、復元では作らない）
+    managed: bool = False
+
+    @classmethod
+    def from_role(cls, role: discord.Role):
+        return cls(role.name, role.id, role.color.value, role.hoist, role.mentionable, role.permissions.value,
+                   role.position, role.managed)
+
+
+@dataclass(slots=True)
+class CategoryRecord(_Record):
+    name: str
+    id: int | None = None
+    position: int = 0
+    overwrites: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_channel(cls, ch, codec: OverwriteCodec):
+        return cls(ch.name, ch.id, ch.position, codec.encode(ch.overwrites))
+
+
+@dataclass(slots=True)
+class TextRecord(_Record):
+    name: str
+    id: int | None = None
+    category: str | None = None
+    category_id: int | None = None
+    position: int = 0
+    nsfw: bool = False
+    topic: str | None = None
+    slowmode_delay: int = 0
+    overwrites: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_channel(cls, ch, codec: OverwriteCodec):
+        return cls(ch.name, ch.id, _category_name(ch), ch.category_id, ch.position, ch.nsfw, ch.topic,
+                   ch.slowmode_delay, codec.encode(ch.overwrites))
+
+
+@dataclass(slots=True)
+class ForumRecord(_Record):
+    name: str
+    id: int | None = None
+    category: str | None = None
+    category_id: int | None = None
+    position: int = 0
+    nsfw: bool = False
+    topic: str | None = None
+    default_thread_slowmode_delay: int | None = None
+    default_reaction_emoji: str | None = None
+    default_layout: str | None = None
+    default_sort_order: str | None = None
+    overwrites: dict = field(default_factory=dict)
+    available_tags: list = field(default_factory=list)
+
+    @classmethod
+    def from_channel(cls, ch, codec: OverwriteCodec):
+        tags = [
+            {'name': t.name, 'emoji': _str_or_none(t.emoji), 'moderated': getattr(t, 'moderated', False)}
+            for t in getattr(ch, 'available_tags', []) or []
+        ]
+        layout = getattr(ch, 'default_layout', None)
+        order = getattr(ch, 'default_sort_order', None)
+        return cls(
+            ch.name, ch.id, _category_name(ch), ch.category_id, ch.position, ch.nsfw, getattr(ch, 'topic', None),
+            getattr(ch, 'default_thread_slowmode_delay', None),
+            _str_or_none(ch.default_reaction_emoji),
+            getattr(layout, 'name', None) if layout else None,
+            getattr(order, 'name', None) if order else None,
+            codec.encode(ch.overwrites),
+            tags,
+        )
+
+
+@dataclass(slots=True)
+class VoiceRecord(_Record):
+    name: str
+    id: int | None = None
+    category: str | None = None
+    category_id: int | None = None
+    position: int = 0
+    bitrate: int | None = None
+    user_limit: int = 0
+    overwrites: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_channel(cls, ch, codec: OverwriteCodec):
+        return cls(ch.name, ch.id, _category_name(ch), ch.category_id, ch.position, ch.bitrate, ch.user_limit,
+                   codec.encode(ch.overwrites))
+
+
+@dataclass(slots=True)
+class ThreadRecord(_Record):
+    # スレッド・フォーラム投稿。starter はフォーラム投稿の最初のメッセージ（投稿の作成に必要）
+    id: int
+    name: str
+    parent: str | None = None
+    parent_id: int | None = None
+    parent_kind: str = 'text'
+    category: str | None = None
+    type: str = 'public_thread'
+    archived: bool = False
+    locked: bool = False
+    pinned: bool = False
+    invitable: bool = True
+    auto_archive_duration: int = 1440
+    slowmode_delay: int = 0
+    applied_tags: list = field(default_factory=list)
+    created_at: str | None = None
+    starter: dict | None = None
+
+    @classmethod
+    def from_thread(cls, thread, starter=None):
+        parent = thread.parent
+        return cls(
+            thread.id, thread.name, getattr(parent, 'name', None), thread.parent_id,
+            'forum' if isinstance(parent, discord.ForumChannel) else 'text',
+            parent.category.name if getattr(parent, 'category', None) else None,
+            thread.type.name, thread.archived, thread.locked, thread.flags.pinned, thread.invitable,
+            thread.auto_archive_duration, thread.slowmode_delay,
+            [t.name for t in thread.applied_tags],
+            thread.created_at.isoformat() if thread.created_at else None,
+            {
+                'content': starter.content,
+                'author': starter.author.display_name,
+                'attachments': [a.url for a in starter.attachments],
+            } if starter is not None else None,
+        )
+
+
+RECORDS = {
+    'roles': RoleRecord,
+    'categories': CategoryRecord,
+    'text': TextRecord,
+    'forum': ForumRecord,
+    'voice': VoiceRecord,
+    'threads': ThreadRecord,
+}
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+
+import discord
+
+from serialize import SERIALIZERS
+
+# バックアップで読むギルドの構成（ロール・チャンネル）の取り方。
+#   cache: ゲートウェイのキャッシュだけを読む（追加の REST は 0 件）。先にキャッシュが揃っているかを確かめ、
+#          足りないものがあれば報告する（再起動直後・大きなギルドの読み込み中はキャッシュが欠けていることがある）
+#   fetch: REST でロールとチャンネルを並列に取得し、その内容で保存する。キャッシュとの差分も報告する
+#   auto : キャッシュを確かめ、問題が無ければ cache、あれば fetch に切り替える（既定）
+
+BACKUP_MODES = ('auto', 'cache', 'fetch')
+BACKUP_MODE = os.getenv('BACKUP_MODE', 'auto')
+# 報告に名前を並べる件数
+MISMATCH_SAMPLES = 5
+
+_CHANNEL_SECTIONS = ('text', 'forum', 'voice')
+_MODE_LABELS = {'cache': 'キャッシュ', 'fetch': 'REST'}
+
+
+def _names(items) -> str:
+    names = [getattr(x, 'name', str(x)) for x in items]
+    more = f' ほか {len(names) - MISMATCH_SAMPLES} 件' if len(names) > MISMATCH_SAMPLES else ''
+    return '、'.join(names[:MISMATCH_SAMPLES]) + more
+
+
+def check_cache(guild: discord.Guild, intents: discord.Intents | None = None) -> list[str]:
+    # キャッシュだけで分かる欠け（REST は使わない）。intents は Bot の Intents（無ければメンバーの読み込みは確かめない）
+    issues = []
+    if guild.unavailable:
+        issues.append('ギルドが利用できない状態です（unavailable）')
+    if intents is not None and intents.members and not guild.chunked:
+        issues.append(f'メンバーの読み込みが終わっていません（{len(guild.members)}/{guild.member_count}）')
+    if guild.get_role(guild.id) is None:
+        issues.append('@everyone ロールがキャッシュにありません')
+    channels = guild.channels
+    if not channels:
+        issues.append('チャンネルが 1 件もキャッシュにありません')
+    category_ids = {c.id for c in guild.categories}
+    orphans = [c for c in channels if c.category_id is not None and c.category_id not in category_ids]
+    if orphans:
+        issues.append(f'親カテゴリがキャッシュに無いチャンネル {len(orphans)} 件（{_names(orphans)}）')
+    unresolved = [c for c in channels if any(_unresolved_role(t) for t in c.overwrites)]
+    if unresolved:
+        issues.append(f'権限上書きのロールがキャッシュに無いチャンネル {len(unresolved)} 件（{_names(unresolved)}）')
+    return issues
+
+
+def _unresolved_role(target) -> bool:
+    # キャッシュに無いロール宛ての上書きは、discord.py が discord.Object（type が Role）にして返す
+    return isinstance(target, discord.Object) and target.type is discord.Role
+
+
+def _role_state(role: discord.Role) -> tuple:
+    return role.name, role.position, role.permissions.value, role.color.value, role.hoist, role.mentionable
+
+
+def _channel_state(ch) -> tuple:
+    return (ch.name, ch.type, ch.position, ch.category_id,
+            frozenset((target.id, *(p.value for p in perm.pair())) for target, perm in ch.overwrites.items()))
+
+
+def reconcile(guild: discord.Guild, roles: list, channels: list) -> list[str]:
+    # REST で取得したもの（正）とキャッシュの差分
+    out = []
+    for label, fetched, cached, state in (('ロール', roles, guild.roles, _role_state),
+                                          ('チャンネル', channels, guild.channels, _channel_state)):
+        fresh = {x.id: x for x in fetched}
+        cache = {x.id: x for x in cached}
+        missing = [fresh[i] for i in fresh.keys() - cache.keys()]
+        stale = [cache[i] for i in cache.keys() - fresh.keys()]
+        changed = [fresh[i] for i in fresh.keys() & cache.keys() if state(fresh[i]) != state(cache[i])]
+        if missing:
+            out.append(f'キャッシュに無い{label} {len(missing)} 件（{_names(missing)}）')
+        if stale:
+            out.append(f'削除済みなのにキャッシュに残っている{label} {len(stale)} 件（{_names(stale)}）')
+        if changed:
+            out.append(f'キャッシュと内容が違う{label} {len(changed)} 件（{_names(changed)}）')
+    return out
+
+
+class GuildView:
+    # serialize.py が読む Guild の属性（roles・categories・text_channels など）を、
+    # キャッシュまたは REST で取得したロール・チャンネルで持つ
+    def __init__(self, guild: discord.Guild, roles, channels):
+        self.guild = guild
+        self.id = guild.id
+        self.name = guild.name
+        self.roles = sorted(roles)
+        self.channels = list(channels)
+        self.categories = self._of(discord.CategoryChannel)
+        self.text_channels = self._of(discord.TextChannel)
+        self.voice_channels = self._of(discord.VoiceChannel)
+        self._category_names = {c.id: c.name for c in self.categories}
+
+    def _of(self, cls) -> list:
+        return sorted((c for c in self.channels if isinstance(c, cls)), key=lambda c: (c.position, c.id))
+
+    def serialize(self, name: str, codec=None) -> list:
+        items = SERIALIZERS[name](self, codec)
+        if name in _CHANNEL_SECTIONS:
+            # 親カテゴリの名前はキャッシュではなく、同じ取り方で読んだカテゴリから引く
+            for item in items:
+                item['category'] = self._category_names.get(item['category_id'])
+        return items
+
+
+@dataclass
+class ViewReport:
+    requested: str
+    mode: str = 'cache'
+    # 段階ごとの所要時間（秒）: cache_check / fetch / reconcile
+    timings: dict = field(default_factory=dict)
+    # キャッシュの確認で見つかった問題・REST の結果とキャッシュの差分
+    issues: list = field(default_factory=list)
+    mismatches: list = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {'requested': self.requested, 'mode': self.mode,
+                'timings': {k: round(v, 4) for k, v in self.timings.items()},
+                'issues': self.issues, 'mismatches': self.mismatches}
+
+    def summary(self) -> str:
+        parts = [f"{label} {self.timings[key] * 1000:.0f} ms"
+                 for key, label in (('cache_check', 'キャッシュ確認'), ('fetch', '取得'), ('reconcile', '突き合わせ'))
+                 if key in self.timings]
+        head = f"🔎 読み込み: {_MODE_LABELS[self.mode]}（{'・'.join(parts)}）"
+        if self.requested == 'auto' and self.mode == 'fetch':
+            head += '。キャッシュが揃っていないため REST で取得しました'
+        lines = [head]
+        if self.issues:
+            lines.append(('⚠️ ' if self.mode == 'cache' else '') + 'キャッシュの問題: ' + ' / '.join(self.issues))
+        if self.mode == 'fetch':
+            lines.append('キャッシュとの差分: ' + (' / '.join(self.mismatches) if self.mismatches else 'なし'))
+        return '\n'.join(lines)
+
+
+async def read_guild(guild: discord.Guild, mode: str = BACKUP_MODE,
+                     intents: discord.Intents | None = None) -> tuple[GuildView, ViewReport]:
+    if mode not in BACKUP_MODES:
+        raise ValueError(f'不明な取り方です: {mode}（{", ".join(BACKUP_MODES)} から選んでください）')
+    report = ViewReport(mode)
+    if mode != 'fetch':
+        start = time.perf_counter()
+        report.issues = check_cache(guild, intents)
+        report.timings['cache_check'] = time.perf_counter() - start
+        if mode == 'cache' or not report.issues:
+            return GuildView(guild, guild.roles, guild.channels), report
+
+    report.mode = 'fetch'
+    start = time.perf_counter()
+    roles, channels = await asyncio.gather(guild.fetch_roles(), guild.fetch_channels())
+    report.timings['fetch'] = time.perf_counter() - start
+    start = time.perf_counter()
+    report.mismatches = reconcile(guild, roles, channels)
+    report.timings['reconcile'] = time.perf_counter() - start
+    return GuildView(guild, roles, channels), report
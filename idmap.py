@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+import time
+
+from store import write_atomic
+
+# 元ギルドの ID → 復元先ギルドの ID の対応表。
+#   <root>/<復元先ギルド>/<元ギルド>.json   {"roles": {元ID: 新ID}, "channels": {...}, "threads": {...}}
+# 復元で作成・対応付けしたものを記録しておき、次の復元（中断後のやり直しを含む）では
+# 名前ではなくこの表で既存のロール・チャンネルを引く。同名のロールやチャンネルがあっても取り違えない。
+
+KINDS = ('roles', 'channels', 'threads')
+
+
+class IdMap:
+    def __init__(self, path: str | None, source_guild_id, target_guild_id, data: dict | None = None):
+        self.path = path
+        self.source_guild_id = source_guild_id
+        self.target_guild_id = target_guild_id
+        self._lock = threading.Lock()
+        self._maps: dict[str, dict[str, int]] = {kind: dict((data or {}).get(kind) or {}) for kind in KINDS}
+        self.dirty = False
+
+    def get(self, kind: str, old_id) -> int | None:
+        if old_id is None:
+            return None
+        return self._maps[kind].get(str(old_id))
+
+    def set(self, kind: str, old_id, new_id):
+        if old_id is None or new_id is None:
+            return
+        key = str(old_id)
+        with self._lock:
+            if self._maps[kind].get(key) != new_id:
+                self._maps[kind][key] = new_id
+                self.dirty = True
+
+    def targets(self, kind: str) -> frozenset[int]:
+        # 対応付け済みの復元先 ID
+        with self._lock:
+            return frozenset(self._maps[kind].values())
+
+    def __len__(self) -> int:
+        return sum(len(m) for m in self._maps.values())
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        with self._lock:
+            data = {
+                'source_guild_id': str(self.source_guild_id),
+                'target_guild_id': str(self.target_guild_id),
+                'updated_at': time.time(),
+                **{kind: dict(m) for kind, m in self._maps.items()},
+            }
+            self.dirty = False
+        write_atomic(self.path, json.dumps(data, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+
+
+class IdMapStore:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, source_guild_id, target_guild_id) -> str:
+        return os.path.join(self.root, str(target_guild_id), f'{source_guild_id}.json')
+
+    def load(self, source_guild_id, target_guild_id) -> IdMap:
+        path = self._path(source_guild_id, target_guild_id)
+        data = None
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        return IdMap(path, source_guild_id, target_guild_id, data)
@@ -0,0 +1,313 @@
+import functools
+import itertools
+import os
+
+import discord
+
+from archive import MessageArchive, archive_guild
+from clone import open_source
+from assets import AssetDownloader, AssetStore, collect_attachments, collect_guild_assets, restore_assets
+from codec import OverwriteCodec
+from guildview import BACKUP_MODE, read_guild
+from idmap import IdMapStore
+from journal import RestoreJournal
+from metrics import PhaseTimer, loop_lag, phase
+from planner import ACTION_LABELS, apply_plan, apply_stream, plan_restore
+from progress import ProgressReporter
+from ratelimit import RestoreExecutor
+from replay import ReplayJournal, replay_all, resolve_targets
+from selection import RestoreFilter
+from snapshot import load_legacy, load_snapshot
+from store import SnapshotStore, backup_dir, run_io
+from validate import PlanValidator
+from threads import finalize_threads, restore_threads, serialize_threads
+
+# バックアップ・復元の本体。スラッシュコマンド（bot.py）と CLI（cli.py）の両方から使う。
+# 進捗は progress（文字列を受け取るコルーチン関数）に渡すだけで、表示先は呼び出し側が決める。
+
+class Backups:
+    # 保存先ディレクトリ以下のストア一式
+    def __init__(self, root: str):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.snapshot_file = os.path.join(root, 'snapshot.dbak')
+        self.store = SnapshotStore(root)
+        self.messages = MessageArchive(os.path.join(root, 'messages'))
+        self.assets = AssetStore(os.path.join(root, 'assets'))
+        self.replay = ReplayJournal(os.path.join(root, 'replay'))
+        self.idmaps = IdMapStore(os.path.join(root, 'idmap'))
+        self.journal = RestoreJournal(os.path.join(root, 'journal'))
+
+
+@functools.cache
+def backups() -> Backups:
+    # 保存先は .env を読んだ後で決まるので、import 時ではなく最初に使うときに作る
+    return Backups(backup_dir())
+
+
+def load_backup(guild_id: int, snapshot_id: str | None = None) -> dict:
+    # ストアのスナップショットを優先し、無ければ単一ファイル → 旧形式（5 ファイル）の順に読む
+    b = backups()
+    if snapshot_id or b.store.latest(guild_id) is not None:
+        # スレッドは件数が多いので、復元で使うときにストアから少しずつ読む
+        return b.store.load(guild_id, snapshot_id, streamed=('threads',))
+    if os.path.exists(b.snapshot_file):
+        return load_snapshot(b.snapshot_file)
+    return load_legacy(b.root)
+
+
+def source_guild(guild_id: int, snapshot_id: str | None) -> int:
+    # 別ギルドのスナップショット（ギルドID/スナップショットID）ならそのギルドのアーカイブ・ID 対応表を使う
+    return int(snapshot_id.split('/', 1)[0]) if snapshot_id and '/' in snapshot_id else guild_id
+
+
+def pin_snapshot(guild_id: int, snapshot_id: str | None) -> str | None:
+    # 「最新」で始めた復元も、再開したときに同じスナップショットを読むよう ID を固定して記録する
+    snap = backups().store.find(guild_id, snapshot_id)
+    if snap is None:
+        return snapshot_id
+    if snapshot_id and '/' in snapshot_id:
+        return f"{snapshot_id.split('/', 1)[0]}/{snap['id']}"
+    return snap['id']
+
+
+async def run_backup(guild: discord.Guild, progress, messages: bool = False, assets: bool = False,
+                     threads: bool = False, trigger: str = 'manual', changes: list | None = None,
+                     mode: str | None = None, intents: discord.Intents | None = None) -> str:
+    # 段階ごとの所要時間・リクエスト数を完了メッセージに添える。intents は Bot の Intents（キャッシュの確認に使う）
+    with PhaseTimer('backup', guild.id) as timer:
+        text = await _run_backup(guild, progress, messages, assets, threads, trigger, changes, mode or BACKUP_MODE,
+                                 intents)
+    return f'{text}\n{timer.summary()}'
+
+
+async def _run_backup(guild: discord.Guild, progress, messages: bool, assets: bool, threads: bool, trigger: str,
+                      changes: list | None, mode: str, intents: discord.Intents | None) -> str:
+    lag_mark = loop_lag.mark()
+    # ロール・チャンネルをキャッシュか REST のどちらから読むか（guildview.py）
+    with phase('read', '読み込み'):
+        view, view_report = await read_guild(guild, mode, intents)
+    # セクションごとにストアへ書き込む（変化のないセクションは既存オブジェクトを指すだけ）
+    snap = backups().store.writer(guild.id, meta={'guild_id': guild.id, 'guild_name': guild.name,
+                                                  'trigger': trigger, 'changes': (changes or [])[-100:], 'read': view_report.to_dict()})
+    codec = OverwriteCodec()
+
+    with phase('structure', '構成'):
+        await progress('🧩 ロールをバックアップ中…')
+        roles = view.serialize('roles', codec)
+        await run_io(snap.add, 'roles', roles)
+        await progress(f'✅ ロール {len(roles)} 件を保存。次：カテゴリ…')
+
+        await progress('📁 カテゴリをバックアップ中…')
+        categories = view.serialize('categories', codec)
+        await run_io(snap.add, 'categories', categories)
+        await progress(f'✅ カテゴリ {len(categories)} 件を保存。次：テキストチャンネル…')
+
+        await progress('💬 テキストチャンネルをバックアップ中…')
+        text_channels = view.serialize('text', codec)
+        await run_io(snap.add, 'text', text_channels)
+        await progress(f'✅ テキストチャンネル {len(text_channels)} 件を保存。次：フォーラム…')
+
+        await progress('📚 フォーラムをバックアップ中…')
+        forum_channels = view.serialize('forum', codec)
+        await run_io(snap.add, 'forum', forum_channels)
+        await progress(f'✅ フォーラム {len(forum_channels)} 件を保存。次：ボイスチャンネル…')
+
+        await progress('🔈 ボイスチャンネルをバックアップ中…')
+        voice_channels = view.serialize('voice', codec)
+        await run_io(snap.add, 'voice', voice_channels)
+    thread_part = ''
+    if threads:
+        with phase('threads', 'スレッド'):
+            async with ProgressReporter(progress) as reporter:
+                reporter.update('🧵 スレッドをバックアップ中…')
+                # ページごとにストアへ書き進める（全スレッドのレコードをメモリに溜めない）
+                stream = await run_io(snap.stream, 'threads')
+                try:
+                    async for page in serialize_threads(guild, progress=reporter):
+                        await run_io(stream.write, page)
+                except BaseException:
+                    await run_io(stream.abort)
+                    raise
+            thread_entry = await run_io(snap.add_stream, stream)
+        thread_part = f"・スレッド {thread_entry['count']} 件"
+    with phase('store', '保存'):
+        if assets:
+            asset_entries, downloads = collect_guild_assets(guild)
+            await run_io(snap.add, 'assets', asset_entries)
+        entry = await run_io(snap.close)
+        removed = await run_io(backups().store.apply_retention, guild.id)
+
+    archive_summary = ''
+    if messages:
+        # 今回保存した segment の添付だけを拾えるよう、保存前の各チャンネルの位置を覚えておく
+        archived = await run_io(lambda: {cp['id']: cp['last_id'] for cp in backups().messages.list_channels(guild.id)})
+        await progress('📝 メッセージ履歴を保存中…')
+        with phase('messages', 'メッセージ'):
+            async with ProgressReporter(progress) as reporter:
+                report = await archive_guild(backups().messages, guild, progress=reporter)
+        archive_summary = '\n' + report.summary()
+
+    if assets:
+        with phase('assets', 'アセット'):
+            if messages:
+                downloads = itertools.chain(downloads, collect_attachments(backups().messages, guild.id,
+                                                                           after=archived))
+            await progress('🖼️ アセットを保存中…')
+            async with AssetDownloader(backups().assets) as downloader:
+                asset_report = await downloader.fetch_all(downloads)
+        archive_summary += '\n' + asset_report.summary()
+
+    return (
+        f'🎉 バックアップ完了（ID: `{entry["id"]}`）。ロール {len(roles)} 件・カテゴリ {len(categories)} 件・'
+        f'テキスト {len(text_channels)} 件・フォーラム {len(forum_channels)} 件・ボイス {len(voice_channels)} 件{thread_part}を保存しました。'
+        f'\n新規セクション {entry["new_objects"]}/{len(entry["sections"])}・保持ポリシーで削除 {len(removed)} 件・{loop_lag.summary(lag_mark)}'
+        f'\n{view_report.summary()}'
+        f'{archive_summary}'
+    )
+
+
+def select(backup: dict, only: dict | None):
+    # 部分復元の条件（RestoreFilter.to_dict()。ジャーナルの options['only'] に残す）をバックアップに当てはめる
+    flt = RestoreFilter.from_dict(only)
+    return flt.resolve(backup) if flt else None
+
+
+async def plan_text(guild: discord.Guild, backup: dict, source_guild_id: int, run=None, only: dict | None = None) -> str:
+    # 現在のギルドとの差分から必要な操作だけを組み立てる（元 ID → 対応表 → 名前の順に対応付ける）
+    idmap = await run_io(backups().idmaps.load, source_guild_id, guild.id)
+    if run is not None:
+        run.apply_to(idmap)
+        only = run.options.get('only')
+    return plan_restore(guild, backup, idmap, select(backup, only), PlanValidator(guild)).render()
+
+
+async def _may_read(source_guild_id: int, guild: discord.Guild, authorize) -> bool:
+    # 別ギルドのアーカイブは、呼び出し側が権限を確かめられたときだけ読む
+    if source_guild_id == guild.id:
+        return True
+    return authorize is not None and bool(await authorize(source_guild_id))
+
+
+async def run_restore(client: discord.Client, guild: discord.Guild, backup: dict, run, progress, authorize=None) -> str:
+    # 段階ごとの所要時間・リクエスト数を完了メッセージに添える。
+    # authorize は別ギルドのデータ（メッセージ履歴）を使ってよいかを返すコルーチン関数（引数は元ギルドの ID）
+    with PhaseTimer('restore', guild.id) as timer:
+        text = await _run_restore(client, guild, backup, run, progress, authorize)
+    return f'{text}\n{timer.summary()}'
+
+
+async def _run_restore(client: discord.Client, guild: discord.Guild, backup: dict, run, progress, authorize=None) -> str:
+    # ジャーナル（run）に 1 操作ずつ結果を書きながら復元する。再開時も同じ流れで、
+    # ジャーナルと ID 対応表から作成済みのものを引くので、残りの操作だけが実行される
+    options = run.options
+    source_guild_id = int(run.info['source_guild_id'])
+    lag_mark = loop_lag.mark()
+    idmap = await run_io(backups().idmaps.load, source_guild_id, guild.id)
+    run.apply_to(idmap)
+    executor = RestoreExecutor()
+    selection = select(backup, options.get('only'))
+    try:
+        # 送っても失敗する操作は、リクエストを送る前に外す・直す（validate.py）
+        plan = plan_restore(guild, backup, idmap, selection, PlanValidator(guild))
+        done = await apply_plan(plan, guild, client.http, executor, progress, idmap, run)
+        await run_io(run.phase, 'structure')
+
+        extra_summary = '\n' + plan.validation.summary() if plan.validation else ''
+        if options.get('assets') and backup.get('assets') and 'assets' not in run.phases:
+            with phase('assets', 'アセット'):
+                asset_report = await restore_assets(guild, backup['assets'], backups().assets, executor, progress, idmap)
+            extra_summary += '\n' + asset_report.summary()
+            await run_io(run.phase, 'assets')
+
+        # スレッドは再開時もやり直す（作成済みのものは対応表・名前で見つかるので作られない）
+        thread_result = None
+        thread_records = backup.get('threads') or []
+        if selection is not None:
+            # 部分復元では選んだチャンネルのスレッド・メッセージだけを戻す（レコードは restore_threads が少しずつ取り出す）
+            thread_records = (t for t in thread_records if selection.allows_thread(t))
+        if options.get('threads') and backup.get('threads'):
+            with phase('threads', 'スレッド'):
+                async with ProgressReporter(progress) as reporter:
+                    reporter.update('🧵 スレッドを復元中…')
+                    thread_result = await restore_threads(guild, thread_records, executor, reporter, idmap=idmap)
+            extra_summary += '\n' + thread_result.summary()
+            await run_io(idmap.save)
+            await run_io(run.phase, 'threads')
+
+        replay = options.get('messages') and 'messages' not in run.phases
+        if replay and not await _may_read(source_guild_id, guild, authorize):
+            # 確かめられないときは再投稿しない（phase は記録しないので、権限のある人が再開すれば続きから戻せる）
+            extra_summary += f'\n⚠️ 別ギルド（{source_guild_id}）のメッセージ履歴は、権限を確認できないため再投稿しませんでした'
+            replay = False
+        if replay:
+            sources = await run_io(backups().messages.list_channels, source_guild_id)
+            if selection is not None:
+                sources = [s for s in sources if selection.allows_source(s)]
+            await progress(f'📨 メッセージ履歴を再投稿中…（{len(sources)} チャンネル）')
+            with phase('messages', 'メッセージ'):
+                targets, missing = await resolve_targets(guild, sources,
+                                                         thread_result.thread_map if thread_result else None, idmap)
+                async with ProgressReporter(progress) as reporter:
+                    replay_report = await replay_all(backups().messages, source_guild_id, targets, backups().replay,
+                                                     guild.id, assets=backups().assets, progress=reporter)
+            extra_summary += '\n' + replay_report.summary()
+            if missing:
+                extra_summary += f'\n復元先が見つからないチャンネル {len(missing)} 件: ' + '、'.join(f'#{n}' for n in missing[:10])
+            if not replay_report.failures:
+                await run_io(run.phase, 'messages')
+
+        if thread_result is not None and thread_result.pending:
+            # アーカイブ・ロックは再投稿の後で戻す
+            with phase('threads', 'スレッド'):
+                await finalize_threads(thread_result, executor)
+    finally:
+        await run_io(idmap.save)
+    await run_io(run.end)
+
+    return (
+        '🎉 復元完了。'
+        + '・'.join(f'{ACTION_LABELS[a]} {n} 件' for a, n in done.items())
+        + extra_summary
+        + f'\n（{executor.summary()}・{loop_lag.summary(lag_mark)}）'
+    )
+
+
+async def run_clone(client: discord.Client, source: str, target: discord.Guild, progress) -> str:
+    # 段階ごとの所要時間・リクエスト数を完了メッセージに添える
+    with PhaseTimer('clone', target.id) as timer:
+        text = await _run_clone(client, source, target, progress)
+    return f'{text}\n{timer.summary()}'
+
+
+async def _run_clone(client: discord.Client, spec: str, target: discord.Guild, progress) -> str:
+    # source はギルド ID・ギルドID/スナップショットID・テンプレートの URL（clone.open_source）。
+    # 元を読み終える前から複製先の作成を始め、ジャーナルには復元と同じ形で 1 操作ずつ書く
+    source = await open_source(client, backups().store, spec)
+    if source.guild_id == target.id:
+        raise ValueError('複製元と複製先が同じギルドです')
+    lag_mark = loop_lag.mark()
+    idmap = await run_io(backups().idmaps.load, source.guild_id, target.id)
+    run = await run_io(backups().journal.begin, target.id, source.snapshot, source.guild_id, {'clone': source.label})
+
+    async def _saved(snapshot: str):
+        await run_io(run.pin, snapshot)
+    source.on_saved = _saved
+
+    executor = RestoreExecutor()
+    validator = PlanValidator(target)
+    await progress(f'🧬 {source.label} を複製中…')
+    try:
+        done = await apply_stream(source, target, client.http, executor, progress, idmap, run, validator)
+        await run_io(run.phase, 'structure')
+    finally:
+        await run_io(idmap.save)
+    await run_io(run.end)
+
+    return (
+        f'🎉 複製完了（{source.label} → {target.name}'
+        + (f'・スナップショット `{source.snapshot}`' if source.snapshot else '') + '）。'
+        + '・'.join(f'{ACTION_LABELS[a]} {n} 件' for a, n in done.items())
+        + ('\n' + validator.report.summary() if validator.report else '')
+        + f'\n（{executor.summary()}・{loop_lag.summary(lag_mark)}）'
+    )
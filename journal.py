@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+
+# 復元の操作ジャーナル（追記専用）。ギルドごとに直近 1 回分の復元を
+#   <root>/<guild_id>.ndjson   1 行 1 レコード
+# として残す。レコードは
+#   begin   復元の開始（スナップショット・元ギルド・オプション）
+#   snapshot 読みながら保存したスナップショット（複製。begin の時点ではまだ ID が無い）
+#   status  進捗を表示しているメッセージ（チャンネル ID・メッセージ ID）
+#   plan    実行する操作の一覧（作成・編集・移動）
+#   op      操作 1 件の結果（作成・対応付けた ID。失敗なら理由）
+#   phase   段階（構成・アセット・スレッド・メッセージ）の完了
+#   end     復元の完了
+# 1 行ずつ fsync してから次の操作に進むので、落ちても書き終えた操作は失われない。
+# 最後の行が書きかけで切れていたら、読み込むときに切り落としてから続きを追記する。
+
+PHASES = ('structure', 'assets', 'threads', 'messages')
+
+_ID_KINDS = {'role': 'roles', 'category': 'channels', 'text': 'channels', 'forum': 'channels', 'voice': 'channels'}
+
+
+def op_key(kind: str, stored: dict) -> str:
+    ref = stored.get('id')
+    return f"{kind}:{ref if ref is not None else stored.get('name')}"
+
+
+class RestoreRun:
+    def __init__(self, path: str, records: list[dict] | None = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.info: dict = {}
+        self.status: dict | None = None
+        self.planned: dict[str, str] = {}
+        self.ops: dict[str, dict] = {}
+        self.phases: set[str] = set()
+        self.finished = False
+        for record in records or []:
+            self._apply(record)
+
+    def _apply(self, record: dict):
+        rtype = record.get('type')
+        if rtype == 'begin':
+            self.info = record
+        elif rtype == 'snapshot':
+            self.info['snapshot'] = record['snapshot']
+        elif rtype == 'status':
+            self.status = record
+        elif rtype == 'plan':
+            self.planned.update({item['key']: item['action'] for item in record.get('ops') or []})
+        elif rtype == 'op':
+            self.ops[record['key']] = record
+        elif rtype == 'phase':
+            self.phases.add(record['phase'])
+        elif rtype == 'end':
+            self.finished = True
+
+    def append(self, record: dict):
+        record = dict(record, at=time.time())
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(record)
+
+    # --- 書き込み（run_io 経由で呼ぶ） ---
+
+    def set_status(self, channel_id, message_id):
+        self.append({'type': 'status', 'channel_id': channel_id, 'message_id': message_id})
+
+    def pin(self, snapshot: str):
+        self.append({'type': 'snapshot', 'snapshot': snapshot})
+
+    def plan(self, ops):
+        self.append({'type': 'plan', 'ops': [{'key': op_key(op.kind, op.stored), 'action': op.action} for op in ops]})
+
+    def op(self, kind: str, stored: dict, action: str, new_id=None, error: BaseException | None = None):
+        record = {'type': 'op', 'key': op_key(kind, stored), 'kind': kind, 'old_id': stored.get('id'),
+                  'action': action, 'new_id': new_id, 'ok': error is None}
+        if error is not None:
+            record['error'] = f'{type(error).__name__}: {error}'[:300]
+        self.append(record)
+
+    def phase(self, name: str):
+        self.append({'type': 'phase', 'phase': name})
+
+    def end(self):
+        self.append({'type': 'end'})
+
+    # --- 読み出し ---
+
+    @property
+    def options(self) -> dict:
+        return self.info.get('options') or {}
+
+    def completed(self) -> int:
+        return sum(1 for key in self.planned if self.ops.get(key, {}).get('ok'))
+
+    def failed(self) -> int:
+        return sum(1 for key in self.planned if key in self.ops and not self.ops[key].get('ok'))
+
+    def apply_to(self, idmap):
+        # 成功した操作の ID を対応表に戻す（対応表は段階ごとにしか保存していないため）
+        for record in self.ops.values():
+            if record.get('ok') and record.get('old_id') is not None and record.get('new_id') is not None:
+                idmap.set(_ID_KINDS[record['kind']], record['old_id'], record['new_id'])
+
+    def summary(self) -> str:
+        return (f"操作 {len(self.planned)} 件中 完了 {self.completed()} 件・失敗 {self.failed()} 件・"
+                f"完了した段階: {'、'.join(p for p in PHASES if p in self.phases) or 'なし'}")
+
+
+class RestoreJournal:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, guild_id) -> str:
+        return os.path.join(self.root, f'{guild_id}.ndjson')
+
+    def begin(self, guild_id, snapshot: str | None, source_guild_id, options: dict) -> RestoreRun:
+        # 新しい復元を始めるたびに前回分を置き換える
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(guild_id)
+        open(path, 'w', encoding='utf-8').close()
+        run = RestoreRun(path)
+        run.append({'type': 'begin', 'guild_id': guild_id, 'snapshot': snapshot,
+                    'source_guild_id': source_guild_id, 'options': options})
+        return run
+
+    def load(self, guild_id) -> RestoreRun | None:
+        path = self._path(guild_id)
+        if not os.path.exists(path):
+            return None
+        records = []
+        valid = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+                if not line.endswith(b'\n'):
+                    records.pop()
+                    break
+                valid += len(line)
+        if valid != os.path.getsize(path):
+            # 書きかけの最後の行を切り落とす（続けて追記する行とくっつかないように）
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+        if not records or records[0].get('type') != 'begin':
+            return None
+        return RestoreRun(path, records)
@@ -0,0 +1,92 @@
+import asyncio
+
+import discord
+
+# 復元 1 回分のメンバー解決キャッシュ。
+# スナップショット中のメンバー宛て上書きの ID を先に集めてまとめて問い合わせ、
+# 見つからなかった ID も None として覚えておく（同じ ID は 1 回しか問い合わせない）。
+
+QUERY_CHUNK = 100
+FETCH_CONCURRENCY = 4
+
+
+def collect_member_ids(entries) -> set[int]:
+    ids = set()
+    for entry in entries:
+        for target_id, perm in (entry.get('overwrites') or {}).items():
+            if perm.get('target_type') == 'member':
+                try:
+                    ids.add(int(target_id))
+                except (TypeError, ValueError):
+                    pass
+    return ids
+
+
+class MemberResolver:
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self._cache: dict[int, discord.Member | None] = {}
+        self._inflight: dict[int, asyncio.Future] = {}
+        self.queries = 0
+        self.fetches = 0
+
+    def _from_cache(self, member_id: int):
+        member = self.guild.get_member(member_id)
+        if member is not None:
+            self._cache[member_id] = member
+        return member
+
+    async def prefetch(self, ids):
+        missing = [i for i in set(ids) if i not in self._cache and self._from_cache(i) is None]
+        if not missing:
+            return
+        # まずゲートウェイの REQUEST_GUILD_MEMBERS で 100 件ずつまとめて引く
+        try:
+            for start in range(0, len(missing), QUERY_CHUNK):
+                chunk = missing[start:start + QUERY_CHUNK]
+                found = await self.guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+                self.queries += 1
+                for member in found:
+                    self._cache[member.id] = member
+                for member_id in chunk:
+                    self._cache.setdefault(member_id, None)
+            return
+        except Exception:
+            # members intent 無し・タイムアウトなど
+            pass
+        # ゲートウェイで引けない場合は REST で 1 件ずつ（同時数を絞る）
+        sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def _one(member_id):
+            async with sem:
+                await self.resolve(member_id)
+
+        await asyncio.gather(*(_one(i) for i in missing if i not in self._cache))
+
+    async def resolve(self, member_id: int) -> discord.Member | None:
+        if member_id in self._cache:
+            return self._cache[member_id]
+        if self._from_cache(member_id) is not None:
+            return self._cache[member_id]
+        pending = self._inflight.get(member_id)
+        if pending is not None:
+            return await pending
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[member_id] = future
+        try:
+            self.fetches += 1
+            try:
+                member = await self.guild.fetch_member(member_id)
+            except discord.HTTPException:
+                member = None
+            self._cache[member_id] = member
+            future.set_result(member)
+            return member
+        finally:
+            self._inflight.pop(member_id, None)
+            if not future.done():
+                future.set_result(None)
+
+    def summary(self) -> str:
+        hits = sum(1 for m in self._cache.values() if m is not None)
+        return f'メンバー {hits}/{len(self._cache)} 件を解決（一括問い合わせ {self.queries} 回・個別取得 {self.fetches} 回）'
@@ -0,0 +1,320 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import os
+import re
+import time
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# Discord API 呼び出しの計測。
+# discord.py の HTTP クライアント（aiohttp のセッション）に TraceConfig を差し込み、実際に送ったリクエスト
+# 1 件ごとにルート別の応答時間・ステータス・429・エラーの種類を記録する（discord.py 内部のリトライも 1 件ずつ数える）。
+# 記録は METRICS_PORT で Prometheus のテキスト形式として公開し、バックアップ/復元では段階ごとの
+# 所要時間・リクエスト数を完了メッセージに添える（ENABLE_OTEL_TRACING=1 なら段階ごとに OpenTelemetry のスパンも作る）。
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 0)
+OTEL_TRACING = os.getenv('ENABLE_OTEL_TRACING', '0').lower() in ('1', 'true', 'yes')
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class LoopLagMonitor:
+    # 一定間隔で sleep し、予定より何秒遅れて起きたかを記録する。
+    # 同期 I/O などでイベントループが止まっていると、その分だけ遅延が大きくなる
+    def __init__(self, interval: float = 0.1, window: float = 600.0):
+        self.interval = interval
+        self.window = window
+        self.samples: collections.deque[tuple[float, float]] = collections.deque()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            self.samples.append((now, max(0.0, now - expected)))
+            while self.samples and self.samples[0][0] < now - self.window:
+                self.samples.popleft()
+
+    def mark(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def stats(self, since: float | None = None) -> dict:
+        lags = sorted(lag for t, lag in self.samples if since is None or t >= since)
+        if not lags:
+            return {'samples': 0, 'max': 0.0, 'p99': 0.0, 'avg': 0.0}
+        return {
+            'samples': len(lags),
+            'max': lags[-1],
+            'p99': lags[min(len(lags) - 1, int(len(lags) * 0.99))],
+            'avg': sum(lags) / len(lags),
+        }
+
+    def summary(self, since: float | None = None) -> str:
+        s = self.stats(since)
+        return f'ループ遅延 最大 {s["max"] * 1000:.0f} ms・p99 {s["p99"] * 1000:.0f} ms'
+
+
+loop_lag = LoopLagMonitor()
+
+
+def route_of(method: str, path: str) -> str:
+    # /api/v10/guilds/123/channels → "POST /guilds/{guild_id}/channels"（ID・トークンを伏せてルート単位にまとめる）
+    parts = []
+    for part in re.sub(r'^/api/v\d+', '', path).strip('/').split('/'):
+        prev = parts[-1] if parts else ''
+        if part.isdigit():
+            parts.append('{' + prev.rstrip('s') + '_id}' if prev and not prev.startswith('{') else '{id}')
+        elif prev in ('{webhook_id}', '{interaction_id}'):
+            parts.append('{token}')
+        else:
+            parts.append(part)
+    return f"{method} /{'/'.join(parts)}"
+
+
+def _error_name(status: int) -> str | None:
+    # discord.py が投げる例外の名前に合わせる（429 はリトライされるので rate_limited の方で数える）
+    if status < 400 or status == 429:
+        return None
+    return {403: 'Forbidden', 404: 'NotFound'}.get(
+        status, 'DiscordServerError' if status >= 500 else 'HTTPException')
+
+
+class _Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+# 実行中の段階（PhaseTimer.phase の中なら、その段階の集計）。リクエストを段階ごとにも数えるのに使う
+_current_phase: contextvars.ContextVar = contextvars.ContextVar('discord_phase', default=None)
+
+
+class ApiMetrics:
+    def __init__(self):
+        self.latency: dict[str, _Histogram] = {}
+        self.requests: collections.Counter = collections.Counter()      # (route, status)
+        self.rate_limited: collections.Counter = collections.Counter()  # (route, scope)
+        self.errors: collections.Counter = collections.Counter()        # (route, error)
+        self.retries: collections.Counter = collections.Counter()       # layer
+        self.auto_backups: collections.Counter = collections.Counter()  # (trigger, result)
+        self.auto_backup_errors: collections.Counter = collections.Counter()  # (trigger, error)
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        config = aiohttp.TraceConfig()
+        config.on_request_start.append(self._on_start)
+        config.on_request_end.append(self._on_end)
+        config.on_request_exception.append(self._on_exception)
+        return config
+
+    async def _on_start(self, session, ctx: SimpleNamespace, params):
+        ctx.start = time.perf_counter()
+
+    async def _on_end(self, session, ctx: SimpleNamespace, params):
+        status = params.response.status
+        scope = params.response.headers.get('X-RateLimit-Scope') or 'user'
+        self.record(route_of(params.method, params.url.path), status, time.perf_counter() - ctx.start, scope=scope)
+
+    async def _on_exception(self, session, ctx: SimpleNamespace, params):
+        self.record(route_of(params.method, params.url.path), 0, time.perf_counter() - ctx.start,
+                    error=type(params.exception).__name__)
+
+    def record(self, route: str, status: int, elapsed: float, scope: str = 'user', error: str | None = None):
+        hist = self.latency.get(route)
+        if hist is None:
+            hist = self.latency[route] = _Histogram()
+        hist.observe(elapsed)
+        self.requests[(route, str(status or 'error'))] += 1
+        error = error or _error_name(status)
+        if status == 429:
+            self.rate_limited[(route, scope)] += 1
+        if error is not None:
+            self.errors[(route, error)] += 1
+        # discord.py は 429・5xx・接続エラーを自分でリトライする
+        if status == 429 or status >= 500 or status == 0:
+            self.retries['http'] += 1
+        stats = _current_phase.get()
+        if stats is not None:
+            stats['requests'] += 1
+            stats['rate_limited'] += status == 429
+            stats['errors'] += error is not None
+
+    def retry(self, layer: str = 'executor'):
+        # RestoreExecutor など、discord.py の外でのリトライ
+        self.retries[layer] += 1
+
+    def auto_backup(self, trigger: str, result: str, error: BaseException | None = None):
+        # 自動バックアップ 1 回分の結果（full / incremental / skipped / failed）
+        self.auto_backups[(trigger, result)] += 1
+        if error is not None:
+            self.auto_backup_errors[(trigger, type(error).__name__)] += 1
+
+    def render(self) -> str:
+        # Prometheus のテキスト形式
+        lines = [
+            '# HELP discord_api_request_duration_seconds Discord API の応答時間（ルート別）',
+            '# TYPE discord_api_request_duration_seconds histogram',
+        ]
+        for route, hist in sorted(self.latency.items()):
+            label = _labels(route=route)
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f'discord_api_request_duration_seconds_bucket{_labels(route=route, le=bound)} {count}')
+            lines.append(f'discord_api_request_duration_seconds_bucket{_labels(route=route, le="+Inf")} {hist.count}')
+            lines.append(f'discord_api_request_duration_seconds_sum{label} {hist.sum:.6f}')
+            lines.append(f'discord_api_request_duration_seconds_count{label} {hist.count}')
+        for name, help_text, counter, keys in (
+            ('discord_api_requests_total', 'Discord API のリクエスト数（ルート・ステータス別）', self.requests, ('route', 'status')),
+            ('discord_api_rate_limited_total', '429 の回数（ルート・スコープ別）', self.rate_limited, ('route', 'scope')),
+            ('discord_api_errors_total', 'エラー応答・例外の回数（ルート・種類別）', self.errors, ('route', 'error')),
+            ('auto_backup_total', '自動バックアップの回数（きっかけ・結果別）', self.auto_backups, ('trigger', 'result')),
+            ('auto_backup_errors_total', '自動バックアップの失敗（きっかけ・例外の種類別）', self.auto_backup_errors,
+             ('trigger', 'error')),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            lines += [f'{name}{_labels(**dict(zip(keys, key)))} {n}' for key, n in sorted(counter.items())]
+        lines += ['# HELP discord_api_retries_total リトライの回数（http: discord.py 内部、executor: 復元・一括削除）',
+                  '# TYPE discord_api_retries_total counter']
+        lines += [f'discord_api_retries_total{_labels(layer=layer)} {n}' for layer, n in sorted(self.retries.items())]
+        lag = loop_lag.stats()
+        lines += ['# HELP event_loop_lag_seconds イベントループの遅延（直近の窓）', '# TYPE event_loop_lag_seconds gauge',
+                  f'event_loop_lag_seconds{_labels(stat="max")} {lag["max"]:.6f}',
+                  f'event_loop_lag_seconds{_labels(stat="p99")} {lag["p99"]:.6f}']
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels) -> str:
+    def _escape(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class PhaseTimer:
+    # 1 回のバックアップ/復元の、段階ごとの所要時間とその間の API リクエスト数。
+    # with で囲んだ間は current_timer になり、下の phase() で段階を区切れる（引数で渡さなくてよい）
+    def __init__(self, operation: str, guild_id=None):
+        self.operation = operation
+        self.guild_id = guild_id
+        self.phases: dict[str, dict] = {}
+        self._token = None
+        self._span = None
+
+    def _start_span(self, name: str):
+        if not OTEL_TRACING or otel_trace is None:
+            return contextlib.nullcontext()
+        return otel_trace.get_tracer('discord-backup').start_as_current_span(
+            name, attributes={'guild.id': str(self.guild_id)})
+
+    def __enter__(self):
+        self._token = current_timer.set(self)
+        self._span = self._start_span(self.operation)
+        self._span.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.__exit__(exc_type, exc, tb)
+        current_timer.reset(self._token)
+        return False
+
+    @contextlib.contextmanager
+    def phase(self, name: str, label: str | None = None):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = {'label': label or name, 'elapsed': 0.0, 'requests': 0, 'rate_limited': 0,
+                                         'errors': 0}
+        token = _current_phase.set(stats)
+        start = time.perf_counter()
+        with self._start_span(f'{self.operation}.{name}') as span:
+            try:
+                yield stats
+            finally:
+                stats['elapsed'] += time.perf_counter() - start
+                _current_phase.reset(token)
+                if span is not None:
+                    span.set_attribute('discord.requests', stats['requests'])
+                    span.set_attribute('discord.rate_limited', stats['rate_limited'])
+                    span.set_attribute('discord.errors', stats['errors'])
+
+    def summary(self) -> str:
+        parts = []
+        for stats in self.phases.values():
+            part = f"{stats['label']} {stats['elapsed']:.1f} 秒"
+            if stats['requests']:
+                part += f"（{stats['requests']} 件"
+                part += f"・429 {stats['rate_limited']}" if stats['rate_limited'] else ''
+                part += f"・エラー {stats['errors']}" if stats['errors'] else ''
+                part += '）'
+            parts.append(part)
+        return '⏱️ ' + '・'.join(parts) if parts else ''
+
+
+current_timer: contextvars.ContextVar = contextvars.ContextVar('discord_phase_timer', default=None)
+
+
+@contextlib.contextmanager
+def phase(name: str, label: str | None = None):
+    # 実行中の PhaseTimer があれば、その段階として計る（無ければ何もしない）
+    timer = current_timer.get()
+    if timer is None:
+        yield None
+        return
+    with timer.phase(name, label) as stats:
+        yield stats
+
+
+class MetricsServer:
+    # GET /metrics で Prometheus のテキスト形式を返す
+    def __init__(self, metrics: ApiMetrics, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: web.AppRunner | None = None
+
+    async def _handle(self, request: web.Request):
+        return web.Response(text=self.metrics.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self):
+        if self._runner is not None or not self.port:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+api_metrics = ApiMetrics()
@@ -0,0 +1,741 @@
+import asyncio
+import itertools
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+# ベンチマーク用のローカル Discord モック（REST + ゲートウェイ）。
+# ルート単位の固定ウィンドウでレート制限し、超過時は本物と同じく 429 + retry_after を返す。
+# ギルドの状態（ロール・チャンネル・メッセージ）を持ち、REST での変更は接続中のゲートウェイへ
+# CHANNEL_CREATE などのイベントとして流すので、discord.py の Bot をそのまま接続して
+# スラッシュコマンド・ボタン（INTERACTION_CREATE）を実行できる。
+
+API_PREFIX = '/api/v10'
+BOT_USER_ID = '1'
+APPLICATION_ID = '2'
+OWNER_USER_ID = '3'
+ALL_PERMISSIONS = str((1 << 50) - 1)
+TIMESTAMP = '2024-01-01T00:00:00+00:00'
+
+# チャンネルの種類（Discord の channel type）
+TEXT, VOICE, CATEGORY, FORUM = 0, 2, 4, 15
+
+
+def _json(payload, status: int = 200, headers: dict | None = None) -> web.Response:
+    # 本物と同じく charset なしの application/json で返す（Webhook のアダプタは完全一致で判定する）
+    return web.Response(body=json.dumps(payload).encode('utf-8'), status=status,
+                        headers=dict(headers or {}, **{'Content-Type': 'application/json'}))
+
+
+async def _read_body(request: web.Request) -> dict:
+    # 添付ファイル付きは multipart の payload_json に本文が入る
+    if request.content_type.startswith('multipart/'):
+        body = {}
+        async for part in await request.multipart():
+            if part.name == 'payload_json':
+                body = await part.json()
+            else:
+                await part.read()
+        return body
+    return await request.json() if request.can_read_body else {}
+
+
+class _Unknown(Exception):
+    # 存在しないオブジェクトへの操作（本物と同じく 404 + エラーコード）
+    def __init__(self, message: str, code: int):
+        super().__init__(message)
+        self.code = code
+
+
+def _user(user_id: str, name: str, bot: bool = False) -> dict:
+    return {'id': user_id, 'username': name, 'global_name': None, 'discriminator': '0', 'avatar': None, 'bot': bot}
+
+
+def _member(user: dict, roles: list[str]) -> dict:
+    return {'user': user, 'roles': roles, 'nick': None, 'avatar': None, 'joined_at': TIMESTAMP,
+            'deaf': False, 'mute': False, 'flags': 0}
+
+
+def _overwrites(items) -> list[dict]:
+    return [{'id': str(o['id']), 'type': int(o.get('type', 0)), 'allow': str(o.get('allow', 0)),
+             'deny': str(o.get('deny', 0))} for o in items or ()]
+
+
+def _role_payload(role_id: str, body: dict, role: dict | None = None) -> dict:
+    role = dict(role or {
+        'id': role_id, 'name': 'new role', 'color': 0, 'hoist': False, 'position': 1, 'permissions': '0',
+        'managed': False, 'mentionable': False, 'flags': 0, 'icon': None, 'unicode_emoji': None,
+    })
+    for key in ('name', 'hoist', 'position', 'mentionable', 'managed', 'tags', 'icon', 'unicode_emoji'):
+        if key in body:
+            role[key] = body[key]
+    if 'permissions' in body:
+        role['permissions'] = str(body['permissions'])
+    if 'color' in body or 'colors' in body:
+        role['color'] = body['color'] if 'color' in body else (body['colors'] or {}).get('primary_color', 0)
+    role['colors'] = {'primary_color': role['color'] or 0, 'secondary_color': None, 'tertiary_color': None}
+    return role
+
+
+def _channel_payload(guild_id: str, channel_id: str, body: dict, ids, channel: dict | None = None) -> dict:
+    if channel is None:
+        channel = {'id': channel_id, 'guild_id': guild_id, 'type': body.get('type', TEXT), 'name': 'channel',
+                   'position': 0, 'parent_id': None, 'permission_overwrites': [], 'nsfw': False, 'topic': None,
+                   'rate_limit_per_user': 0, 'last_message_id': None, 'flags': 0}
+        if channel['type'] == VOICE:
+            channel.update(bitrate=64000, user_limit=0, rtc_region=None)
+        elif channel['type'] == FORUM:
+            channel.update(available_tags=[], default_reaction_emoji=None, default_thread_rate_limit_per_user=0,
+                           default_sort_order=None, default_forum_layout=0)
+    channel = dict(channel, **{k: v for k, v in body.items() if k not in ('id', 'guild_id', 'type')})
+    channel['permission_overwrites'] = _overwrites(channel.get('permission_overwrites'))
+    if channel.get('parent_id') is not None:
+        channel['parent_id'] = str(channel['parent_id'])
+    if 'available_tags' in channel:
+        channel['available_tags'] = [
+            {'emoji_id': None, 'emoji_name': None, 'moderated': False, **tag, 'id': str(tag.get('id') or next(ids))}
+            for tag in channel['available_tags'] or ()
+        ]
+    return channel
+
+
+class MockGuild:
+    # 1 ギルド分の状態。値は Discord の API と同じ形の payload で持つ
+    def __init__(self, guild_id: str, name: str, ids):
+        self.id = guild_id
+        self.name = name
+        self._ids = ids
+        self.roles: dict[str, dict] = {}
+        self.channels: dict[str, dict] = {}
+        self.members: dict[str, dict] = {}
+        self.add_role('@everyone', role_id=guild_id, position=0, permissions='104324673')
+        # Bot の連携ロールは最上位に置く（一括削除で他のロールを消せるように）
+        bot_role = self.add_role('mock-bot', position=1000, permissions=ALL_PERMISSIONS, managed=True,
+                                 tags={'bot_id': BOT_USER_ID})
+        self.members[BOT_USER_ID] = _member(_user(BOT_USER_ID, 'mock', bot=True), [bot_role['id']])
+        self.members[OWNER_USER_ID] = _member(_user(OWNER_USER_ID, 'owner'), [])
+
+    def add_role(self, name: str, role_id: str | None = None, **fields) -> dict:
+        role_id = role_id or str(next(self._ids))
+        role = self.roles[role_id] = _role_payload(role_id, dict(fields, name=name))
+        return role
+
+    def add_channel(self, name: str, type: int = TEXT, **fields) -> dict:
+        channel_id = str(next(self._ids))
+        channel = _channel_payload(self.id, channel_id, dict(fields, type=type, name=name,
+                                                             position=fields.get('position', len(self.channels))),
+                                   self._ids)
+        self.channels[channel_id] = channel
+        return channel
+
+    def payload(self) -> dict:
+        return {
+            'id': self.id, 'name': self.name, 'icon': None, 'splash': None, 'discovery_splash': None, 'banner': None,
+            'description': None, 'owner_id': OWNER_USER_ID, 'afk_channel_id': None, 'afk_timeout': 300,
+            'verification_level': 0, 'default_message_notifications': 0, 'explicit_content_filter': 0,
+            'mfa_level': 0, 'nsfw_level': 0, 'premium_tier': 0, 'premium_progress_bar_enabled': False,
+            'system_channel_id': None, 'system_channel_flags': 0, 'rules_channel_id': None,
+            'public_updates_channel_id': None, 'vanity_url_code': None, 'preferred_locale': 'ja', 'features': [],
+            'roles': list(self.roles.values()), 'emojis': [], 'stickers': [], 'channels': list(self.channels.values()),
+            'members': list(self.members.values()), 'member_count': len(self.members), 'threads': [],
+            'presences': [], 'voice_states': [], 'stage_instances': [], 'guild_scheduled_events': [],
+            'joined_at': TIMESTAMP, 'large': False, 'unavailable': False,
+        }
+
+
+class _Bucket:
+    def __init__(self, name: str, limit: int, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.count = 0
+        self.reset_at = 0.0
+
+    def hit(self) -> tuple[bool, int, float]:
+        now = time.monotonic()
+        if now >= self.reset_at:
+            self.count = 0
+            self.reset_at = now + self.window
+        reset_after = max(0.0, self.reset_at - now)
+        if self.count >= self.limit:
+            return False, 0, reset_after
+        self.count += 1
+        return True, self.limit - self.count, reset_after
+
+
+class _GatewaySession:
+    # ゲートウェイの接続 1 本。IDENTIFY で受け取ったシャードのギルドのイベントだけを流す
+    def __init__(self, ws: web.WebSocketResponse):
+        self.ws = ws
+        self.seq = 0
+        self.shard = (0, 1)
+
+    def owns(self, guild_id: str) -> bool:
+        shard_id, shard_count = self.shard
+        return (int(guild_id) >> 22) % shard_count == shard_id
+
+    async def send(self, op: int, d=None, t: str | None = None):
+        payload = {'op': op, 'd': d, 's': None, 't': t}
+        if op == 0:
+            self.seq += 1
+            payload['s'] = self.seq
+        try:
+            await self.ws.send_str(json.dumps(payload))
+        except (ConnectionResetError, RuntimeError):
+            pass
+
+
+class MockDiscord:
+    def __init__(self, bucket_limit: int = 10, bucket_window: float = 1.0, latency: float = 0.05,
+                 webhook_limit: int = 5, webhook_window: float = 2.0):
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.webhook_limit = webhook_limit
+        self.webhook_window = webhook_window
+        self.latency = latency
+        self.requests = 0
+        self.rate_limited = 0
+        self.webhook_messages = 0
+        self.routes: dict[str, int] = {}
+        self.guilds: dict[str, MockGuild] = {}
+        self.messages: dict[str, dict] = {}
+        self.interactions: dict[str, dict] = {}
+        self._buckets: dict[str, _Bucket] = {}
+        self._sessions: list[_GatewaySession] = []
+        self._changed = asyncio.Condition()
+        self._ids = itertools.count(100000000000000000)
+        self._runner: web.AppRunner | None = None
+        self.base_url = None
+        self.gateway_url = None
+
+    def reset_stats(self):
+        self.requests = 0
+        self.rate_limited = 0
+        self.webhook_messages = 0
+        self.routes.clear()
+        self._buckets.clear()
+
+    # --- ギルドの状態 ---
+
+    def add_guild(self, name: str = 'mock guild', guild_id: int | None = None) -> MockGuild:
+        guild_id = str(guild_id or next(self._ids))
+        guild = self.guilds[guild_id] = MockGuild(guild_id, name, self._ids)
+        return guild
+
+    def _guild(self, guild_id: str) -> MockGuild:
+        # 登録していないギルドへの作成は、その場で空のギルドを作って受け付ける（REST だけのベンチ用）
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = MockGuild(guild_id, 'mock guild', self._ids)
+        return guild
+
+    def _channel(self, channel_id: str) -> tuple[MockGuild, dict]:
+        for guild in self.guilds.values():
+            channel = guild.channels.get(channel_id)
+            if channel is not None:
+                return guild, channel
+        raise _Unknown('Unknown Channel', 10003)
+
+    def _channel_scope(self, channel_id: str) -> str:
+        # チャンネル単位のルートも、実際にはギルド単位の（非公開の）制限を受ける
+        for guild in self.guilds.values():
+            if channel_id in guild.channels:
+                return guild.id
+        return channel_id
+
+    def _role(self, guild_id: str, role_id: str) -> dict:
+        role = self._guild(guild_id).roles.get(role_id)
+        if role is None:
+            raise _Unknown('Unknown Role', 10011)
+        return role
+
+    # --- ゲートウェイ ---
+
+    async def dispatch(self, event: str, data: dict, guild_id: str | None = None):
+        for session in list(self._sessions):
+            if guild_id is None or session.owns(guild_id):
+                await session.send(0, data, event)
+
+    async def _gateway(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        session = _GatewaySession(ws)
+        # 圧縮（compress=zlib-stream など）は無視してテキストフレームで送る（discord.py はどちらも受け付ける）
+        await session.send(10, {'heartbeat_interval': 41250})
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                data = json.loads(msg.data)
+                op, d = data.get('op'), data.get('d') or {}
+                if op == 1:
+                    await session.send(11)
+                elif op == 2:
+                    await self._identify(session, d)
+                elif op == 8:
+                    await self._request_members(session, d)
+        finally:
+            if session in self._sessions:
+                self._sessions.remove(session)
+        return ws
+
+    async def _identify(self, session: _GatewaySession, d: dict):
+        if d.get('shard'):
+            session.shard = tuple(d['shard'])
+        guilds = [g for g in self.guilds.values() if session.owns(g.id)]
+        await session.send(0, {
+            'v': 10, 'user': _user(BOT_USER_ID, 'mock', bot=True), 'session_id': f'mock-{next(self._ids)}',
+            'resume_gateway_url': self.gateway_url, 'shard': list(session.shard),
+            'application': {'id': APPLICATION_ID, 'flags': 0},
+            'guilds': [{'id': g.id, 'unavailable': True} for g in guilds],
+        }, 'READY')
+        self._sessions.append(session)
+        for guild in guilds:
+            await session.send(0, guild.payload(), 'GUILD_CREATE')
+
+    async def _request_members(self, session: _GatewaySession, d: dict):
+        guild = self.guilds.get(str(d.get('guild_id')))
+        user_ids = [str(u) for u in d.get('user_ids') or ()]
+        members = [m for uid, m in guild.members.items() if uid in user_ids] if guild else []
+        await session.send(0, {
+            'guild_id': str(d.get('guild_id')), 'members': members, 'chunk_index': 0, 'chunk_count': 1,
+            'not_found': [u for u in user_ids if not any(m['user']['id'] == u for m in members)],
+            'nonce': d.get('nonce'),
+        }, 'GUILD_MEMBERS_CHUNK')
+
+    # --- インタラクション（ベンチマークから呼ぶ） ---
+
+    async def interact(self, guild_id, channel_id, name: str, **options) -> str:
+        # スラッシュコマンドの実行。返り値の token で応答メッセージを追える
+        types = {bool: 5, int: 4, str: 3}
+        data = {'id': str(next(self._ids)), 'name': name, 'type': 1,
+                'options': [{'name': k, 'type': types[type(v)], 'value': v} for k, v in options.items()]}
+        return await self._interaction(str(guild_id), str(channel_id), 2, data)
+
+    async def press(self, token: str, custom_id: str) -> str:
+        # token の応答メッセージに付いたボタンを押す
+        parent = self.interactions[token]
+        message = self.messages[parent['original']]
+        return await self._interaction(parent['guild_id'], parent['channel_id'], 3,
+                                       {'custom_id': custom_id, 'component_type': 2}, message=message)
+
+    async def _interaction(self, guild_id: str, channel_id: str, itype: int, data: dict, **extra) -> str:
+        interaction_id = str(next(self._ids))
+        token = f'interaction-{interaction_id}'
+        guild = self.guilds[guild_id]
+        self.interactions[token] = {'id': interaction_id, 'guild_id': guild_id, 'channel_id': channel_id,
+                                    'original': None}
+        await self.dispatch('INTERACTION_CREATE', dict({
+            'id': interaction_id, 'application_id': APPLICATION_ID, 'type': itype, 'data': data, 'token': token,
+            'version': 1, 'guild_id': guild_id, 'guild': {'id': guild_id, 'locale': 'ja', 'features': []},
+            'channel_id': channel_id, 'channel': {'id': channel_id, 'type': guild.channels[channel_id]['type'],
+                                                  'guild_id': guild_id},
+            'member': dict(guild.members[OWNER_USER_ID], permissions=ALL_PERMISSIONS),
+            'app_permissions': ALL_PERMISSIONS, 'locale': 'ja', 'guild_locale': 'ja', 'entitlements': [],
+            'authorizing_integration_owners': {'0': guild_id}, 'context': 0,
+            'attachment_size_limit': 8 * 1024 * 1024,
+        }, **extra), guild_id)
+        return token
+
+    async def wait_message(self, predicate, timeout: float = 60.0) -> dict:
+        # predicate を満たすメッセージ（作成・編集）が現れるまで待つ
+        async def _wait():
+            async with self._changed:
+                while True:
+                    for message in self.messages.values():
+                        if predicate(message):
+                            return message
+                    await self._changed.wait()
+        return await asyncio.wait_for(_wait(), timeout)
+
+    async def _touch(self, message: dict) -> dict:
+        self.messages[message['id']] = message
+        async with self._changed:
+            self._changed.notify_all()
+        return message
+
+    def _message(self, message_id: str, channel_id: str, body: dict, author: dict, **extra) -> dict:
+        return dict({
+            'id': message_id, 'type': 0, 'channel_id': channel_id, 'content': body.get('content') or '',
+            'author': author, 'attachments': [], 'embeds': body.get('embeds') or [],
+            'components': body.get('components') or [], 'mentions': [], 'mention_roles': [], 'pinned': False,
+            'mention_everyone': False, 'tts': False, 'timestamp': TIMESTAMP, 'edited_timestamp': None,
+            'flags': body.get('flags') or 0,
+        }, **extra)
+
+    # --- REST ---
+
+    def _bucket(self, key: str) -> _Bucket:
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = _Bucket(key, self.bucket_limit, self.bucket_window)
+        return b
+
+    async def _limited(self, request: web.Request, route: str, payload, scope: str | None = None,
+                       limit: int | None = None, window: float | None = None):
+        # バケットは既定でルート × ギルド。Webhook の実行は Webhook ごと（scope）に分かれる。
+        # payload に関数を渡すと、レート制限を通ったときだけ呼んで（状態を変えて）その結果を返す
+        self.requests += 1
+        self.routes[route] = self.routes.get(route, 0) + 1
+        key = f'{route}:{scope if scope is not None else request.match_info.get("guild_id", "")}'
+        bucket = self._bucket(key)
+        if limit is not None:
+            bucket.limit = limit
+            bucket.window = window or bucket.window
+        ok, remaining, reset_after = bucket.hit()
+        headers = {
+            'X-RateLimit-Limit': str(bucket.limit),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset-After': f'{reset_after:.3f}',
+            'X-RateLimit-Bucket': route,
+            'Via': '1.1 google',
+        }
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not ok:
+            self.rate_limited += 1
+            return _json(
+                {'message': 'You are being rate limited.', 'retry_after': reset_after, 'global': False},
+                status=429,
+                headers=headers,
+            )
+        if callable(payload):
+            try:
+                payload = await payload()
+            except _Unknown as e:
+                return _json({'message': str(e), 'code': e.code}, status=404, headers=headers)
+        if payload is None:
+            return web.Response(status=204, headers=headers)
+        return _json(payload, headers=headers)
+
+    async def _me(self, request: web.Request):
+        return _json(_user(BOT_USER_ID, 'mock', bot=True))
+
+    async def _application(self, request: web.Request):
+        return _json({'id': APPLICATION_ID, 'name': 'mock', 'description': '', 'icon': None, 'bot_public': False,
+                      'bot_require_code_grant': False, 'owner': _user(OWNER_USER_ID, 'owner'), 'verify_key': '',
+                      'flags': 0})
+
+    async def _sync_commands(self, request: web.Request):
+        body = await request.json()
+        payload = [dict({'type': 1, 'options': [], 'description': '', 'default_member_permissions': None,
+                         'dm_permission': True, 'nsfw': False}, **command, id=str(next(self._ids)),
+                        application_id=APPLICATION_ID, version='1') for command in body]
+        return await self._limited(request, 'commands_sync', payload)
+
+    # チャンネル
+
+    async def _list_channels(self, request: web.Request):
+        guild = self._guild(request.match_info['guild_id'])
+        return await self._limited(request, 'channel_list', list(guild.channels.values()))
+
+    async def _create_channel(self, request: web.Request):
+        body = await request.json()
+        guild = self._guild(request.match_info['guild_id'])
+
+        async def _apply():
+            channel = _channel_payload(guild.id, str(next(self._ids)), body, self._ids)
+            guild.channels[channel['id']] = channel
+            await self.dispatch('CHANNEL_CREATE', channel, guild.id)
+            return channel
+        return await self._limited(request, 'channel_create', _apply)
+
+    async def _edit_channel(self, request: web.Request):
+        body = await request.json()
+        channel_id = request.match_info['channel_id']
+
+        async def _apply():
+            guild, channel = self._channel(channel_id)
+            channel = guild.channels[channel_id] = _channel_payload(guild.id, channel_id, body, self._ids, channel)
+            await self.dispatch('CHANNEL_UPDATE', channel, guild.id)
+            return channel
+        return await self._limited(request, 'channel_edit', _apply, scope=self._channel_scope(channel_id))
+
+    async def _delete_channel(self, request: web.Request):
+        channel_id = request.match_info['channel_id']
+
+        async def _apply():
+            guild, channel = self._channel(channel_id)
+            del guild.channels[channel_id]
+            await self.dispatch('CHANNEL_DELETE', channel, guild.id)
+            # カテゴリを消すと配下のチャンネルはカテゴリなしになる
+            for child in guild.channels.values():
+                if child.get('parent_id') == channel_id:
+                    child['parent_id'] = None
+                    await self.dispatch('CHANNEL_UPDATE', child, guild.id)
+            return channel
+        return await self._limited(request, 'channel_delete', _apply, scope=self._channel_scope(channel_id))
+
+    async def _channel_positions(self, request: web.Request):
+        body = await request.json()
+        guild = self._guild(request.match_info['guild_id'])
+
+        async def _apply():
+            for item in body:
+                channel = guild.channels.get(str(item['id']))
+                if channel is None:
+                    continue
+                changes = {k: item[k] for k in ('position', 'parent_id') if k in item}
+                guild.channels[channel['id']] = channel = _channel_payload(guild.id, channel['id'], changes,
+                                                                           self._ids, channel)
+                await self.dispatch('CHANNEL_UPDATE', channel, guild.id)
+            return None
+        return await self._limited(request, 'channel_positions', _apply)
+
+    # ロール
+
+    async def _list_roles(self, request: web.Request):
+        guild = self._guild(request.match_info['guild_id'])
+        return await self._limited(request, 'role_list', list(guild.roles.values()))
+
+    async def _create_role(self, request: web.Request):
+        body = await request.json()
+        guild = self._guild(request.match_info['guild_id'])
+
+        async def _apply():
+            role = guild.add_role(body.get('name', 'new role'), **{k: v for k, v in body.items() if k != 'name'})
+            await self.dispatch('GUILD_ROLE_CREATE', {'guild_id': guild.id, 'role': role}, guild.id)
+            return role
+        return await self._limited(request, 'role_create', _apply)
+
+    async def _edit_role(self, request: web.Request):
+        body = await request.json()
+        guild_id, role_id = request.match_info['guild_id'], request.match_info['role_id']
+
+        async def _apply():
+            role = self._guild(guild_id).roles[role_id] = _role_payload(role_id, body, self._role(guild_id, role_id))
+            await self.dispatch('GUILD_ROLE_UPDATE', {'guild_id': guild_id, 'role': role}, guild_id)
+            return role
+        return await self._limited(request, 'role_edit', _apply)
+
+    async def _delete_role(self, request: web.Request):
+        guild_id, role_id = request.match_info['guild_id'], request.match_info['role_id']
+
+        async def _apply():
+            self._role(guild_id, role_id)
+            guild = self._guild(guild_id)
+            del guild.roles[role_id]
+            for member in guild.members.values():
+                if role_id in member['roles']:
+                    member['roles'].remove(role_id)
+            await self.dispatch('GUILD_ROLE_DELETE', {'guild_id': guild_id, 'role_id': role_id}, guild_id)
+            return None
+        return await self._limited(request, 'role_delete', _apply)
+
+    async def _role_positions(self, request: web.Request):
+        body = await request.json()
+        guild = self._guild(request.match_info['guild_id'])
+
+        async def _apply():
+            for item in body:
+                role = guild.roles.get(str(item['id']))
+                if role is not None and 'position' in item:
+                    role = guild.roles[role['id']] = dict(role, position=item['position'])
+                    await self.dispatch('GUILD_ROLE_UPDATE', {'guild_id': guild.id, 'role': role}, guild.id)
+            return list(guild.roles.values())
+        return await self._limited(request, 'role_positions', _apply)
+
+    # メッセージ
+
+    async def _send_message(self, request: web.Request):
+        body = await request.json()
+        channel_id = request.match_info['channel_id']
+
+        async def _apply():
+            guild, _ = self._channel(channel_id)
+            return await self._touch(self._message(str(next(self._ids)), channel_id, body,
+                                                   _user(BOT_USER_ID, 'mock', bot=True), guild_id=guild.id))
+        return await self._limited(request, 'message_create', _apply, scope=channel_id)
+
+    async def _edit_message(self, request: web.Request):
+        body = await request.json()
+        channel_id, message_id = request.match_info['channel_id'], request.match_info['message_id']
+
+        async def _apply():
+            message = self.messages.get(message_id)
+            if message is None:
+                raise _Unknown('Unknown Message', 10008)
+            return await self._touch(dict(message, **{k: v for k, v in body.items()
+                                                      if k in ('content', 'embeds', 'components', 'flags')},
+                                          edited_timestamp=TIMESTAMP))
+        return await self._limited(request, 'message_edit', _apply, scope=channel_id)
+
+    # インタラクションの応答
+
+    async def _interaction_callback(self, request: web.Request):
+        body = await request.json()
+        token = request.match_info['token']
+        state = self.interactions.get(token)
+        rtype = body.get('type')
+        data = body.get('data') or {}
+
+        async def _apply():
+            if state is None:
+                raise _Unknown('Unknown interaction', 10062)
+            resource = {'type': rtype}
+            if rtype in (4, 7):
+                # 4: メッセージで応答 / 7: ボタンの付いたメッセージを更新
+                resource['message'] = await self._edit_original(token, data)
+            return {'interaction': {'id': state['id'], 'type': 2, 'response_message_loading': rtype == 5,
+                                    'response_message_ephemeral': bool(data.get('flags', 0) & 64)},
+                    'resource': resource}
+        return await self._limited(request, 'interaction_callback', _apply, scope=token)
+
+    async def _edit_original(self, token: str, body: dict) -> dict:
+        state = self.interactions[token]
+        message = self.messages.get(state['original'] or '')
+        if message is None:
+            state['original'] = str(next(self._ids))
+            message = self._message(state['original'], state['channel_id'], {}, _user(APPLICATION_ID, 'mock', bot=True),
+                                    webhook_id=APPLICATION_ID, application_id=APPLICATION_ID)
+        return await self._touch(dict(message, **{k: v for k, v in body.items()
+                                                  if k in ('content', 'embeds', 'components', 'flags')}))
+
+    async def _edit_webhook_message(self, request: web.Request):
+        body = await _read_body(request)
+        token, message_id = request.match_info['token'], request.match_info['message_id']
+
+        async def _apply():
+            if message_id == '@original' and token in self.interactions:
+                return await self._edit_original(token, body)
+            message = self.messages.get(message_id)
+            if message is None:
+                raise _Unknown('Unknown Message', 10008)
+            return await self._touch(dict(message, **{k: v for k, v in body.items()
+                                                      if k in ('content', 'embeds', 'components')}))
+        return await self._limited(request, 'webhook_message_edit', _apply, scope=token)
+
+    # Webhook
+
+    async def _create_webhook(self, request: web.Request):
+        body = await request.json()
+        payload = {
+            'id': str(next(self._ids)),
+            'type': 1,
+            'token': f'token-{next(self._ids)}',
+            'name': body.get('name'),
+            'channel_id': request.match_info['channel_id'],
+            'guild_id': None,
+            'avatar': None,
+        }
+        return await self._limited(request, 'webhook_create', payload, scope=request.match_info['channel_id'])
+
+    async def _execute_webhook(self, request: web.Request):
+        body = await _read_body(request)
+        webhook_id = request.match_info['webhook_id']
+        token = request.match_info['token']
+        thread_id = request.query.get('thread_id')
+        message_id = str(next(self._ids))
+        if token in self.interactions:
+            # インタラクションのフォローアップ
+            channel_id = self.interactions[token]['channel_id']
+        else:
+            channel_id = thread_id or (message_id if body.get('thread_name') else webhook_id)
+        author = {'id': webhook_id, 'username': body.get('username') or 'webhook', 'discriminator': '0000',
+                  'avatar': None, 'bot': True}
+        payload = self._message(message_id, channel_id, body, author, webhook_id=webhook_id,
+                                timestamp=TIMESTAMP)
+        self.webhook_messages += 1
+
+        async def _apply():
+            if token in self.interactions:
+                await self._touch(payload)
+            return payload
+        # 本物と同じく Webhook ごとに 5 件 / 2 秒
+        return await self._limited(request, 'webhook_execute', _apply, scope=webhook_id,
+                                   limit=self.webhook_limit, window=self.webhook_window)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/gateway', self._gateway)
+        app.router.add_get(API_PREFIX + '/users/@me', self._me)
+        app.router.add_get(API_PREFIX + '/oauth2/applications/@me', self._application)
+        app.router.add_put(API_PREFIX + '/applications/{app_id}/commands', self._sync_commands)
+        app.router.add_put(API_PREFIX + '/applications/{app_id}/guilds/{guild_id}/commands', self._sync_commands)
+        app.router.add_get(API_PREFIX + '/guilds/{guild_id}/channels', self._list_channels)
+        app.router.add_post(API_PREFIX + '/guilds/{guild_id}/channels', self._create_channel)
+        app.router.add_patch(API_PREFIX + '/guilds/{guild_id}/channels', self._channel_positions)
+        app.router.add_patch(API_PREFIX + '/channels/{channel_id}', self._edit_channel)
+        app.router.add_delete(API_PREFIX + '/channels/{channel_id}', self._delete_channel)
+        app.router.add_post(API_PREFIX + '/channels/{channel_id}/messages', self._send_message)
+        app.router.add_patch(API_PREFIX + '/channels/{channel_id}/messages/{message_id}', self._edit_message)
+        app.router.add_get(API_PREFIX + '/guilds/{guild_id}/roles', self._list_roles)
+        app.router.add_post(API_PREFIX + '/guilds/{guild_id}/roles', self._create_role)
+        app.router.add_patch(API_PREFIX + '/guilds/{guild_id}/roles', self._role_positions)
+        app.router.add_patch(API_PREFIX + '/guilds/{guild_id}/roles/{role_id}', self._edit_role)
+        app.router.add_delete(API_PREFIX + '/guilds/{guild_id}/roles/{role_id}', self._delete_role)
+        app.router.add_post(API_PREFIX + '/interactions/{interaction_id}/{token}/callback', self._interaction_callback)
+        app.router.add_post(API_PREFIX + '/channels/{channel_id}/webhooks', self._create_webhook)
+        app.router.add_post(API_PREFIX + '/webhooks/{webhook_id}/{token}', self._execute_webhook)
+        app.router.add_patch(API_PREFIX + '/webhooks/{webhook_id}/{token}/messages/{message_id}',
+                             self._edit_webhook_message)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}{API_PREFIX}'
+        self.gateway_url = f'ws://{host}:{port}/gateway'
+        return self.base_url
+
+    async def stop(self):
+        for session in list(self._sessions):
+            await session.ws.close()
+        self._sessions.clear()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class MockCDN:
+    # アセットのダウンロード確認用。fixtures（パス → bytes）をそのまま返す。
+    # flaky を指定すると各パスの最初の 1 回だけ 503 / 429 を返す（リトライの確認用）
+    def __init__(self, fixtures: dict[str, bytes], latency: float = 0.02, flaky: float = 0.0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.flaky = flaky
+        self.requests = 0
+        self.errors = 0
+        self._failed: set[str] = set()
+        self._runner: web.AppRunner | None = None
+        self.base_url = None
+
+    async def _get(self, request: web.Request):
+        self.requests += 1
+        path = request.match_info['path']
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = self.fixtures.get(path)
+        if data is None:
+            return web.Response(status=404)
+        if self.flaky and path not in self._failed and (hash(path) % 1000) / 1000 < self.flaky:
+            self._failed.add(path)
+            self.errors += 1
+            if len(self._failed) % 2:
+                return web.Response(status=503)
+            return web.Response(status=429, headers={'Retry-After': '0.1'})
+        return web.Response(body=data, content_type='application/octet-stream')
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get('/{path:.+}', self._get)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        return self.base_url
+
+    def url(self, path: str) -> str:
+        return f'{self.base_url}/{path}'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
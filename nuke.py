@@ -0,0 +1,106 @@
+import asyncio
+from dataclasses import dataclass, field
+
+import discord
+
+from ratelimit import ROUTE_CHANNEL_DELETE, ROUTE_ROLE_DELETE
+
+# nuke_all の削除処理。チャンネル（テキスト/フォーラム/ボイス）→ カテゴリ → ロールの順に、
+# 各段階の中はルートごとのレート制限を見ながら並列に削除する。
+
+REASON = 'nuke_all by owner'
+
+KIND_LABELS = {
+    'text': 'テキストチャンネル',
+    'forum': 'フォーラム',
+    'voice': 'ボイスチャンネル',
+    'category': 'カテゴリ',
+    'role': 'ロール',
+}
+PHASES = (('text', 'forum', 'voice'), ('category',), ('role',))
+
+
+def collect_targets(guild: discord.Guild, keep_channel=None) -> dict:
+    # 現在のチャンネルは最後まで残す。@everyone と連携ロールは除外（権限なしになるので）
+    keep_id = getattr(keep_channel, 'id', None)
+    return {
+        'text': [c for c in guild.text_channels if c.id != keep_id],
+        'forum': [c for c in guild.channels if isinstance(c, discord.ForumChannel) and c.id != keep_id],
+        'voice': [c for c in guild.voice_channels if c.id != keep_id],
+        'category': sorted(guild.categories, key=lambda c: c.position, reverse=True),
+        'role': sorted((r for r in guild.roles if not r.is_default() and not r.managed), key=lambda r: r.position),
+    }
+
+
+def _label(kind: str, target) -> str:
+    return f'@{target.name}' if kind == 'role' else f'#{target.name}'
+
+
+def _reason(exc: Exception) -> str:
+    if isinstance(exc, discord.HTTPException):
+        return f'{exc.status} {exc.text or type(exc).__name__}'
+    return f'{type(exc).__name__}: {exc}' if str(exc) else type(exc).__name__
+
+
+@dataclass
+class NukeReport:
+    totals: dict
+    deleted: dict = field(default_factory=dict)
+    failures: list = field(default_factory=list)  # (種類, 名前, 理由)
+
+    def progress(self) -> str:
+        parts = [
+            f'{KIND_LABELS[kind]} {self.deleted.get(kind, 0)}/{total}'
+            for kind, total in self.totals.items() if total
+        ]
+        return '🧹 削除中… ' + '・'.join(parts) if parts else '🧹 削除中…'
+
+    def render(self, limit: int = 1800) -> str:
+        lines = ['🎉 一括削除が完了しました（このチャンネルは残しています）。']
+        lines.append('・'.join(f'{KIND_LABELS[k]} {self.deleted.get(k, 0)}/{t}' for k, t in self.totals.items()))
+        if self.failures:
+            lines.append(f'⚠️ 削除できなかったもの {len(self.failures)} 件:')
+            for i, (kind, name, reason) in enumerate(self.failures):
+                line = f'- {KIND_LABELS[kind]} {name}: {reason}'
+                if sum(len(l) + 1 for l in lines) + len(line) > limit:
+                    lines.append(f'…ほか {len(self.failures) - i} 件')
+                    break
+                lines.append(line)
+        return '\n'.join(lines)
+
+
+async def nuke(guild: discord.Guild, targets: dict, executor, progress=None) -> NukeReport:
+    report = NukeReport(totals={kind: len(items) for kind, items in targets.items()})
+    report.deleted = {kind: 0 for kind in targets}
+
+    # Bot の最上位ロール以上は消せないので、リクエストを送らずに失敗として記録する
+    top = getattr(getattr(guild, 'me', None), 'top_role', None)
+    roles = []
+    for role in targets.get('role', ()):
+        if top is not None and role >= top:
+            report.failures.append(('role', _label('role', role), 'Bot の最上位ロール以上のため削除できません'))
+        else:
+            roles.append(role)
+    targets = dict(targets, role=roles)
+
+    async def _delete(target):
+        try:
+            await target.delete(reason=REASON)
+        except discord.NotFound:
+            # すでに消えていれば削除済みとみなす
+            pass
+
+    async def _one(kind: str, target):
+        route = ROUTE_ROLE_DELETE if kind == 'role' else ROUTE_CHANNEL_DELETE
+        try:
+            await executor.run(route, lambda: _delete(target), _label(kind, target))
+        except Exception as e:
+            report.failures.append((kind, _label(kind, target), _reason(e)))
+        else:
+            report.deleted[kind] += 1
+        if progress is not None:
+            progress.update(report.progress())
+
+    for phase in PHASES:
+        await asyncio.gather(*(_one(kind, target) for kind in phase for target in targets.get(kind, ())))
+    return report
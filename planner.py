@@ -0,0 +1,712 @@
+import asyncio
+from dataclasses import dataclass, field
+
+import discord
+
+from ratelimit import ROUTE_CHANNEL_CREATE, ROUTE_CHANNEL_EDIT, ROUTE_ROLE_CREATE, ROUTE_ROLE_EDIT
+from codec import ROLE, OverwriteCodec, role_key
+from members import MemberResolver, collect_member_ids
+from metrics import phase
+from store import run_io
+from reorder import plan_role_positions, plan_channel_positions, apply_role_positions, apply_channel_positions
+
+# 現在のギルドをインデックス化してバックアップと突き合わせ、
+# 必要な操作（作成・編集・移動・スキップ）だけを実行する。
+
+CREATE = 'create'
+EDIT = 'edit'
+MOVE = 'move'
+SKIP = 'skip'
+
+KINDS = ('role', 'category', 'text', 'forum', 'voice')
+KIND_LABELS = {'role': 'ロール', 'category': 'カテゴリ', 'text': 'テキスト', 'forum': 'フォーラム', 'voice': 'ボイス'}
+ACTION_LABELS = {CREATE: '作成', EDIT: '編集', MOVE: '移動', SKIP: 'スキップ'}
+ACTION_ICONS = {CREATE: '➕', EDIT: '✏️', MOVE: '🔀', SKIP: '・'}
+
+_FORUM_LAYOUT = getattr(discord, 'ForumLayoutType', None) or getattr(discord, 'ForumLayout', None)
+_FORUM_ORDER = getattr(discord, 'ForumOrderType', None) or getattr(discord, 'SortOrder', None)
+
+
+def _parse_reaction_emoji(s):
+    if not s:
+        return None
+    try:
+        return discord.PartialEmoji.from_str(s)
+    except Exception:
+        return s
+
+
+def _channel_kind(ch) -> str | None:
+    if isinstance(ch, discord.CategoryChannel):
+        return 'category'
+    if isinstance(ch, discord.ForumChannel):
+        return 'forum'
+    if isinstance(ch, discord.VoiceChannel):
+        return 'voice'
+    if isinstance(ch, discord.TextChannel):
+        return 'text'
+    return None
+
+
+def _live_tags(ch) -> list:
+    tags = []
+    for t in getattr(ch, 'available_tags', []) or []:
+        tags.append({'name': t.name, 'emoji': str(t.emoji) if t.emoji else None, 'moderated': getattr(t, 'moderated', False)})
+    return tags
+
+
+def _enum_name(value):
+    return getattr(value, 'name', None) if value is not None else None
+
+
+@dataclass
+class Op:
+    action: str
+    kind: str
+    stored: dict
+    target: object = None
+    changes: list = field(default_factory=list)
+    # 部分復元で、選んだものが参照するために足したもの（無ければ作り、既にあれば触らない）
+    dependency: bool = False
+
+    @property
+    def name(self) -> str:
+        return self.stored.get('name', '')
+
+    def describe(self) -> str:
+        label = f"{ACTION_ICONS[self.action]} {KIND_LABELS[self.kind]} {self.name}"
+        if self.action == MOVE:
+            old = getattr(getattr(self.target, 'category', None), 'name', None) or '(なし)'
+            label += f"（{old} → {self.stored.get('category') or '(なし)'}）"
+        if self.changes:
+            label += f" [{', '.join(self.changes)}]"
+        if self.dependency:
+            label += '（依存）'
+        return label
+
+    @property
+    def keeps_position(self) -> bool:
+        # 既にある依存は並べ替えの対象にもしない
+        return self.dependency and self.action == SKIP
+
+
+@dataclass
+class RestorePlan:
+    ops: list
+    reorder_roles: bool = False
+    reorder_channels: bool = False
+    selection: object = None
+    # validate.Validation（事前検証の結果。検証しなかったときは None）
+    validation: object = None
+
+    def of(self, kind: str, *actions) -> list:
+        return [op for op in self.ops if op.kind == kind and (not actions or op.action in actions)]
+
+    def counts(self) -> dict:
+        counts = {a: 0 for a in (CREATE, EDIT, MOVE, SKIP)}
+        for op in self.ops:
+            counts[op.action] += 1
+        return counts
+
+    def estimated_requests(self) -> int:
+        # 作成・編集は 1 件 1 リクエスト、移動は一括並べ替えの PATCH に含める
+        n = sum(1 for op in self.ops if op.action == CREATE or op.changes)
+        return n + int(self.reorder_roles) + int(self.reorder_channels)
+
+    def summary(self) -> str:
+        return '・'.join(f'{ACTION_LABELS[a]} {n} 件' for a, n in self.counts().items())
+
+    def render(self, limit: int = 1800) -> str:
+        lines = [
+            '🧪 ドライラン: 復元プラン',
+            self.summary(),
+            f'推定リクエスト数: {self.estimated_requests()}'
+            f'（並べ替え: ロール {"あり" if self.reorder_roles else "なし"}・チャンネル {"あり" if self.reorder_channels else "なし"}）',
+        ]
+        if self.selection is not None:
+            lines.insert(1, self.selection.describe())
+        if self.validation is not None:
+            lines.append(self.validation.summary())
+        size = sum(len(line) + 1 for line in lines)
+        pending = [op for op in self.ops if op.action != SKIP]
+        for i, op in enumerate(pending):
+            line = '- ' + op.describe()
+            if size + len(line) + 1 > limit:
+                lines.append(f'…ほか {len(pending) - i} 件')
+                break
+            lines.append(line)
+            size += len(line) + 1
+        return '\n'.join(lines)
+
+
+class GuildIndex:
+    # 現在のギルドを ID と名前（種類・カテゴリ名）の両方で引けるようにする。
+    # claim_* はバックアップの元 ID から（対応表 → 同じ ID の順）、take_* は名前から探す。
+    # どちらも 1 つずつ消費するので、同名が複数あっても同じものを 2 回使わない
+    def __init__(self, guild: discord.Guild, idmap=None):
+        self.guild = guild
+        self.idmap = idmap
+        self.taken: set[int] = set()
+        # 連携のロール（managed）は別に持ち、保存時も managed だったものにだけ対応付ける
+        self.role_ids: dict[bool, dict[int, discord.Role]] = {False: {}, True: {}}
+        self.roles: dict[bool, dict[str, list]] = {False: {}, True: {}}
+        for r in sorted(guild.roles, key=lambda r: r.position, reverse=True):
+            if not r.is_default():
+                self.role_ids[r.managed][r.id] = r
+                self.roles[r.managed].setdefault(r.name, []).append(r)
+        self.channel_ids: dict[int, object] = {}
+        self.channels: dict[tuple, list] = {}
+        self.loose: dict[tuple, list] = {}
+        for ch in guild.channels:
+            kind = _channel_kind(ch)
+            if kind is None:
+                continue
+            parent = None if kind == 'category' else getattr(ch.category, 'name', None)
+            self.channel_ids[ch.id] = ch
+            self.channels.setdefault((kind, ch.name, parent), []).append(ch)
+            self.loose.setdefault((kind, ch.name), []).append(ch)
+
+    def _claim(self, table: dict, map_kind: str, old_id, accept=None):
+        if old_id is None:
+            return None
+        mapped = self.idmap.get(map_kind, old_id) if self.idmap is not None else None
+        for candidate in (mapped, int(old_id)):
+            live = table.get(candidate)
+            if live is not None and live.id not in self.taken and (accept is None or accept(live)):
+                self.taken.add(live.id)
+                return live
+        return None
+
+    def _first(self, bucket):
+        while bucket:
+            item = bucket.pop(0)
+            if item.id not in self.taken:
+                self.taken.add(item.id)
+                return item
+        return None
+
+    def claim_role(self, stored: dict):
+        return self._claim(self.role_ids[bool(stored.get('managed'))], 'roles', stored.get('id'))
+
+    def take_role(self, stored: dict):
+        return self._first(self.roles[bool(stored.get('managed'))].get(stored['name']))
+
+    def claim_channel(self, kind: str, stored: dict):
+        return self._claim(self.channel_ids, 'channels', stored.get('id'), lambda ch: _channel_kind(ch) == kind)
+
+    def take_channel(self, kind: str, name: str, parent: str | None):
+        found = self._first(self.channels.get((kind, name, parent)))
+        if found is None and kind != 'category':
+            found = self._first(self.loose.get((kind, name)))
+        return found
+
+
+def ref_key(stored: dict, id_key: str, name_key: str):
+    # バックアップ内での参照キー。元 ID があれば ID、旧形式のバックアップでは名前
+    value = stored.get(id_key)
+    return str(value) if value is not None else stored.get(name_key)
+
+
+def _lookup(live_items, pairs, id_key: str = 'id') -> dict:
+    # バックアップ内の参照キー（元 ID・旧形式では名前）→ 現在のギルドのオブジェクト（これから作るものは None）
+    lookup = {item.name: item for item in live_items}
+    lookup.update({str(item.id): item for item in live_items})
+    for stored, live in pairs:
+        lookup[stored['name']] = live
+        if stored.get(id_key) is not None:
+            lookup[str(stored[id_key])] = live
+    return lookup
+
+
+def _role_lookup(guild: discord.Guild, pairs) -> dict:
+    lookup = _lookup(guild.roles, pairs)
+    lookup['@everyone'] = guild.default_role
+    return lookup
+
+
+def diff_fields(kind: str, stored: dict, live, role_keys: dict, codec: OverwriteCodec) -> list:
+    changes = []
+    # ID で対応付けたものは名前が変わっていることがある
+    if live.name != stored.get('name'):
+        changes.append('name')
+    if kind == 'role':
+        if live.permissions.value != int(stored.get('permissions', 0)):
+            changes.append('permissions')
+        if live.color.value != int(stored.get('color', 0)):
+            changes.append('color')
+        for key in ('hoist', 'mentionable'):
+            if getattr(live, key) != bool(stored.get(key, False)):
+                changes.append(key)
+        return changes
+
+    if kind in ('text', 'forum'):
+        if live.nsfw != bool(stored.get('nsfw', False)):
+            changes.append('nsfw')
+        if (live.topic or None) != (stored.get('topic') or None):
+            changes.append('topic')
+    if kind == 'text' and live.slowmode_delay != int(stored.get('slowmode_delay') or 0):
+        changes.append('slowmode_delay')
+    if kind == 'voice':
+        if stored.get('bitrate') is not None and live.bitrate != stored.get('bitrate'):
+            changes.append('bitrate')
+        if live.user_limit != int(stored.get('user_limit') or 0):
+            changes.append('user_limit')
+    if kind == 'forum':
+        if stored.get('default_thread_slowmode_delay') is not None and live.default_thread_slowmode_delay != stored.get('default_thread_slowmode_delay'):
+            changes.append('default_thread_slowmode_delay')
+        live_reaction = str(live.default_reaction_emoji) if live.default_reaction_emoji else None
+        if live_reaction != stored.get('default_reaction_emoji'):
+            changes.append('default_reaction_emoji')
+        if stored.get('default_layout') and _enum_name(live.default_layout) != stored.get('default_layout'):
+            changes.append('default_layout')
+        if stored.get('default_sort_order') and _enum_name(live.default_sort_order) != stored.get('default_sort_order'):
+            changes.append('default_sort_order')
+        stored_tags = [
+            {'name': t.get('name'), 'emoji': t.get('emoji'), 'moderated': bool(t.get('moderated', False))}
+            for t in stored.get('available_tags') or []
+        ]
+        if stored_tags != _live_tags(live):
+            changes.append('available_tags')
+    # 解決できないロール宛ての上書きは比較対象から外す（毎回差分扱いになるのを防ぐ）
+    if codec.encode(live.overwrites) != codec.normalize(stored.get('overwrites'), role_keys):
+        changes.append('overwrites')
+    return changes
+
+
+CHANNEL_SECTIONS = (('category', 'categories'), ('text', 'text'), ('forum', 'forum'), ('voice', 'voice'))
+
+
+class RestorePlanner:
+    # plan_restore をセクションごとに進める版。roles → channels('category') → 残りのチャンネルの順に渡す
+    # （clone では元ギルドを読みながら、届いたセクションから計画して実行に回す）。
+    # 元 ID で対応付けられるものを先にすべて確定させてから、残りを名前で探す
+    # （名前で探したものが、後で ID で対応付くはずのものを横取りしないように。claim も take も種類ごと）
+    # validator（validate.PlanValidator）を渡すと、セクションごとに送っても失敗する操作を外す・直す
+    def __init__(self, guild: discord.Guild, idmap=None, selection=None, validator=None):
+        self.guild = guild
+        self.selection = selection
+        self.validator = validator
+        self.is_dependency = selection.is_dependency if selection is not None else lambda stored: False
+        self.index = GuildIndex(guild, idmap)
+        self.codec = OverwriteCodec()
+        self.ops: list[Op] = []
+        self.role_pairs = []
+        self.channel_pairs = []
+        self.role_keys: dict | None = None
+        self.categories: dict | None = None
+
+    def roles(self, items) -> list[Op]:
+        roles = sorted(items or [], key=lambda x: x.get('position', 0), reverse=True)
+        role_live = [self.index.claim_role(r) for r in roles]
+        role_live = [live or self.index.take_role(r) for r, live in zip(roles, role_live)]
+        # これから作るロール宛ての上書きは、現在のギルドには無いので必ず差分になる仮のキーにする。
+        # 作らない連携のロールで対応するものが無いものは、宛ての上書きごと落とす
+        absent = {key for r, live in zip(roles, role_live) if live is None and r.get('managed')
+                  for key in (ref_key(r, 'id', 'name'), r['name'])}
+        self.role_keys = {key: role_key(live) if live is not None else f'new:{key}'
+                          for key, live in _role_lookup(self.guild, list(zip(roles, role_live))).items()
+                          if live is not None or key not in absent}
+
+        ops = []
+        for r, live in zip(roles, role_live):
+            if r.get('managed'):
+                # 連携のロールは連携（Bot の追加・ブースト）が作るので、作成も編集もしない。あれば並び順だけ合わせる
+                ops.append(Op(SKIP, 'role', r, live))
+                if live is not None:
+                    self.role_pairs.append((r, live))
+                continue
+            if live is None:
+                ops.append(Op(CREATE, 'role', r, dependency=self.is_dependency(r)))
+                continue
+            if self.is_dependency(r):
+                ops.append(Op(SKIP, 'role', r, live, dependency=True))
+                continue
+            changes = diff_fields('role', r, live, self.role_keys, self.codec)
+            ops.append(Op(EDIT if changes else SKIP, 'role', r, live, changes))
+            self.role_pairs.append((r, live))
+        return self._add(ops)
+
+    def channels(self, kind: str, items) -> list[Op]:
+        if self.role_keys is None:
+            self.roles([])
+        if kind == 'category':
+            items = sorted(items or [], key=lambda c: c.get('position', 0))
+        entries = [(stored, self.index.claim_channel(kind, stored)) for stored in items or []]
+        entries = [
+            (stored, live or self.index.take_channel(kind, stored['name'], None if kind == 'category' else stored.get('category')))
+            for stored, live in entries
+        ]
+        if kind == 'category':
+            self.categories = _lookup(self.guild.categories, entries)
+        elif self.categories is None:
+            self.categories = _lookup(self.guild.categories, [])
+
+        ops = []
+        for stored, live in entries:
+            if live is None:
+                ops.append(Op(CREATE, kind, stored, dependency=self.is_dependency(stored)))
+                continue
+            if self.is_dependency(stored):
+                ops.append(Op(SKIP, kind, stored, live, dependency=True))
+                continue
+            changes = diff_fields(kind, stored, live, self.role_keys, self.codec)
+            parent_id = None
+            if kind != 'category':
+                parent_key = ref_key(stored, 'category_id', 'category')
+                parent = self.categories.get(parent_key) if parent_key else None
+                parent_id = parent.id if parent is not None else None
+                # 親カテゴリがこれから作られる場合も移動になる
+                moved = live.category_id != parent_id or (parent_key is not None and parent is None)
+            else:
+                moved = False
+            action = MOVE if moved else (EDIT if changes else SKIP)
+            ops.append(Op(action, kind, stored, live, changes))
+            self.channel_pairs.append((stored, live, parent_id))
+        return self._add(ops)
+
+    def _add(self, ops: list[Op]) -> list[Op]:
+        if self.validator is not None:
+            ops = self.validator.check(ops, self.role_keys)
+        self.ops.extend(ops)
+        return ops
+
+    def section(self, name: str, items) -> list[Op]:
+        if name == 'roles':
+            return self.roles(items)
+        kind = next((k for k, section in CHANNEL_SECTIONS if section == name), None)
+        return self.channels(kind, items) if kind is not None else []
+
+    def finish(self) -> RestorePlan:
+        guild, ops = self.guild, self.ops
+        plan = RestorePlan(ops, selection=self.selection,
+                           validation=self.validator.report if self.validator is not None else None)
+        plan.reorder_roles = bool(plan.of('role', CREATE)) or bool(plan_role_positions(guild, self.role_pairs))
+        if any(op.action in (CREATE, MOVE) for op in ops if op.kind != 'role'):
+            plan.reorder_channels = True
+        else:
+            plan.reorder_channels = bool(plan_channel_positions(guild, self.channel_pairs))
+        if self.selection is not None and not self.role_pairs and not plan.of('role', CREATE):
+            # 部分復元でロールに触らないなら、ほかのロールの位置の詰め直しもしない
+            plan.reorder_roles = False
+        return plan
+
+
+def plan_restore(guild: discord.Guild, backup: dict, idmap=None, selection=None, validator=None) -> RestorePlan:
+    # selection（selection.Selection）を渡すと、選んだものとその依存だけを計画する
+    if selection is not None:
+        backup = selection.backup
+    planner = RestorePlanner(guild, idmap, selection, validator)
+    planner.roles(backup.get('roles') or [])
+    for kind, section in CHANNEL_SECTIONS:
+        planner.channels(kind, backup.get(section) or [])
+    return planner.finish()
+
+
+class _Applier:
+    def __init__(self, guild: discord.Guild, http, executor, members: MemberResolver | None = None, idmap=None,
+                 journal=None):
+        self.guild = guild
+        self.http = http
+        self.executor = executor
+        self.members = members or MemberResolver(guild)
+        self.idmap = idmap
+        self.journal = journal
+        self.codec = OverwriteCodec()
+        # バックアップ内の参照キー（元 ID・旧形式では名前）→ 復元先のロール・カテゴリ
+        self.role_map: dict[str, discord.Role] = {}
+        self.cat_map: dict[str, discord.CategoryChannel] = {}
+        self.channel_pairs = []
+        self.done = {a: 0 for a in (CREATE, EDIT, MOVE, SKIP)}
+
+    async def _overwrites(self, stored: dict) -> dict:
+        return await self.codec.decode(stored, self.role_map, self.members)
+
+    async def _run(self, op: Op, route: str, factory):
+        try:
+            return await self.executor.run(route, factory, op.name)
+        except Exception as e:
+            await self._record(op, error=e)
+            raise
+
+    async def _record(self, op: Op, result=None, error: Exception | None = None):
+        # 作成・編集した結果を次の操作に進む前にジャーナルへ書く（スキップしたものは書かない）
+        if self.journal is not None and op.action != SKIP:
+            await run_io(self.journal.op, op.kind, op.stored, op.action, getattr(result, 'id', None), error)
+
+    async def role(self, op: Op):
+        r = op.stored
+        if op.target is None and op.action == SKIP:
+            # 対応するものが無い連携のロール
+            return None
+        fields = dict(
+            permissions=discord.Permissions(r['permissions']),
+            colour=discord.Colour(r['color']),
+            hoist=r['hoist'],
+            mentionable=r['mentionable'],
+        )
+        if 'name' in op.changes:
+            fields['name'] = r['name']
+        if op.action == CREATE:
+            result = await self._run(op, ROUTE_ROLE_CREATE, lambda: self.guild.create_role(name=r['name'], **fields))
+        else:
+            if op.changes:
+                await self._run(op, ROUTE_ROLE_EDIT, lambda: op.target.edit(**fields))
+            result = op.target
+        self.done[op.action] += 1
+        if self.idmap is not None:
+            self.idmap.set('roles', r.get('id'), result.id)
+        await self._record(op, result)
+        return result
+
+    async def _channel_kwargs(self, op: Op) -> dict:
+        ch = op.stored
+        kwargs = {}
+        if op.action != CREATE:
+            kwargs['name'] = ch['name']
+        if op.action == CREATE or 'overwrites' in op.changes:
+            kwargs['overwrites'] = await self._overwrites(ch.get('overwrites'))
+        if op.kind in ('text', 'forum'):
+            kwargs.update(nsfw=ch.get('nsfw', False), topic=ch.get('topic'))
+        if op.kind == 'text':
+            kwargs['slowmode_delay'] = ch.get('slowmode_delay', 0)
+        if op.kind == 'voice':
+            kwargs.update(bitrate=ch.get('bitrate', None), user_limit=ch.get('user_limit', 0))
+            if kwargs['bitrate'] is None:
+                del kwargs['bitrate']
+        if op.kind == 'forum':
+            tag_objs = []
+            for t in (ch.get('available_tags') or []):
+                try:
+                    emoji_val = _parse_reaction_emoji(t.get('emoji')) if t.get('emoji') else None
+                    tag_objs.append(discord.ForumTag(name=t.get('name'), emoji=emoji_val, moderated=bool(t.get('moderated', False))))
+                except Exception:
+                    pass
+            kwargs['default_reaction_emoji'] = _parse_reaction_emoji(ch.get('default_reaction_emoji'))
+            if ch.get('default_thread_slowmode_delay') is not None:
+                kwargs['default_thread_slowmode_delay'] = ch['default_thread_slowmode_delay']
+            kwargs['available_tags'] = tag_objs
+            if _FORUM_LAYOUT is not None and ch.get('default_layout'):
+                layout = getattr(_FORUM_LAYOUT, ch['default_layout'], None)
+                if layout is not None:
+                    kwargs['default_layout'] = layout
+            if _FORUM_ORDER is not None and ch.get('default_sort_order'):
+                order = getattr(_FORUM_ORDER, ch['default_sort_order'], None)
+                if order is not None:
+                    kwargs['default_sort_order'] = order
+        return kwargs
+
+    async def channel(self, op: Op):
+        ch = op.stored
+        parent_key = ref_key(ch, 'category_id', 'category') if op.kind != 'category' else None
+        category = self.cat_map.get(parent_key) if parent_key else None
+        parent_id = getattr(category, 'id', None)
+
+        if op.action == CREATE:
+            kwargs = await self._channel_kwargs(op)
+            if op.kind == 'category':
+                factory = lambda: self.guild.create_category(ch['name'], **kwargs)
+            elif op.kind == 'text':
+                factory = lambda: self.guild.create_text_channel(ch['name'], category=category, **kwargs)
+            elif op.kind == 'voice':
+                factory = lambda: self.guild.create_voice_channel(ch['name'], category=category, **kwargs)
+            else:
+                # create_forum は None を受け付けないので未設定の項目は落とす
+                for key in ('available_tags', 'default_reaction_emoji'):
+                    if not kwargs[key]:
+                        del kwargs[key]
+                factory = lambda: self.guild.create_forum(ch['name'], category=category, **kwargs)
+            result = await self._run(op, ROUTE_CHANNEL_CREATE, factory)
+        else:
+            if op.changes:
+                kwargs = await self._channel_kwargs(op)
+                # 差分のあった項目だけ送る。移動は最後の一括並べ替えで親カテゴリごと反映する
+                edit_kwargs = {k: v for k, v in kwargs.items() if k in op.changes}
+                await self._run(op, ROUTE_CHANNEL_EDIT, lambda: op.target.edit(**edit_kwargs))
+            result = op.target
+        self.done[op.action] += 1
+
+        if op.kind == 'category':
+            self.cat_map[ch['name']] = result
+            if ch.get('id') is not None:
+                self.cat_map[str(ch['id'])] = result
+            parent_id = None
+        if self.idmap is not None:
+            self.idmap.set('channels', ch.get('id'), result.id)
+        await self._record(op, result)
+        if not op.keeps_position:
+            self.channel_pairs.append((ch, result, parent_id))
+        return result
+
+
+def _dependencies(op: Op) -> list[tuple]:
+    # 依存グラフの辺: 上書きで参照するロール（上書きを送るときだけ）と、チャンネルの親カテゴリ
+    deps = []
+    if op.kind == 'role':
+        return deps
+    if op.action == CREATE or 'overwrites' in op.changes:
+        deps.extend(('role', key) for key, perm in (op.stored.get('overwrites') or {}).items()
+                    if perm.get('target_type') == ROLE and key != '@everyone')
+    if op.kind != 'category':
+        parent_key = ref_key(op.stored, 'category_id', 'category')
+        if parent_key:
+            deps.append(('category', parent_key))
+    return deps
+
+
+class _Graph:
+    # 依存グラフで実行する（部分復元・clone）。段階ごとに全件を待ち合わせず、各操作は自分の依存
+    # （ロール・親カテゴリ）の完了だけを待つ。互いに関係しないカテゴリとその配下は並列に進む（同時実行数は executor が絞る）。
+    # add は何回に分けてもよいが、依存先（ロール・カテゴリ）は依存元より先に add すること
+    def __init__(self, applier: _Applier, guild: discord.Guild):
+        self.applier = applier
+        self.finished: dict[tuple, asyncio.Future] = {}
+        self.tasks: list[asyncio.Task] = []
+        self.role_pairs = []
+        applier.role_map = _role_lookup(guild, [])
+        applier.cat_map = _lookup(guild.categories, [])
+
+    def add(self, ops):
+        loop = asyncio.get_running_loop()
+        nodes = []
+        for op in ops:
+            future = loop.create_future() if op.kind in ('role', 'category') else None
+            if future is not None:
+                for key in (ref_key(op.stored, 'id', 'name'), op.name):
+                    self.finished.setdefault((op.kind, key), future)
+            nodes.append((op, future))
+        self.tasks.extend(asyncio.create_task(self._node(op, future)) for op, future in nodes)
+
+    async def _node(self, op: Op, future):
+        applier = self.applier
+        try:
+            waits = [self.finished[dep] for dep in _dependencies(op) if dep in self.finished]
+            if waits:
+                await asyncio.wait(waits)
+            if op.kind != 'role':
+                await applier.channel(op)
+                return
+            role = await applier.role(op)
+            if role is None:
+                return
+            applier.role_map[op.name] = role
+            if op.stored.get('id') is not None:
+                applier.role_map[str(op.stored['id'])] = role
+            if not op.keeps_position:
+                self.role_pairs.append((op.stored, role))
+        finally:
+            # 失敗しても待っている側は進める（参照先の無い上書きは落として作る）
+            if future is not None:
+                future.set_result(None)
+
+    async def wait(self) -> list:
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        return self.role_pairs
+
+
+async def _prepare(ops, applier: _Applier, journal, progress):
+    if journal is not None:
+        await run_io(journal.plan, [op for op in ops if op.action != SKIP])
+    # 上書きを送る操作が参照するメンバーを先にまとめて解決しておく
+    member_ids = collect_member_ids(
+        op.stored for op in ops
+        if op.kind != 'role' and (op.action == CREATE or 'overwrites' in op.changes)
+    )
+    if member_ids:
+        await progress(f'👤 メンバー {len(member_ids)} 件を解決中…')
+        await applier.members.prefetch(member_ids)
+
+
+async def _finish_graph(plan: RestorePlan, guild: discord.Guild, executor, applier: _Applier, role_pairs, progress):
+    if plan.reorder_roles:
+        with phase('positions', '並び順'):
+            try:
+                await apply_role_positions(executor, ROUTE_ROLE_EDIT, guild, plan_role_positions(guild, role_pairs))
+            except Exception:
+                pass
+    return await _apply_positions(plan, guild, executor, applier, progress)
+
+
+async def _quiet(msg):
+    pass
+
+
+async def apply_stream(sections, guild: discord.Guild, http, executor, progress=None, idmap=None, journal=None,
+                       validator=None):
+    # sections は (セクション名, 項目の列) を roles → categories → text → forum → voice の順に返す非同期イテレータ。
+    # 届いたセクションから計画して依存グラフに積むので、後ろのセクションを読んでいる間に前のセクションの作成が進む
+    progress = progress or _quiet
+    planner = RestorePlanner(guild, idmap, validator=validator)
+    applier = _Applier(guild, http, executor, idmap=idmap, journal=journal)
+    with phase('structure', '構成'):
+        graph = _Graph(applier, guild)
+        async for name, items in sections:
+            ops = planner.section(name, items)
+            await _prepare(ops, applier, journal, progress)
+            graph.add(ops)
+            pending = sum(1 for op in planner.ops if op.action != SKIP)
+            await progress(f'📥 {name} を受け取り、作成中…（計画 {pending} 件・完了 {sum(applier.done.values())} 件）')
+        role_pairs = await graph.wait()
+        if idmap is not None:
+            await run_io(idmap.save)
+    return await _finish_graph(planner.finish(), guild, executor, applier, role_pairs, progress)
+
+
+async def apply_plan(plan: RestorePlan, guild: discord.Guild, http, executor, progress=None, idmap=None,
+                     journal=None):
+    _progress = progress or _quiet
+
+    async def _save_idmap():
+        # 段階ごとに対応表を書き出す。途中で止まっても次の復元は作ったものを ID で引ける
+        if idmap is not None:
+            await run_io(idmap.save)
+
+    applier = _Applier(guild, http, executor, idmap=idmap, journal=journal)
+    await _prepare(plan.ops, applier, journal, _progress)
+
+    if plan.selection is not None:
+        pending = [op for op in plan.ops if op.action != SKIP]
+        await _progress(f'🎯 選択した {len(pending)} 件を依存関係の順に復元中…（{plan.selection.filter.describe()}）')
+        with phase('selected', '部分復元'):
+            graph = _Graph(applier, guild)
+            graph.add(plan.ops)
+            role_pairs = await graph.wait()
+            await _save_idmap()
+        return await _finish_graph(plan, guild, executor, applier, role_pairs, _progress)
+
+    await _progress(f'🧩 ロールを復元中…（{len(plan.of("role", CREATE, EDIT))} 件）')
+    with phase('roles', 'ロール'):
+        role_ops = plan.of('role')
+        results = await asyncio.gather(*(applier.role(op) for op in role_ops), return_exceptions=True)
+        role_pairs = [(op.stored, role) for op, role in zip(role_ops, results) if isinstance(role, discord.Role)]
+        applier.role_map = _role_lookup(guild, role_pairs)
+        await _save_idmap()
+        if plan.reorder_roles:
+            try:
+                await apply_role_positions(executor, ROUTE_ROLE_EDIT, guild, plan_role_positions(guild, role_pairs))
+            except Exception:
+                pass
+
+    await _progress(f'📁 カテゴリを復元中…（{len(plan.of("category", CREATE, EDIT))} 件）')
+    with phase('categories', 'カテゴリ'):
+        applier.cat_map = _lookup(guild.categories, [])
+        await asyncio.gather(*(applier.channel(op) for op in plan.of('category')), return_exceptions=True)
+        await _save_idmap()
+
+    await _progress(f'💬 チャンネルを復元中…（{sum(len(plan.of(k, CREATE, EDIT, MOVE)) for k in ("text", "forum", "voice"))} 件）')
+    with phase('channels', 'チャンネル'):
+        channel_ops = [op for op in plan.ops if op.kind in ('text', 'forum', 'voice')]
+        await asyncio.gather(*(applier.channel(op) for op in channel_ops), return_exceptions=True)
+        await _save_idmap()
+    return await _apply_positions(plan, guild, executor, applier, _progress)
+
+
+async def _apply_positions(plan: RestorePlan, guild: discord.Guild, executor, applier: _Applier, progress):
+    if plan.reorder_channels:
+        await progress('🔀 並び順を調整中…')
+        with phase('positions', '並び順'):
+            try:
+                payload = plan_channel_positions(guild, applier.channel_pairs)
+                await apply_channel_positions(executor, ROUTE_CHANNEL_EDIT, applier.http, guild, payload)
+            except Exception:
+                pass
+    return applier.done
@@ -0,0 +1,58 @@
+import asyncio
+import os
+
+# 進捗メッセージの編集もメッセージ編集のレート制限を消費するので、
+# 処理側は最新の文面を置いていくだけにして、一定間隔でまとめて 1 回だけ編集する。
+
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL_SECONDS', '2'))
+
+
+class ProgressReporter:
+    def __init__(self, send, interval: float = PROGRESS_INTERVAL):
+        self.send = send
+        self.interval = interval
+        self.edits = 0
+        self._text: str | None = None
+        self._sent: str | None = None
+        self._task: asyncio.Task | None = None
+
+    def update(self, text: str):
+        self._text = text
+
+    async def flush(self):
+        text = self._text
+        if text is None or text == self._sent:
+            return
+        self._sent = text
+        self.edits += 1
+        try:
+            await self.send(text)
+        except Exception:
+            pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+        return False
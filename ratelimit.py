@@ -0,0 +1,143 @@
+import asyncio
+import os
+import time
+
+import discord
+
+from metrics import api_metrics
+
+# 復元・一括削除で使う Discord のルート（レート制限バケット）
+ROUTE_CHANNEL_CREATE = 'channel_create'
+ROUTE_CHANNEL_EDIT = 'channel_edit'
+ROUTE_CHANNEL_DELETE = 'channel_delete'
+ROUTE_THREAD_CREATE = 'thread_create'
+ROUTE_ROLE_CREATE = 'role_create'
+ROUTE_ROLE_EDIT = 'role_edit'
+ROUTE_ROLE_DELETE = 'role_delete'
+
+DEFAULT_CONCURRENCY = int(os.getenv('RESTORE_CONCURRENCY', '8'))
+
+
+def _retry_after(exc: Exception) -> float:
+    if isinstance(exc, discord.RateLimited):
+        return float(exc.retry_after)
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After', 1.0))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class RouteBucket:
+    # ルートごとの同時実行数を AIMD で調整する（成功で +1、429/遅延で半減）
+    def __init__(self, name: str, limit: int = 4, max_limit: int = 16, slow_threshold: float = 2.0):
+        self.name = name
+        self.limit = limit
+        self.max_limit = max_limit
+        self.slow_threshold = slow_threshold
+        self.active = 0
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.rate_limited = 0
+        self.slowed = 0
+        self._streak = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while self.active >= self.limit:
+                await self._cond.wait()
+            self.active += 1
+        delay = self.blocked_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.requests += 1
+
+    async def release(self):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def _shrink(self):
+        self.limit = max(1, self.limit // 2)
+        self._streak = 0
+
+    def on_success(self, elapsed: float):
+        # discord.py が内部で 429 を待った場合はレスポンスが遅くなるので、それも混雑とみなす
+        if elapsed >= self.slow_threshold:
+            self.slowed += 1
+            self._shrink()
+            return
+        self._streak += 1
+        if self._streak >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self._streak = 0
+
+    def on_rate_limited(self, retry_after: float):
+        self.rate_limited += 1
+        self._shrink()
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+class RestoreExecutor:
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, retries: int = 3):
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.buckets: dict[str, RouteBucket] = {}
+        self.failures: list[tuple[str, Exception]] = []
+        self.retried = 0
+        self._sem = asyncio.Semaphore(self.concurrency)
+
+    def bucket(self, route: str) -> RouteBucket:
+        b = self.buckets.get(route)
+        if b is None:
+            b = self.buckets[route] = RouteBucket(route, limit=min(4, self.concurrency), max_limit=self.concurrency)
+        return b
+
+    async def run(self, route: str, factory, label: str | None = None):
+        bucket = self.bucket(route)
+        attempt = 0
+        while True:
+            backoff = 0.0
+            async with self._sem:
+                await bucket.acquire()
+                start = time.monotonic()
+                try:
+                    result = await factory()
+                except (discord.RateLimited, discord.HTTPException) as e:
+                    status = getattr(e, 'status', 429)
+                    if attempt >= self.retries or not (status == 429 or status >= 500):
+                        self.failures.append((label or route, e))
+                        raise
+                    if status == 429:
+                        bucket.on_rate_limited(_retry_after(e))
+                    else:
+                        backoff = min(30.0, 0.5 * 2 ** attempt)
+                except Exception as e:
+                    self.failures.append((label or route, e))
+                    raise
+                else:
+                    bucket.on_success(time.monotonic() - start)
+                    return result
+                finally:
+                    await bucket.release()
+            attempt += 1
+            self.retried += 1
+            api_metrics.retry('executor')
+            if backoff:
+                await asyncio.sleep(backoff)
+
+    async def run_all(self, route: str, jobs):
+        # jobs: (label, factory) の列。失敗は failures に記録して None を返す
+        async def _one(label, factory):
+            try:
+                return await self.run(route, factory, label)
+            except Exception:
+                return None
+        return await asyncio.gather(*(_one(label, factory) for label, factory in jobs))
+
+    def summary(self) -> str:
+        rate_limited = sum(b.rate_limited for b in self.buckets.values())
+        requests = sum(b.requests for b in self.buckets.values())
+        return f'リクエスト {requests} 件・429 {rate_limited} 回・リトライ {self.retried} 回・失敗 {len(self.failures)} 件'
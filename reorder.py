@@ -0,0 +1,86 @@
+import discord
+
+# ロール・チャンネルの最終的な並び順を計算し、一括エンドポイントで 1 回ずつ適用する。
+# バックアップ側のエントリは保存時の position、それ以外の既存エントリは現在の position を
+# ソートキーにして混ぜるので、バックアップに無いものも相対位置を保ったまま並ぶ。
+
+
+def _channel_group(ch) -> int:
+    if isinstance(ch, discord.CategoryChannel):
+        return 2
+    if isinstance(ch, (discord.VoiceChannel, discord.StageChannel)):
+        return 1
+    return 0
+
+
+def plan_role_positions(guild: discord.Guild, pairs, live_roles=None) -> dict:
+    # pairs: (保存データ, 対応する Role) の列。戻り値は edit_role_positions にそのまま渡せる dict
+    live = {r.id: r for r in (live_roles if live_roles is not None else guild.roles)}
+    for _, role in pairs:
+        live[role.id] = role
+    me = getattr(guild, 'me', None)
+    ceiling = me.top_role.position if me is not None else None
+
+    stored_key = {role.id: int(stored.get('position', 0)) for stored, role in pairs}
+    # Bot の最上位ロール以上は動かせないので対象外
+    movable = [r for r in live.values() if not r.is_default() and (ceiling is None or r.position < ceiling)]
+    movable.sort(key=lambda r: (stored_key.get(r.id, r.position), 0 if r.id in stored_key else 1, r.id))
+
+    positions = {}
+    for pos, role in enumerate(movable, start=1):
+        if ceiling is not None and pos >= ceiling:
+            break
+        if role.position != pos:
+            positions[role] = pos
+    return positions
+
+
+def plan_channel_positions(guild: discord.Guild, pairs, live_channels=None) -> list[dict]:
+    # pairs: (保存データ, 対応するチャンネル, 目的の親カテゴリ ID または None) の列。
+    # 戻り値は PATCH /guilds/{id}/channels のペイロード（変更のあるものだけ）
+    live = {c.id: c for c in (live_channels if live_channels is not None else guild.channels)}
+    wanted = {}
+    for stored, ch, parent_id in pairs:
+        live[ch.id] = ch
+        wanted[ch.id] = (int(stored.get('position') or 0), parent_id)
+
+    groups: dict[tuple, list] = {}
+    for ch in live.values():
+        if isinstance(ch, discord.Thread):
+            continue
+        if ch.id in wanted:
+            key, parent_id = wanted[ch.id]
+        else:
+            key, parent_id = ch.position, getattr(ch, 'category_id', None)
+        if isinstance(ch, discord.CategoryChannel):
+            parent_id = None
+        groups.setdefault((parent_id, _channel_group(ch)), []).append((key, 0 if ch.id in wanted else 1, ch.id, ch, parent_id))
+
+    payload = []
+    for items in groups.values():
+        items.sort(key=lambda x: x[:3])
+        for pos, (_, _, _, ch, parent_id) in enumerate(items):
+            moved = not isinstance(ch, discord.CategoryChannel) and getattr(ch, 'category_id', None) != parent_id
+            if ch.position == pos and not moved:
+                continue
+            entry = {'id': ch.id, 'position': pos}
+            if moved:
+                entry['parent_id'] = parent_id
+                entry['lock_permissions'] = False
+            payload.append(entry)
+    return payload
+
+
+async def apply_role_positions(executor, route: str, guild: discord.Guild, positions: dict):
+    if not positions:
+        return 0
+    await executor.run(route, lambda: guild.edit_role_positions(positions, reason='restore'), 'role positions')
+    return 1
+
+
+async def apply_channel_positions(executor, route: str, http, guild: discord.Guild, payload: list[dict]):
+    # http はクライアントの HTTPClient（client.http）。discord.py に一括並べ替えの公開 API が無いので直接呼ぶ
+    if not payload:
+        return 0
+    await executor.run(route, lambda: http.bulk_channel_update(guild.id, payload, reason='restore'), 'channel positions')
+    return 1
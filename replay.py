@@ -0,0 +1,266 @@
+import asyncio
+import io
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+
+import discord
+
+from store import run_io, write_atomic
+
+# アーカイブしたメッセージを Webhook で再投稿する（元の投稿者名・アバターで）。
+# Webhook はそれぞれ独立したレート制限バケットを持つので、復元先チャンネルごとに
+# Webhook を 1 つ作り、その Webhook 専用のキューを 1 本ずつ並列に流す。
+# 進捗は <root>/<復元先ギルド>/<元ギルド>-<元チャンネル>.json に 1 件ごとに記録し、中断しても続きから再開する。
+
+REPLAY_CONCURRENCY = int(os.getenv('REPLAY_CONCURRENCY', '8'))
+WEBHOOK_NAME = 'DiscordBackUp replay'
+
+_REPLAYABLE = {'default', 'reply', 'thread_starter_message'}
+_FORBIDDEN_NAME = re.compile('discord|clyde', re.IGNORECASE)
+_MAX_CONTENT = 2000
+
+
+class ReplayJournal:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, target_guild_id, source_guild_id, source_channel_id) -> str:
+        return os.path.join(self.root, str(target_guild_id), f'{source_guild_id}-{source_channel_id}.json')
+
+    def load(self, target_guild_id, source_guild_id, source_channel_id) -> dict:
+        path = self._path(target_guild_id, source_guild_id, source_channel_id)
+        if not os.path.exists(path):
+            return {'last_id': None, 'sent': 0}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, target_guild_id, source_guild_id, source_channel_id, state: dict):
+        write_atomic(self._path(target_guild_id, source_guild_id, source_channel_id),
+                      json.dumps(state, ensure_ascii=False).encode('utf-8'))
+
+
+def _username(author: dict) -> str:
+    name = author.get('display_name') or author.get('name') or 'unknown'
+    # Webhook の名前に discord / clyde は使えない
+    name = _FORBIDDEN_NAME.sub(lambda m: m.group(0)[0] + '\u200b' + m.group(0)[1:], name)
+    return name[:80]
+
+
+def _split(content: str) -> list[str]:
+    if len(content) <= _MAX_CONTENT:
+        return [content]
+    parts = []
+    while content:
+        cut = content.rfind('\n', 0, _MAX_CONTENT)
+        cut = cut if cut > 0 else _MAX_CONTENT
+        parts.append(content[:cut])
+        content = content[cut:].lstrip('\n')
+    return parts
+
+
+def build_sends(msg: dict, assets=None) -> list[dict]:
+    # 1 件のアーカイブメッセージ → webhook.send に渡す引数の列（本文が長ければ分割する）
+    if msg.get('type', 'default') not in _REPLAYABLE:
+        return []
+    content = msg.get('content') or ''
+    files = []
+    for a in msg.get('attachments') or []:
+        data = assets.get_key(f"attachment:{a['id']}") if assets is not None else None
+        if data is not None:
+            files.append(discord.File(io.BytesIO(data), filename=a.get('filename') or 'file',
+                                      description=a.get('description')))
+        elif a.get('url'):
+            content += ('\n' if content else '') + a['url']
+    embeds = [discord.Embed.from_dict(e) for e in msg.get('embeds') or [] if e.get('type', 'rich') == 'rich'][:10]
+    if not content and not files and not embeds:
+        return []
+    author = msg.get('author') or {}
+    base = {
+        'username': _username(author),
+        'avatar_url': author.get('avatar'),
+        'allowed_mentions': discord.AllowedMentions.none(),
+        'wait': True,
+    }
+    parts = _split(content) if content else ['']
+    sends = [dict(base, content=part) for part in parts]
+    # 添付と埋め込みは最後の 1 通に付ける
+    if files:
+        sends[-1]['files'] = files
+    if embeds:
+        sends[-1]['embeds'] = embeds
+    for send in sends:
+        if not send['content']:
+            del send['content']
+    return sends
+
+
+@dataclass
+class ChannelTarget:
+    # source: アーカイブの checkpoint、webhook: 投稿に使う Webhook、
+    # thread: スレッドへ投稿する場合の discord.Object（フォーラム投稿で未作成なら None で thread_name を使う）
+    source: dict
+    webhook: discord.Webhook
+    thread: discord.abc.Snowflake | None = None
+    thread_name: str | None = None
+    skip_ids: set = field(default_factory=set)
+
+
+@dataclass
+class ReplayReport:
+    channels: int = 0
+    messages: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    per_channel: dict = field(default_factory=dict)  # 名前 → (件数, 秒)
+    failures: list = field(default_factory=list)  # (チャンネル名, 理由)
+    _start: float = field(default_factory=time.perf_counter)
+
+    @property
+    def rate(self) -> float:
+        elapsed = self.elapsed or (time.perf_counter() - self._start)
+        return self.messages / elapsed if elapsed > 0 else 0.0
+
+    def progress(self) -> str:
+        return f'📨 メッセージを再投稿中… {self.messages} 件（{self.rate:.1f} 件/秒）・チャンネル {self.channels} 件完了'
+
+    def summary(self) -> str:
+        text = (f'メッセージ再投稿: {self.messages} 件・チャンネル {self.channels} 件・'
+                f'{self.elapsed:.1f} 秒（{self.rate:.1f} 件/秒）・スキップ {self.skipped} 件')
+        if self.failures:
+            names = '、'.join(f'#{name}（{reason}）' for name, reason in self.failures[:5])
+            text += f'\n⚠️ 再投稿できなかったチャンネル {len(self.failures)} 件: {names}'
+        return text
+
+
+async def replay_channel(archive, source_guild_id, target: ChannelTarget, journal: ReplayJournal,
+                         target_guild_id, report: ReplayReport, assets=None, progress=None):
+    # 1 つの Webhook のキュー。順序を保つため、このチャンネルの中は 1 件ずつ送る
+    source = target.source
+    state = await run_io(journal.load, target_guild_id, source_guild_id, source['id'])
+    if state.get('thread_id'):
+        target.thread = discord.Object(id=state['thread_id'])
+    start = time.perf_counter()
+    sent = 0
+    # segment（最大 ARCHIVE_SEGMENT_MESSAGES 件）単位で読むので、チャンネルが大きくてもメモリは一定
+    for name in await run_io(archive.segments, source_guild_id, source['id'], state.get('last_id')):
+        for msg in await run_io(archive.read_segment, source_guild_id, source['id'], name):
+            if state.get('last_id') is not None and msg['id'] <= state['last_id']:
+                continue
+            sends = await run_io(build_sends, msg, assets) if msg['id'] not in target.skip_ids else []
+            if not sends:
+                report.skipped += 1
+            for kwargs in sends:
+                if target.thread is not None:
+                    kwargs['thread'] = target.thread
+                elif target.thread_name:
+                    # フォーラムでは最初の 1 通でそのまま投稿（スレッド）を作る
+                    kwargs['thread_name'] = target.thread_name[:100]
+                result = await target.webhook.send(**kwargs)
+                if target.thread is None and target.thread_name and result is not None:
+                    target.thread = discord.Object(id=result.channel.id)
+                    state['thread_id'] = result.channel.id
+            if sends:
+                sent += 1
+                report.messages += 1
+            state['last_id'] = msg['id']
+            state['sent'] = state.get('sent', 0) + (1 if sends else 0)
+            await run_io(journal.save, target_guild_id, source_guild_id, source['id'], state)
+            if progress is not None:
+                progress.update(report.progress())
+    report.per_channel[source.get('name')] = (sent, time.perf_counter() - start)
+    return sent
+
+
+async def ensure_webhook(channel) -> discord.Webhook:
+    # 以前の復元で作った Webhook があれば使い回す
+    for webhook in await channel.webhooks():
+        if webhook.name == WEBHOOK_NAME and webhook.token:
+            return webhook
+    return await channel.create_webhook(name=WEBHOOK_NAME, reason='メッセージの復元')
+
+
+def _find_channel(guild: discord.Guild, name: str, category: str | None, kinds, source_id=None, idmap=None):
+    # 元のチャンネル ID（対応表 → 同じ ID）で引けなければ名前とカテゴリ名で探す
+    if source_id is not None:
+        mapped = idmap.get('channels', source_id) if idmap is not None else None
+        for candidate in (mapped, source_id):
+            channel = guild.get_channel(candidate) if candidate else None
+            if isinstance(channel, kinds):
+                return channel
+    candidates = [c for c in guild.channels if isinstance(c, kinds) and c.name == name]
+    for c in candidates:
+        if (c.category.name if c.category else None) == category:
+            return c
+    return candidates[0] if candidates else None
+
+
+async def resolve_targets(guild: discord.Guild, sources: list[dict], thread_map: dict | None = None,
+                          idmap=None) -> tuple[list, list]:
+    # アーカイブの各チャンネルを復元先チャンネル（と Webhook）に対応付ける。
+    # thread_map（元のスレッド ID → 復元済みスレッド）にあるスレッドはそこへ投稿する。
+    # 無ければテキストスレッドは Bot が作ってから投稿し、フォーラム投稿は Webhook の thread_name で作る
+    thread_map = thread_map or {}
+    targets, missing = [], []
+    webhooks: dict[int, discord.Webhook] = {}
+    for source in sources:
+        if source.get('kind') == 'text':
+            channel = _find_channel(guild, source['name'], source.get('category'), discord.TextChannel,
+                                    source['id'], idmap)
+        else:
+            channel = _find_channel(guild, source.get('parent'), source.get('category'),
+                                    (discord.TextChannel, discord.ForumChannel), source.get('parent_id'), idmap)
+        if channel is None:
+            missing.append(source.get('name'))
+            continue
+        try:
+            if channel.id not in webhooks:
+                webhooks[channel.id] = await ensure_webhook(channel)
+            target = ChannelTarget(source, webhooks[channel.id])
+            restored = thread_map.get(source['id'])
+            if restored is not None:
+                target.thread = restored
+                if source.get('kind') == 'forum_post':
+                    # 最初のメッセージ（投稿と同じ ID）は投稿の作成時に送ってある
+                    target.skip_ids.add(source['id'])
+            elif source.get('kind') == 'forum_post':
+                target.thread_name = source['name']
+            elif source.get('kind') == 'thread':
+                mapped = idmap.get('threads', source['id']) if idmap is not None else None
+                existing = guild.get_thread(mapped) if mapped else None
+                existing = existing or next((t for t in channel.threads if t.name == source['name']), None)
+                target.thread = existing or await channel.create_thread(
+                    name=source['name'][:100], type=discord.ChannelType.public_thread, reason='メッセージの復元')
+                if idmap is not None:
+                    idmap.set('threads', source['id'], target.thread.id)
+        except discord.HTTPException:
+            missing.append(source.get('name'))
+            continue
+        targets.append(target)
+    return targets, missing
+
+
+async def replay_all(archive, source_guild_id, targets: list[ChannelTarget], journal: ReplayJournal,
+                     target_guild_id, assets=None, concurrency: int = REPLAY_CONCURRENCY, progress=None) -> ReplayReport:
+    # 同じ Webhook を使うチャンネル（テキストとそのスレッド）は 1 本のキューにまとめ、Webhook ごとに並列に流す
+    report = ReplayReport()
+    queues: dict[int, list[ChannelTarget]] = {}
+    for target in targets:
+        queues.setdefault(target.webhook.id, []).append(target)
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _webhook_queue(items):
+        async with sem:
+            for target in items:
+                try:
+                    await replay_channel(archive, source_guild_id, target, journal, target_guild_id, report,
+                                         assets, progress)
+                except discord.HTTPException as e:
+                    report.failures.append((target.source.get('name'), f'{e.status} {e.text or type(e).__name__}'))
+                report.channels += 1
+
+    await asyncio.gather(*(_webhook_queue(items) for items in queues.values()))
+    report.elapsed = time.perf_counter() - report._start
+    return report
@@ -0,0 +1,149 @@
+import fnmatch
+from dataclasses import asdict, dataclass, field
+
+# 一部だけの復元（/restore categories:… channels:… kinds:… ids:…）。
+# 条件に合うエンティティを選び、依存関係（チャンネル → 親カテゴリ、カテゴリ・チャンネル → 上書きで参照するロール）を
+# たどって必要なロール・カテゴリだけを足す。依存として足したものは無ければ作るだけで、既にあれば触らない。
+# categories・channels・ids はどれかに合えば選び（和）、kinds はさらに種類で絞る（積）。kinds だけなら種類で選ぶ。
+
+KIND_SECTIONS = {'role': 'roles', 'category': 'categories', 'text': 'text', 'forum': 'forum', 'voice': 'voice'}
+
+
+def _split(value) -> list[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [v.strip() for v in value if v and v.strip()]
+
+
+def _keys(stored: dict, id_key: str, name_key: str) -> set[str]:
+    # 参照に使われうるキー（元 ID と、旧形式の名前）
+    keys = {str(stored[id_key])} if stored.get(id_key) is not None else set()
+    if stored.get(name_key):
+        keys.add(stored[name_key])
+    return keys
+
+
+@dataclass
+class RestoreFilter:
+    categories: list = field(default_factory=list)
+    channels: list = field(default_factory=list)
+    kinds: list = field(default_factory=list)
+    ids: list = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, categories=None, channels=None, kinds=None, ids=None) -> 'RestoreFilter | None':
+        # カンマ区切りの文字列（スラッシュコマンド）かリスト（CLI）から作る。条件が無ければ None（全体を復元）
+        flt = cls(_split(categories), _split(channels), _split(kinds), _split(ids))
+        unknown = [k for k in flt.kinds if k not in KIND_SECTIONS]
+        if unknown:
+            raise ValueError(f'不明な種類です: {", ".join(unknown)}（{", ".join(KIND_SECTIONS)} から選んでください）')
+        return flt if flt else None
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> 'RestoreFilter | None':
+        return cls(**data) if data else None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def __bool__(self) -> bool:
+        return bool(self.categories or self.channels or self.kinds or self.ids)
+
+    def describe(self) -> str:
+        parts = []
+        for label, values in (('カテゴリ', self.categories), ('チャンネル', self.channels), ('種類', self.kinds),
+                              ('ID', self.ids)):
+            if values:
+                parts.append(f'{label} {", ".join(values)}')
+        return '・'.join(parts)
+
+    def _matches(self, kind: str, stored: dict) -> bool:
+        if self.kinds and kind not in self.kinds:
+            return False
+        if not (self.categories or self.channels or self.ids):
+            return True
+        if stored.get('id') is not None and str(stored['id']) in self.ids:
+            return True
+        if kind == 'category':
+            return bool(_keys(stored, 'id', 'name') & set(self.categories))
+        if kind == 'role':
+            return False
+        if _keys(stored, 'category_id', 'category') & set(self.categories):
+            return True
+        return any(fnmatch.fnmatchcase(stored.get('name') or '', pattern) for pattern in self.channels)
+
+    def resolve(self, backup: dict) -> 'Selection':
+        roles, categories = {}, {}
+        for stored in backup.get('roles') or []:
+            for key in _keys(stored, 'id', 'name'):
+                roles.setdefault(key, stored)
+        for stored in backup.get('categories') or []:
+            for key in _keys(stored, 'id', 'name'):
+                categories.setdefault(key, stored)
+
+        chosen = {}
+        for kind, section in KIND_SECTIONS.items():
+            for stored in backup.get(section) or []:
+                if self._matches(kind, stored):
+                    chosen[id(stored)] = stored
+        selected = set(chosen)
+
+        # 依存をたどる。カテゴリを足したらそのカテゴリの上書きが参照するロールも足す
+        pending = list(chosen.values())
+        while pending:
+            stored = pending.pop()
+            needed = [roles.get(key) for key, perm in (stored.get('overwrites') or {}).items()
+                      if perm.get('target_type') == 'role' and key != '@everyone']
+            parent_id, parent = stored.get('category_id'), stored.get('category')
+            if parent_id is not None or parent:
+                needed.append(categories.get(str(parent_id)) or categories.get(parent))
+            for dep in needed:
+                if dep is not None and id(dep) not in chosen:
+                    chosen[id(dep)] = dep
+                    pending.append(dep)
+
+        subset = dict(backup)
+        for section in KIND_SECTIONS.values():
+            if section in backup:
+                subset[section] = [s for s in backup[section] or [] if id(s) in chosen]
+        return Selection(self, subset, set(chosen) - selected)
+
+
+class Selection:
+    # RestoreFilter を 1 つのバックアップに当てはめた結果。backup は選んだもの＋依存だけのバックアップ
+    def __init__(self, flt: RestoreFilter, backup: dict, dependencies: set):
+        self.filter = flt
+        self.backup = backup
+        self._dependencies = dependencies
+        self.channel_ids = set()
+        self.channel_names = set()
+        for section in ('text', 'forum', 'voice'):
+            for stored in backup.get(section) or []:
+                if id(stored) not in dependencies:
+                    if stored.get('id') is not None:
+                        self.channel_ids.add(str(stored['id']))
+                    self.channel_names.add(stored.get('name'))
+
+    def is_dependency(self, stored: dict) -> bool:
+        return id(stored) in self._dependencies
+
+    def count(self) -> tuple[int, int]:
+        # (選んだもの, 依存として足したもの)
+        total = sum(len(self.backup.get(s) or []) for s in KIND_SECTIONS.values())
+        return total - len(self._dependencies), len(self._dependencies)
+
+    def allows_thread(self, record: dict) -> bool:
+        return str(record.get('parent_id')) in self.channel_ids or (
+            record.get('parent_id') is None and record.get('parent') in self.channel_names)
+
+    def allows_source(self, source: dict) -> bool:
+        # メッセージアーカイブのチャンネル（テキスト・スレッド・フォーラム投稿）を再投稿するか
+        if source.get('kind') == 'text':
+            return str(source.get('id')) in self.channel_ids
+        return str(source.get('parent_id')) in self.channel_ids
+
+    def describe(self) -> str:
+        selected, dependencies = self.count()
+        return f'🎯 部分復元: {self.filter.describe()}（対象 {selected} 件・依存 {dependencies} 件）'
@@ -0,0 +1,46 @@
+import discord
+
+from codec import OverwriteCodec, RoleRecord, CategoryRecord, TextRecord, ForumRecord, VoiceRecord
+
+# ギルドのキャッシュからバックアップのセクションを組み立てる。
+# backup_slash と自動バックアップの両方から使う。
+# 1 回のバックアップでは同じ codec を全セクションに渡すと、上書きの組が共有される。
+
+# 特殊板を除外
+SKIP_TEXT = ("moderator-only", "rules")
+
+
+def serialize_roles(guild: discord.Guild, codec: OverwriteCodec | None = None) -> list:
+    return [RoleRecord.from_role(role).to_dict() for role in guild.roles if not role.is_default()]
+
+
+def serialize_categories(guild: discord.Guild, codec: OverwriteCodec | None = None) -> list:
+    codec = codec or OverwriteCodec()
+    return [CategoryRecord.from_channel(cat, codec).to_dict() for cat in guild.categories]
+
+
+def serialize_text(guild: discord.Guild, codec: OverwriteCodec | None = None) -> list:
+    codec = codec or OverwriteCodec()
+    return [TextRecord.from_channel(ch, codec).to_dict() for ch in guild.text_channels if ch.name not in SKIP_TEXT]
+
+
+def serialize_forum(guild: discord.Guild, codec: OverwriteCodec | None = None) -> list:
+    codec = codec or OverwriteCodec()
+    return [
+        ForumRecord.from_channel(ch, codec).to_dict()
+        for ch in guild.channels if isinstance(ch, discord.ForumChannel)
+    ]
+
+
+def serialize_voice(guild: discord.Guild, codec: OverwriteCodec | None = None) -> list:
+    codec = codec or OverwriteCodec()
+    return [VoiceRecord.from_channel(ch, codec).to_dict() for ch in guild.voice_channels]
+
+
+SERIALIZERS = {
+    'roles': serialize_roles,
+    'categories': serialize_categories,
+    'text': serialize_text,
+    'forum': serialize_forum,
+    'voice': serialize_voice,
+}
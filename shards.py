@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import socket
+import time
+
+import discord
+from discord.ext import commands
+
+from store import write_atomic
+
+# シャーディング。大量のギルドを扱うときは AutoShardedBot で複数シャードに分け、
+# さらにプロセスごとに受け持つシャードを SHARD_IDS で分けられる（SHARD_COUNT は全プロセスで同じ値）。
+#   SHARD_COUNT=16 SHARD_IDS=0-7   python bot.py   # 1 台目
+#   SHARD_COUNT=16 SHARD_IDS=8-15  python bot.py   # 2 台目
+# 各プロセスは自分のシャードのギルドしか受け取らないので、定期バックアップも自分のギルドだけを処理する。
+# 定期バックアップはシャードごとのキューに積み、シャードごとのワーカーで処理する（遅いシャードが他を止めない）。
+# キューの状況は <root>/<プロセス名>.json に定期的に書き出し、/shards で全プロセス分をまとめて表示する。
+
+SHARD_COUNT = int(os.getenv('SHARD_COUNT') or 0) or None
+SHARD_IDS = (os.getenv('SHARD_IDS') or '').strip()
+AUTO_SHARD = os.getenv('AUTO_SHARD', '0').lower() in ('1', 'true', 'yes')
+SHARD_WORKERS = int(os.getenv('AUTO_BACKUP_SHARD_WORKERS', '2'))
+STATUS_INTERVAL = float(os.getenv('SHARD_STATUS_INTERVAL_SECONDS', '30'))
+PROCESS_NAME = os.getenv('SHARD_PROCESS_NAME') or f'{socket.gethostname()}-{os.getpid()}'
+
+
+def parse_shard_ids(spec: str) -> list[int] | None:
+    # "0-3,8,10-11" → [0, 1, 2, 3, 8, 10, 11]
+    if not spec:
+        return None
+    ids = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-', 1)
+            ids.update(range(int(lo), int(hi) + 1))
+        else:
+            ids.add(int(part))
+    return sorted(ids)
+
+
+def is_sharded() -> bool:
+    return AUTO_SHARD or SHARD_COUNT is not None or bool(SHARD_IDS)
+
+
+def build_intents(members: bool, message_content: bool, minimal: bool | None = None) -> discord.Intents:
+    # minimal: スラッシュコマンドと自動バックアップに要るイベント（ギルド・ロール・チャンネル・絵文字）だけ。
+    # 省略時はシャーディングするときだけ minimal にする
+    if minimal is None:
+        minimal = (os.getenv('INTENTS_PROFILE') or ('minimal' if is_sharded() else 'default')) == 'minimal'
+    intents = discord.Intents.none() if minimal else discord.Intents.default()
+    intents.guilds = True
+    if minimal:
+        intents.emojis_and_stickers = True
+    intents.members = members
+    intents.message_content = message_content
+    return intents
+
+
+def bot_options(intents: discord.Intents) -> tuple[type, dict]:
+    # (Bot クラス, コンストラクタ引数)。シャーディングしないときは従来どおり commands.Bot
+    if not is_sharded():
+        return commands.Bot, {}
+    shard_ids = parse_shard_ids(SHARD_IDS)
+    if shard_ids is not None and SHARD_COUNT is None:
+        raise ValueError('SHARD_IDS を指定するときは SHARD_COUNT も指定してください')
+    options = {
+        'shard_count': SHARD_COUNT,
+        'shard_ids': shard_ids,
+        # 数千ギルドのメンバーを全部キャッシュしない。メンバー宛ての上書きは復元時に必要な分だけ問い合わせる
+        'chunk_guilds_at_startup': False,
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+    }
+    if (os.getenv('MEMBER_CACHE') or 'none') != 'none':
+        options['member_cache_flags'] = discord.MemberCacheFlags.from_intents(intents)
+    return commands.AutoShardedBot, options
+
+
+class ShardQueues:
+    # シャード ID → ギルドのキュー。同じギルドは処理待ちの間に 2 回積まない
+    def __init__(self, handler, workers: int = SHARD_WORKERS):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self._queues: dict[int, asyncio.Queue] = {}
+        self._tasks: dict[int, list[asyncio.Task]] = {}
+        self._pending: set[int] = set()
+        self.running: dict[int, int] = {}
+        self.done: dict[int, int] = {}
+        self.failed: dict[int, int] = {}
+
+    def _queue(self, shard_id: int) -> asyncio.Queue:
+        queue = self._queues.get(shard_id)
+        if queue is None:
+            queue = self._queues[shard_id] = asyncio.Queue()
+            self._tasks[shard_id] = [asyncio.create_task(self._worker(shard_id, queue)) for _ in range(self.workers)]
+        return queue
+
+    def submit(self, guild: discord.Guild) -> bool:
+        if guild.id in self._pending:
+            return False
+        self._pending.add(guild.id)
+        self._queue(guild.shard_id or 0).put_nowait(guild)
+        return True
+
+    async def _worker(self, shard_id: int, queue: asyncio.Queue):
+        while True:
+            guild = await queue.get()
+            self._pending.discard(guild.id)
+            self.running[shard_id] = self.running.get(shard_id, 0) + 1
+            try:
+                await self.handler(guild)
+                self.done[shard_id] = self.done.get(shard_id, 0) + 1
+            except Exception:
+                # 失敗の内容はハンドラ（AutoBackup.backup_guild）が /metrics の auto_backup_errors_total に数える。
+                # ここではシャードごとの件数（/shards に表示）だけを数え、ワーカーは次のギルドへ進む
+                self.failed[shard_id] = self.failed.get(shard_id, 0) + 1
+            finally:
+                self.running[shard_id] -= 1
+                queue.task_done()
+
+    def depth(self) -> dict[int, dict]:
+        return {
+            shard_id: {'queued': queue.qsize(), 'running': self.running.get(shard_id, 0),
+                       'done': self.done.get(shard_id, 0), 'failed': self.failed.get(shard_id, 0)}
+            for shard_id, queue in sorted(self._queues.items())
+        }
+
+    def stop(self):
+        for tasks in self._tasks.values():
+            for task in tasks:
+                task.cancel()
+        self._tasks.clear()
+        self._queues.clear()
+        self._pending.clear()
+
+
+def shard_status(bot, queues: ShardQueues | None) -> dict:
+    # このプロセスが受け持つシャードごとのギルド数・レイテンシ・キューの深さ
+    guilds: dict[int, int] = {}
+    for guild in bot.guilds:
+        shard_id = guild.shard_id or 0
+        guilds[shard_id] = guilds.get(shard_id, 0) + 1
+    latencies = dict(getattr(bot, 'latencies', None) or [(0, bot.latency)])
+    depth = queues.depth() if queues is not None else {}
+    shards = {}
+    for shard_id in sorted(set(guilds) | set(latencies) | set(depth)):
+        latency = latencies.get(shard_id)
+        shards[str(shard_id)] = dict(
+            {'guilds': guilds.get(shard_id, 0), 'queued': 0, 'running': 0, 'done': 0, 'failed': 0},
+            latency_ms=round(latency * 1000, 1) if latency is not None and latency == latency else None,
+            **depth.get(shard_id, {}),
+        )
+    return {'process': PROCESS_NAME, 'updated_at': time.time(), 'shard_count': getattr(bot, 'shard_count', None) or 1,
+            'shards': shards}
+
+
+class ShardStatusBoard:
+    # プロセスごとの状況ファイル。同じ backup/ を共有していれば全プロセス分を読める
+    def __init__(self, root: str):
+        self.root = root
+
+    def write(self, status: dict):
+        write_atomic(os.path.join(self.root, f"{status['process']}.json"),
+                      json.dumps(status, ensure_ascii=False).encode('utf-8'))
+
+    def read_all(self, max_age: float | None = None) -> list[dict]:
+        if not os.path.isdir(self.root):
+            return []
+        out = []
+        max_age = max_age if max_age is not None else STATUS_INTERVAL * 4
+        for name in sorted(os.listdir(self.root)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.root, name), 'r', encoding='utf-8') as f:
+                    status = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # 止まったプロセスの古いファイルは表示しない
+            if time.time() - status.get('updated_at', 0) <= max_age:
+                out.append(status)
+        return out
+
+
+def render_status(statuses: list[dict], limit: int = 1900) -> str:
+    rows = []
+    for status in statuses:
+        for shard_id, s in status['shards'].items():
+            rows.append((int(shard_id), status['process'], s))
+    rows.sort(key=lambda r: r[0])
+    total_queued = sum(s['queued'] for _, _, s in rows)
+    lines = [f'🧭 シャード {len(rows)} 件・プロセス {len(statuses)} 件・バックアップ待ち {total_queued} 件']
+    size = len(lines[0])
+    for i, (shard_id, process, s) in enumerate(rows):
+        latency = f"{s['latency_ms']:.0f} ms" if s.get('latency_ms') is not None else '-'
+        line = (f"- #{shard_id}（{process}）ギルド {s['guilds']}・待ち {s['queued']}・実行中 {s['running']}・"
+                f"完了 {s['done']}・失敗 {s['failed']}・{latency}")
+        if size + len(line) + 1 > limit:
+            lines.append(f'…ほか {len(rows) - i} 件')
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return '\n'.join(lines)
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+
+import discord
+from discord.flags import alias_flag_value
+
+from snapshot import SnapshotError
+
+# スナップショット同士の差分（/backup_diff・python store.py diff）。
+# セクションごとに「エンティティのキー（ID。旧形式では名前）→ 内容のハッシュ・名前」の索引を作っておき、
+#   1. セクションのオブジェクトが同じ（内容アドレスが一致）なら丸ごと飛ばす
+#   2. 索引どうしを比べて追加・削除・ハッシュが変わったものだけを拾う
+#   3. ハッシュが変わったものだけセクション本体を読んで項目・権限上書きを比べる
+# の順に絞るので、1 万チャンネルでも変更が少なければ本体はほとんど読まない。
+# 索引はセクションを保存したときに作り、store がオブジェクトと同じく内容アドレスで持つ。
+
+INDEX_VERSION = 1
+CHANNEL_SECTIONS = ('categories', 'text', 'forum', 'voice')
+INDEXED_SECTIONS = ('roles',) + CHANNEL_SECTIONS
+
+SECTION_LABELS = {'roles': 'ロール', 'categories': 'カテゴリ', 'text': 'テキスト', 'forum': 'フォーラム', 'voice': 'ボイス'}
+FIELD_LABELS = {
+    'name': '名前', 'color': '色', 'hoist': '別表示', 'mentionable': 'メンション可', 'permissions': '権限',
+    'position': '位置', 'category': 'カテゴリ', 'category_id': 'カテゴリ', 'nsfw': 'NSFW', 'topic': 'トピック',
+    'slowmode_delay': '低速モード', 'bitrate': 'ビットレート', 'user_limit': '人数制限',
+    'default_thread_slowmode_delay': '投稿の低速モード', 'default_reaction_emoji': '既定のリアクション',
+    'default_layout': 'レイアウト', 'default_sort_order': '並び順', 'available_tags': 'タグ', 'section': '種類',
+    'managed': '連携ロール',
+}
+# 差分として見せない項目（ID は対応付けに使う。カテゴリは名前と ID の両方を持つので名前で見せる）
+_HIDDEN_FIELDS = ('id', 'overwrites', 'category_id')
+_STATE_LABELS = {1: '許可', -1: '拒否', 0: '未設定'}
+
+# 権限のビット → 名前（別名は除く）
+PERMISSION_FLAGS = sorted(
+    ((name, value) for name, value in discord.Permissions.VALID_FLAGS.items()
+     if not isinstance(discord.Permissions.__dict__.get(name), alias_flag_value)),
+    key=lambda kv: kv[1],
+)
+
+
+def entity_key(item: dict) -> str:
+    if item.get('id') is not None:
+        return str(item['id'])
+    # 旧形式（ID なし）は名前で対応付ける。チャンネルはカテゴリ名も含める
+    category = item.get('category')
+    return 'name:' + (f'{category}/' if category else '') + str(item.get('name'))
+
+
+def build_index(items: list) -> dict:
+    entities = {}
+    for item in items:
+        raw = json.dumps(item, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        entities[entity_key(item)] = [hashlib.blake2b(raw, digest_size=8).hexdigest(), item.get('name')]
+    return {'version': INDEX_VERSION, 'entities': entities}
+
+
+def permission_changes(old: int, new: int) -> tuple[list[str], list[str]]:
+    # ロールの権限: (付いた権限, 外れた権限)
+    changed = old ^ new
+    gained = [name for name, bit in PERMISSION_FLAGS if changed & bit and new & bit]
+    lost = [name for name, bit in PERMISSION_FLAGS if changed & bit and old & bit]
+    return gained, lost
+
+
+def overwrite_changes(old: dict | None, new: dict | None) -> list[tuple[str, str, str]]:
+    # 権限上書き 1 件: [(権限名, 前の状態, 後の状態)]。状態は 許可 / 拒否 / 未設定
+    old_allow, old_deny = int((old or {}).get('allow', 0)), int((old or {}).get('deny', 0))
+    new_allow, new_deny = int((new or {}).get('allow', 0)), int((new or {}).get('deny', 0))
+    changed = (old_allow ^ new_allow) | (old_deny ^ new_deny)
+    out = []
+    for name, bit in PERMISSION_FLAGS:
+        if not changed & bit:
+            continue
+        # allow と deny の両方に立っているビットは discord.py と同じく拒否として扱う
+        before = -1 if old_deny & bit else (1 if old_allow & bit else 0)
+        after = -1 if new_deny & bit else (1 if new_allow & bit else 0)
+        if before != after:
+            out.append((name, _STATE_LABELS[before], _STATE_LABELS[after]))
+    return out
+
+
+@dataclass(slots=True)
+class EntityDiff:
+    section: str
+    key: str
+    name: str
+    fields: dict = field(default_factory=dict)
+    permissions: tuple = ((), ())
+    overwrites: list = field(default_factory=list)
+
+    @property
+    def position_only(self) -> bool:
+        return set(self.fields) <= {'position'} and not self.overwrites and not any(self.permissions)
+
+    def to_dict(self) -> dict:
+        out = {'section': self.section, 'key': self.key, 'name': self.name,
+               'fields': {k: {'old': a, 'new': b} for k, (a, b) in self.fields.items()}}
+        if any(self.permissions):
+            out['permissions'] = {'gained': list(self.permissions[0]), 'lost': list(self.permissions[1])}
+        if self.overwrites:
+            out['overwrites'] = [
+                {'target': target, 'change': change, 'bits': [{'name': n, 'old': a, 'new': b} for n, a, b in bits]}
+                for target, change, bits in self.overwrites
+            ]
+        return out
+
+
+@dataclass
+class SnapshotDiff:
+    a: str
+    b: str
+    added: dict = field(default_factory=lambda: {'roles': [], 'channels': []})
+    removed: dict = field(default_factory=lambda: {'roles': [], 'channels': []})
+    changed: dict = field(default_factory=lambda: {'roles': [], 'channels': []})
+    skipped_sections: int = 0
+    compared_sections: int = 0
+    deep_compared: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def empty(self) -> bool:
+        return not any(self.added.values()) and not any(self.removed.values()) and not any(self.changed.values())
+
+    def to_dict(self) -> dict:
+        return {
+            'a': self.a, 'b': self.b,
+            'added': {g: [dict(e) for e in v] for g, v in self.added.items()},
+            'removed': {g: [dict(e) for e in v] for g, v in self.removed.items()},
+            'changed': {g: [e.to_dict() for e in v] for g, v in self.changed.items()},
+            'skipped_sections': self.skipped_sections,
+            'deep_compared': self.deep_compared,
+            'elapsed': round(self.elapsed, 4),
+        }
+
+    def summary(self) -> str:
+        parts = []
+        for group, label in (('roles', 'ロール'), ('channels', 'チャンネル')):
+            moved = sum(1 for e in self.changed[group] if e.position_only)
+            parts.append(f'{label} 追加 {len(self.added[group])}・削除 {len(self.removed[group])}・'
+                         f'変更 {len(self.changed[group]) - moved}・位置のみ {moved}')
+        return ' / '.join(parts)
+
+    def render(self, limit: int | None = 1900) -> str:
+        header = (f'🔍 `{self.a}` → `{self.b}` の差分（同一セクション {self.skipped_sections}/'
+                  f'{self.skipped_sections + self.compared_sections} 件は比較を省略・詳細比較 {self.deep_compared} 件・'
+                  f'{self.elapsed:.2f} 秒）\n{self.summary()}')
+        if self.empty:
+            return header + '\n変更はありません。'
+        lines = []
+        for group in ('roles', 'channels'):
+            for e in self.added[group]:
+                lines.append(f'＋ {_label(e["section"], e["name"])}')
+            for e in self.removed[group]:
+                lines.append(f'－ {_label(e["section"], e["name"])}')
+            for e in self.changed[group]:
+                if not e.position_only:
+                    lines.extend(_render_entity(e))
+        moved = [e for g in ('roles', 'channels') for e in self.changed[g] if e.position_only]
+        if moved:
+            # 1 件の挿入で後ろ全部の位置がずれるので、名前は先頭の数件だけ出す
+            names = '、'.join(_label(e.section, e.name) for e in moved[:20])
+            lines.append(f'↕ 位置のみ変更 {len(moved)} 件: {names}' + ('…' if len(moved) > 20 else ''))
+        out = [header]
+        size = len(header)
+        for i, line in enumerate(lines):
+            if limit is not None and size + len(line) + 1 > limit - 20:
+                out.append(f'…ほか {len(lines) - i} 行')
+                break
+            out.append(line)
+            size += len(line) + 1
+        return '\n'.join(out)
+
+
+def _label(section: str, name) -> str:
+    if section == 'roles':
+        return f'@{name}'
+    if section == 'categories':
+        return f'📁{name}'
+    return f'#{name}'
+
+
+def _short(value, width: int = 40) -> str:
+    text = repr(value)
+    return text if len(text) <= width else text[:width - 1] + '…'
+
+
+def _render_entity(e: EntityDiff) -> list[str]:
+    changes = [f'{FIELD_LABELS.get(k, k)} {_short(a)} → {_short(b)}'
+               for k, (a, b) in e.fields.items() if k != 'permissions']
+    gained, lost = e.permissions
+    if gained or lost:
+        changes.append('権限 ' + ' '.join([f'+{n}' for n in gained] + [f'-{n}' for n in lost]))
+    lines = [f'～ {_label(e.section, e.name)}' + (': ' + '、'.join(changes) if changes else '')]
+    for target, change, bits in e.overwrites:
+        detail = '、'.join(f'{n} {a}→{b}' for n, a, b in bits)
+        lines.append(f'　　{target}（上書き{change}）' + (f': {detail}' if detail else ''))
+    return lines
+
+
+def _compare(section: str, key: str, old: dict, new: dict, target_name) -> EntityDiff:
+    diff = EntityDiff(section, key, new.get('name') or old.get('name'))
+    for name in sorted(set(old) | set(new)):
+        if name in _HIDDEN_FIELDS or old.get(name) == new.get(name):
+            continue
+        diff.fields[name] = (old.get(name), new.get(name))
+    if 'permissions' in diff.fields:
+        diff.permissions = permission_changes(int(old.get('permissions') or 0), int(new.get('permissions') or 0))
+    old_ow, new_ow = old.get('overwrites') or {}, new.get('overwrites') or {}
+    for target in sorted(set(old_ow) | set(new_ow)):
+        before, after = old_ow.get(target), new_ow.get(target)
+        if before == after:
+            continue
+        change = '追加' if before is None else ('削除' if after is None else '変更')
+        diff.overwrites.append((target_name(target, before or after), change, overwrite_changes(before, after)))
+    return diff
+
+
+def diff_snapshots(store, guild_id, a: str | None, b: str | None = None) -> SnapshotDiff:
+    # store は SnapshotStore。a・b はスナップショット ID（省略時は最新。別ギルドのものは ギルドID/スナップショットID）
+    start = time.perf_counter()
+    snap_a, snap_b = store.find(guild_id, a), store.find(guild_id, b)
+    for snap, snapshot_id in ((snap_a, a), (snap_b, b)):
+        if snap is None:
+            raise SnapshotError(f'スナップショット {snapshot_id or "(最新)"} が見つかりません')
+    result = SnapshotDiff(snap_a['id'], snap_b['id'])
+
+    # キー → (セクション, ハッシュ, 名前)。同じオブジェクトを指すセクションは両側とも載せない
+    entities = ({}, {})
+    changed_sections = set()
+    for section in INDEXED_SECTIONS:
+        objects = [snap['sections'].get(section, {}).get('object') for snap in (snap_a, snap_b)]
+        if objects[0] == objects[1]:
+            result.skipped_sections += objects[0] is not None
+            continue
+        result.compared_sections += 1
+        changed_sections.add(section)
+        for side, digest in zip(entities, objects):
+            if digest is None:
+                continue
+            for key, (value, name) in store.section_index(digest)['entities'].items():
+                side[key] = (section, value, name)
+
+    old, new = entities
+    groups = {section: 'roles' if section == 'roles' else 'channels' for section in INDEXED_SECTIONS}
+    for key in old.keys() - new.keys():
+        section, _, name = old[key]
+        result.removed[groups[section]].append({'section': section, 'key': key, 'name': name})
+    for key in new.keys() - old.keys():
+        section, _, name = new[key]
+        result.added[groups[section]].append({'section': section, 'key': key, 'name': name})
+    modified = [key for key in old.keys() & new.keys() if old[key][:2] != new[key][:2]]
+
+    if modified:
+        # ハッシュが変わったものだけ本体を読む（読むのは変化のあったセクションだけ）
+        bodies = ({}, {})
+        for side, snap, index in zip(bodies, (snap_a, snap_b), entities):
+            needed = {index[key][0] for key in modified}
+            for section in needed:
+                entry = snap['sections'].get(section)
+                if entry is not None:
+                    side.update((entity_key(item), item) for item in store.get_section(entry['object']))
+        role_names = {}
+        for snap in (snap_a, snap_b):
+            entry = snap['sections'].get('roles')
+            if entry is not None:
+                role_names.update((k, v[1]) for k, v in store.section_index(entry['object'])['entities'].items())
+
+        def target_name(target: str, stored: dict) -> str:
+            if target == '@everyone':
+                return target
+            if stored.get('target_type') == 'member':
+                return f'メンバー {target}'
+            return f'@{role_names.get(target) or role_names.get("name:" + target) or target}'
+
+        for key in sorted(modified, key=lambda k: (INDEXED_SECTIONS.index(new[k][0]), str(new[k][2]))):
+            section = new[key][0]
+            entity = _compare(section, key, bodies[0].get(key, {}), bodies[1].get(key, {}), target_name)
+            if old[key][0] != section:
+                entity.fields['section'] = (SECTION_LABELS[old[key][0]], SECTION_LABELS[section])
+            result.changed[groups[section]].append(entity)
+        result.deep_compared = len(modified)
+
+    for group in ('roles', 'channels'):
+        for entries in (result.added[group], result.removed[group]):
+            entries.sort(key=lambda e: (INDEXED_SECTIONS.index(e['section']), str(e['name'])))
+    result.elapsed = time.perf_counter() - start
+    return result
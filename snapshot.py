@@ -0,0 +1,309 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 単一ファイルのスナップショット形式。
+#   MAGIC(4) | version(u16) | header_len(u32) | header(JSON) | section ...
+# header の sections に各セクションの offset/length/sha256 を持つので、
+# 1 セクションだけ読むときは seek して読めばよい。各セクションは独立に圧縮する。
+
+MAGIC = b'DBAK'
+VERSION = 1
+_PRELUDE = struct.Struct('>4sHI')
+_CHUNK = 64 * 1024
+
+SECTIONS = ('roles', 'categories', 'text', 'forum', 'voice')
+LEGACY_FILES = {
+    'roles': 'roles.json',
+    'categories': 'categories.json',
+    'text': 'text_channels.json',
+    'forum': 'forum_channels.json',
+    'voice': 'voice_channels.json',
+}
+DEFAULT_CODEC = 'zstd' if zstandard is not None else 'gzip'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def compressor(codec: str):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise SnapshotError('zstd で圧縮するには zstandard パッケージが必要です')
+        return zstandard.ZstdCompressor(level=6).compressobj()
+    if codec == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    raise SnapshotError(f'未知の圧縮形式です: {codec}')
+
+
+def compress(codec: str, raw: bytes) -> bytes:
+    comp = compressor(codec)
+    return comp.compress(raw) + comp.flush()
+
+
+def decompressor(codec: str):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise SnapshotError('このスナップショットを読むには zstandard パッケージが必要です')
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == 'gzip':
+        return zlib.decompressobj(31)
+    raise SnapshotError(f'未知の圧縮形式です: {codec}')
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise SnapshotError('このスナップショットを読むには zstandard パッケージが必要です')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if codec == 'gzip':
+        return zlib.decompress(data, 31)
+    raise SnapshotError(f'未知の圧縮形式です: {codec}')
+
+
+class SnapshotWriter:
+    # セクションを 1 つずつ圧縮しながら本体用の一時ファイルへ流し込み、
+    # close 時にヘッダ（索引）を先頭に付けて書き出す
+    def __init__(self, path: str, meta: dict | None = None, codec: str = DEFAULT_CODEC):
+        self.path = path
+        self.codec = codec
+        self.meta = dict(meta or {})
+        self.created_at = self.meta.pop('created_at', None) or time.time()
+        self.sections: dict[str, dict] = {}
+        self._body = None
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def _open_body(self):
+        if self._body is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._body = tempfile.TemporaryFile(dir=directory)
+        return self._body
+
+    def add(self, name: str, items) -> dict:
+        if name in self.sections:
+            raise SnapshotError(f'セクション {name} が重複しています')
+        self._open_body()
+        comp = compressor(self.codec)
+        digest = hashlib.sha256()
+        length = 0
+        raw_size = 0
+        buf = []
+        buffered = 0
+
+        def _emit(data: bytes):
+            nonlocal length
+            if data:
+                self._body.write(data)
+                digest.update(data)
+                length += len(data)
+
+        # 要素ごとに（C 実装の）json.dumps で直列化し、ある程度まとめてから圧縮器へ渡す
+        buf.append('[')
+        for i, item in enumerate(items):
+            if i:
+                buf.append(',')
+            chunk = json.dumps(item, ensure_ascii=False, separators=(',', ':'))
+            buf.append(chunk)
+            buffered += len(chunk)
+            if buffered >= _CHUNK:
+                raw = ''.join(buf).encode('utf-8')
+                raw_size += len(raw)
+                _emit(comp.compress(raw))
+                buf.clear()
+                buffered = 0
+        buf.append(']')
+        raw = ''.join(buf).encode('utf-8')
+        raw_size += len(raw)
+        _emit(comp.compress(raw))
+        _emit(comp.flush())
+        entry = {
+            'offset': self._offset,
+            'length': length,
+            'raw_size': raw_size,
+            'count': len(items),
+            'sha256': digest.hexdigest(),
+        }
+        self._offset += length
+        self.sections[name] = entry
+        return entry
+
+    def header(self) -> dict:
+        return {
+            'version': VERSION,
+            'codec': self.codec,
+            'created_at': self.created_at,
+            'meta': self.meta,
+            'sections': self.sections,
+        }
+
+    def close(self):
+        header = json.dumps(self.header(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        tmp = self.path + '.tmp'
+        self._open_body()
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(_PRELUDE.pack(MAGIC, VERSION, len(header)))
+                f.write(header)
+                self._body.seek(0)
+                shutil.copyfileobj(self._body, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        finally:
+            self._body.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._body is not None:
+            self._body.close()
+        return False
+
+
+class SnapshotReader:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            prelude = f.read(_PRELUDE.size)
+            if len(prelude) < _PRELUDE.size:
+                raise SnapshotError('スナップショットが短すぎます（破損しています）')
+            magic, version, header_len = _PRELUDE.unpack(prelude)
+            if magic != MAGIC:
+                raise SnapshotError('スナップショット形式ではありません')
+            if version > VERSION:
+                raise SnapshotError(f'未対応のスナップショットのバージョンです: {version}')
+            try:
+                self.header = json.loads(f.read(header_len).decode('utf-8'))
+            except ValueError as e:
+                raise SnapshotError(f'ヘッダが読めません: {e}') from e
+        self.version = version
+        self.codec = self.header['codec']
+        self.meta = self.header.get('meta', {})
+        self.created_at = self.header.get('created_at')
+        self.sections: dict[str, dict] = self.header['sections']
+        self._body_start = _PRELUDE.size + header_len
+
+    def _read_raw(self, f, name: str) -> bytes:
+        entry = self.sections[name]
+        f.seek(self._body_start + entry['offset'])
+        data = f.read(entry['length'])
+        if len(data) != entry['length'] or hashlib.sha256(data).hexdigest() != entry['sha256']:
+            raise SnapshotError(f'セクション {name} のチェックサムが一致しません（破損しています）')
+        return data
+
+    def verify(self) -> list[str]:
+        bad = []
+        with open(self.path, 'rb') as f:
+            for name in self.sections:
+                try:
+                    self._read_raw(f, name)
+                except SnapshotError:
+                    bad.append(name)
+        return bad
+
+    def read_section(self, name: str):
+        if name not in self.sections:
+            return None
+        with open(self.path, 'rb') as f:
+            data = self._read_raw(f, name)
+        return json.loads(decompress(self.codec, data).decode('utf-8'))
+
+    def load(self, names=None) -> dict:
+        names = [n for n in (names or self.sections) if n in self.sections]
+        out = {}
+        with open(self.path, 'rb') as f:
+            # 全セクションのチェックサムを先に確認してから展開する
+            raws = {name: self._read_raw(f, name) for name in names}
+        for name, data in raws.items():
+            out[name] = json.loads(decompress(self.codec, data).decode('utf-8'))
+        return out
+
+
+def write_snapshot(path: str, sections: dict, meta: dict | None = None, codec: str = DEFAULT_CODEC) -> dict:
+    with SnapshotWriter(path, meta=meta, codec=codec) as w:
+        for name in SECTIONS:
+            if name in sections:
+                w.add(name, sections[name])
+        for name, items in sections.items():
+            if name not in SECTIONS:
+                w.add(name, items)
+    return w.header()
+
+
+def load_snapshot(path: str, names=None) -> dict:
+    return SnapshotReader(path).load(names)
+
+
+def load_legacy(backup_dir: str) -> dict:
+    sections = {}
+    for name, filename in LEGACY_FILES.items():
+        path = os.path.join(backup_dir, filename)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                sections[name] = json.load(f)
+    return sections
+
+
+def convert_legacy(backup_dir: str, out_path: str, codec: str = DEFAULT_CODEC) -> dict:
+    sections = load_legacy(backup_dir)
+    if not sections:
+        raise SnapshotError(f'{backup_dir} に旧形式のバックアップがありません')
+    return write_snapshot(out_path, sections, meta={'converted_from': 'legacy'}, codec=codec)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='スナップショットの変換・検証')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('convert', help='旧形式（5 ファイル）からスナップショットへ変換')
+    p.add_argument('backup_dir')
+    p.add_argument('out')
+    p.add_argument('--codec', choices=('gzip', 'zstd'), default=DEFAULT_CODEC)
+    p = sub.add_parser('info', help='ヘッダの索引を表示')
+    p.add_argument('path')
+    p = sub.add_parser('verify', help='全セクションのチェックサムを検証')
+    p.add_argument('path')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'convert':
+            header = convert_legacy(args.backup_dir, args.out, codec=args.codec)
+            print(f"{args.out}: {os.path.getsize(args.out)} bytes, {len(header['sections'])} sections ({header['codec']})")
+        elif args.command == 'info':
+            reader = SnapshotReader(args.path)
+            print(f'version={reader.version} codec={reader.codec} meta={reader.meta}')
+            for name, entry in reader.sections.items():
+                print(f"  {name:<12} count={entry['count']:<6} {entry['length']:>10} / {entry['raw_size']:>10} bytes  sha256={entry['sha256'][:16]}")
+        elif args.command == 'verify':
+            bad = SnapshotReader(args.path).verify()
+            if bad:
+                print('破損したセクション: ' + ', '.join(bad))
+                return 1
+            print('OK')
+    except SnapshotError as e:
+        print(f'エラー: {e}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
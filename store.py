@@ -0,0 +1,537 @@
+import asyncio
+import codecs
+import datetime
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from snapdiff import INDEX_VERSION, INDEXED_SECTIONS, build_index, diff_snapshots
+from snapshot import (DEFAULT_CODEC, SECTIONS, SnapshotError, SnapshotReader, SnapshotWriter, compress, compressor,
+                      decompress, decompressor)
+
+# ギルド ID × タイムスタンプでスナップショットを管理するリポジトリ。
+#   <root>/objects/ab/<sha256>.gz|.zst  セクション本体（内容アドレス。全ギルドで共有）
+#   <root>/indexes/ab/<sha256>.json      セクションの索引（エンティティ → 内容のハッシュ。差分用）
+#   <root>/guilds/<guild_id>/index.json  スナップショット一覧（セクション → オブジェクトの対応も持つ）
+# 変化していないセクションは同じオブジェクトを指すだけなので 1 回しか保存されない。
+
+CODEC_SUFFIX = {'gzip': '.gz', 'zstd': '.zst'}
+_CODEC_BY_SUFFIX = {v: k for k, v in CODEC_SUFFIX.items()}
+
+# SectionReader が 1 回に読む圧縮データの大きさ
+READ_CHUNK = int(os.getenv('STORE_READ_CHUNK', str(64 * 1024)))
+
+KEEP_LAST = int(os.getenv('RETENTION_KEEP_LAST', '10'))
+KEEP_DAILY = int(os.getenv('RETENTION_KEEP_DAILY', '7'))
+KEEP_WEEKLY = int(os.getenv('RETENTION_KEEP_WEEKLY', '4'))
+
+# ファイル I/O と圧縮・JSON 処理はイベントループの外（専用スレッドプール）で行う
+_IO_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('IO_WORKERS', '4')), thread_name_prefix='backup-io')
+
+
+async def run_io(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_IO_POOL, lambda: func(*args, **kwargs))
+
+
+def backup_dir() -> str:
+    # 保存先。bot・CLI（jobs.py）とこのファイルのコマンドで同じ場所を使う
+    # （読み込んだ時点ではなく呼んだ時点の環境変数を見る。bench.py は store を読み込んでから BACKUP_DIR を決める）
+    return os.getenv('BACKUP_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup')
+
+
+def _canonical(items) -> bytes:
+    return json.dumps(items, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def section_digest(items) -> str:
+    # セクションのオブジェクト名（正規化した JSON の sha256）。保存せずに前回のものと同じかを比べるのにも使う
+    return hashlib.sha256(_canonical(items)).hexdigest()
+
+
+def write_atomic(path: str, data: bytes):
+    # 一時ファイルに書いてから rename するので、途中で落ちても中途半端なファイルは残らない
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class SnapshotStore:
+    def __init__(self, root: str, codec: str = DEFAULT_CODEC):
+        self.root = root
+        self.codec = codec
+        self.objects_dir = os.path.join(root, 'objects')
+        self.indexes_dir = os.path.join(root, 'indexes')
+        self.guilds_dir = os.path.join(root, 'guilds')
+        # 索引の読み書きと GC を直列化する。書き込み途中（索引に載る前）のオブジェクトは GC しない
+        self._lock = threading.RLock()
+        self._pending: dict[str, int] = {}
+
+    # --- オブジェクト ---
+
+    def _object_path(self, digest: str, codec: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest + CODEC_SUFFIX[codec])
+
+    def _find_object(self, digest: str) -> str | None:
+        for codec in CODEC_SUFFIX:
+            path = self._object_path(digest, codec)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def put_section(self, items, name: str | None = None) -> tuple[str, bool]:
+        raw = _canonical(items)
+        digest = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            self._pending[digest] = self._pending.get(digest, 0) + 1
+            if self._find_object(digest) is not None:
+                return digest, False
+        write_atomic(self._object_path(digest, self.codec), compress(self.codec, raw))
+        if name in INDEXED_SECTIONS:
+            # 差分用の索引も新しいオブジェクトのときだけ作る（変化のないセクションは前回の索引を使う）
+            self._put_index(digest, build_index(items))
+        return digest, True
+
+    def retain(self, digest: str) -> bool:
+        # 既存オブジェクトを新しいスナップショットから参照する前に GC から保護する
+        with self._lock:
+            if self._find_object(digest) is None:
+                return False
+            self._pending[digest] = self._pending.get(digest, 0) + 1
+            return True
+
+    def _release(self, digests):
+        with self._lock:
+            for digest in digests:
+                left = self._pending.get(digest, 0) - 1
+                if left > 0:
+                    self._pending[digest] = left
+                else:
+                    self._pending.pop(digest, None)
+
+    def get_section(self, digest: str):
+        path = self._find_object(digest)
+        if path is None:
+            raise SnapshotError(f'オブジェクト {digest[:12]} が見つかりません')
+        codec = _CODEC_BY_SUFFIX[os.path.splitext(path)[1]]
+        with open(path, 'rb') as f:
+            raw = decompress(codec, f.read())
+        if hashlib.sha256(raw).hexdigest() != digest:
+            raise SnapshotError(f'オブジェクト {digest[:12]} のチェックサムが一致しません（破損しています）')
+        return json.loads(raw.decode('utf-8'))
+
+    # --- セクションの索引（差分用） ---
+
+    def _section_index_path(self, digest: str) -> str:
+        return os.path.join(self.indexes_dir, digest[:2], digest + '.json')
+
+    def _put_index(self, digest: str, index: dict):
+        write_atomic(self._section_index_path(digest), json.dumps(index, ensure_ascii=False).encode('utf-8'))
+
+    def section_index(self, digest: str) -> dict:
+        path = self._section_index_path(digest)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        # 索引を作る前に保存したセクション（または壊れた索引）は本体から作り直して保存する
+        index = build_index(self.get_section(digest))
+        self._put_index(digest, index)
+        return index
+
+    def diff(self, guild_id, a: str | None, b: str | None = None):
+        return diff_snapshots(self, guild_id, a, b)
+
+    # --- 索引 ---
+
+    def _index_path(self, guild_id) -> str:
+        return os.path.join(self.guilds_dir, str(guild_id), 'index.json')
+
+    def list_guilds(self) -> list[str]:
+        if not os.path.isdir(self.guilds_dir):
+            return []
+        return sorted(g for g in os.listdir(self.guilds_dir) if os.path.exists(self._index_path(g)))
+
+    def list_snapshots(self, guild_id) -> list[dict]:
+        path = self._index_path(guild_id)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['snapshots']
+
+    def _save_index(self, guild_id, snapshots: list[dict]):
+        snapshots = sorted(snapshots, key=lambda s: s['created_at'])
+        data = json.dumps({'guild_id': str(guild_id), 'snapshots': snapshots}, ensure_ascii=False, indent=2)
+        write_atomic(self._index_path(guild_id), data.encode('utf-8'))
+
+    def latest(self, guild_id) -> dict | None:
+        snapshots = self.list_snapshots(guild_id)
+        return snapshots[-1] if snapshots else None
+
+    def find(self, guild_id, snapshot_id: str | None = None) -> dict | None:
+        # 'ギルドID/スナップショットID' 形式なら別ギルドのスナップショットも指定できる
+        # （ここでは権限を確かめない。利用者の入力を渡す側が、そのギルドを使ってよいかを先に確かめること）
+        if snapshot_id and '/' in snapshot_id:
+            guild_id, snapshot_id = snapshot_id.split('/', 1)
+        snapshots = self.list_snapshots(guild_id)
+        if not snapshot_id:
+            return snapshots[-1] if snapshots else None
+        for snap in snapshots:
+            if snap['id'] == snapshot_id:
+                return snap
+        matches = [s for s in snapshots if s['id'].startswith(snapshot_id)]
+        return matches[0] if len(matches) == 1 else None
+
+    # --- スナップショット ---
+
+    def writer(self, guild_id, meta: dict | None = None) -> 'StoreWriter':
+        return StoreWriter(self, guild_id, meta)
+
+    def add_snapshot(self, guild_id, sections: dict, meta: dict | None = None) -> dict:
+        w = self.writer(guild_id, meta)
+        for name in SECTIONS:
+            if name in sections:
+                w.add(name, sections[name])
+        for name, items in sections.items():
+            if name not in SECTIONS:
+                w.add(name, items)
+        return w.close()
+
+    def _commit(self, guild_id, entry: dict):
+        with self._lock:
+            snapshots = [s for s in self.list_snapshots(guild_id) if s['id'] != entry['id']]
+            snapshots.append(entry)
+            self._save_index(guild_id, snapshots)
+
+    def load(self, guild_id, snapshot_id: str | None = None, names=None, streamed=()) -> dict:
+        snap = self.find(guild_id, snapshot_id)
+        if snap is None:
+            raise SnapshotError(f'スナップショット {snapshot_id or "(最新)"} が見つかりません')
+        names = [n for n in (names or snap['sections']) if n in snap['sections']]
+        # 全セクションを検証してから返す（途中で壊れていたら復元を始めない）。
+        # streamed のセクション（スレッドなど件数の多いもの）だけは SectionReader で返し、使うときに少しずつ読む
+        return {name: (SectionReader(self, snap['sections'][name]['object'], snap['sections'][name]['count'])
+                       if name in streamed else self.get_section(snap['sections'][name]['object']))
+                for name in names}
+
+    def export(self, guild_id, snapshot_id: str | None, path: str) -> dict:
+        snap = self.find(guild_id, snapshot_id)
+        if snap is None:
+            raise SnapshotError(f'スナップショット {snapshot_id or "(最新)"} が見つかりません')
+        meta = dict(snap.get('meta', {}), created_at=snap['created_at'], snapshot_id=snap['id'])
+        meta.setdefault('guild_id', str(guild_id))
+        with SnapshotWriter(path, meta=meta, codec=self.codec) as w:
+            for name, entry in snap['sections'].items():
+                w.add(name, self.get_section(entry['object']))
+        return w.header()
+
+    def import_file(self, path: str, guild_id=None) -> dict:
+        reader = SnapshotReader(path)
+        guild_id = guild_id or reader.meta.get('guild_id')
+        if guild_id is None:
+            raise SnapshotError('ギルド ID が分からないため取り込めません')
+        meta = {k: v for k, v in reader.meta.items() if k not in ('snapshot_id',)}
+        w = StoreWriter(self, guild_id, meta, created_at=reader.created_at)
+        for name, items in reader.load().items():
+            w.add(name, items)
+        return w.close()
+
+    # --- 保持ポリシー ---
+
+    def select_kept(self, snapshots: list[dict], keep_last: int, keep_daily: int, keep_weekly: int) -> set[str]:
+        ordered = sorted(snapshots, key=lambda s: s['created_at'], reverse=True)
+        kept = {s['id'] for s in ordered[:keep_last]}
+        for count, bucket in ((keep_daily, lambda d: d.date()), (keep_weekly, lambda d: d.isocalendar()[:2])):
+            seen = []
+            for s in ordered:
+                key = bucket(datetime.datetime.fromtimestamp(s['created_at'], datetime.timezone.utc))
+                if key in seen:
+                    continue
+                if len(seen) >= count:
+                    break
+                seen.append(key)
+                kept.add(s['id'])
+        return kept
+
+    def apply_retention(self, guild_id, keep_last: int = KEEP_LAST, keep_daily: int = KEEP_DAILY, keep_weekly: int = KEEP_WEEKLY) -> list[str]:
+        with self._lock:
+            snapshots = self.list_snapshots(guild_id)
+            kept = self.select_kept(snapshots, keep_last, keep_daily, keep_weekly)
+            removed = [s['id'] for s in snapshots if s['id'] not in kept]
+            if removed:
+                self._save_index(guild_id, [s for s in snapshots if s['id'] in kept])
+                self.gc()
+        return removed
+
+    def gc(self) -> int:
+        with self._lock:
+            return self._gc()
+
+    def _gc(self) -> int:
+        # どのギルドの索引からも参照されないオブジェクトを消す
+        referenced = set(self._pending)
+        for guild_id in self.list_guilds():
+            for snap in self.list_snapshots(guild_id):
+                referenced.update(entry['object'] for entry in snap['sections'].values())
+        removed = 0
+        if os.path.isdir(self.objects_dir):
+            for prefix in os.listdir(self.objects_dir):
+                directory = os.path.join(self.objects_dir, prefix)
+                for filename in os.listdir(directory):
+                    digest, suffix = os.path.splitext(filename)
+                    if suffix in _CODEC_BY_SUFFIX and digest not in referenced:
+                        os.remove(os.path.join(directory, filename))
+                        removed += 1
+        # 索引はオブジェクトと一緒に消す（件数には数えない）
+        if os.path.isdir(self.indexes_dir):
+            for prefix in os.listdir(self.indexes_dir):
+                directory = os.path.join(self.indexes_dir, prefix)
+                for filename in os.listdir(directory):
+                    digest, suffix = os.path.splitext(filename)
+                    if suffix == '.json' and digest not in referenced:
+                        os.remove(os.path.join(directory, filename))
+        return removed
+
+
+class SectionStream:
+    # 件数の多いセクション（スレッドなど）を、全件をリストに溜めずに書く。write を何回かに分けて呼び、close で
+    # オブジェクトにする。正規化した JSON は put_section と同じなので、同じ内容なら同じオブジェクトになる
+    def __init__(self, store: SnapshotStore, name: str):
+        self.store = store
+        self.name = name
+        self.count = 0
+        self._hash = hashlib.sha256()
+        self._comp = compressor(store.codec)
+        # 書き終わるまでは objects/ の外（GC が見ない場所。rename できるよう同じ root の下）に置く
+        directory = os.path.join(store.root, 'tmp')
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=directory, prefix=f'{name}.', suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self._put(b'[')
+
+    def _put(self, raw: bytes):
+        self._hash.update(raw)
+        self._file.write(self._comp.compress(raw))
+
+    def write(self, items):
+        for item in items:
+            self._put((b',' if self.count else b'') + _canonical(item))
+            self.count += 1
+
+    def close(self) -> tuple[str, bool]:
+        self._put(b']')
+        self._file.write(self._comp.flush())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        digest = self._hash.hexdigest()
+        with self.store._lock:
+            self.store._pending[digest] = self.store._pending.get(digest, 0) + 1
+            if self.store._find_object(digest) is not None:
+                os.remove(self._tmp)
+                return digest, False
+        path = self.store._object_path(digest, self.store.codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self._tmp, path)
+        return digest, True
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+class SectionReader:
+    # SectionStream の逆。セクションを全件リストにせず、先頭から 1 件ずつ返す（メモリに載るのは READ_CHUNK 分と 1 件だけ）。
+    # 何度でも繰り返し読める。チェックサムは最後まで読んだときに確かめる
+    def __init__(self, store: SnapshotStore, digest: str, count: int):
+        self.store = store
+        self.digest = digest
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        path = self.store._find_object(self.digest)
+        if path is None:
+            raise SnapshotError(f'オブジェクト {self.digest[:12]} が見つかりません')
+        decomp = decompressor(_CODEC_BY_SUFFIX[os.path.splitext(path)[1]])
+        text = codecs.getincrementaldecoder('utf-8')()
+        decoder = json.JSONDecoder()
+        checksum = hashlib.sha256()
+        buf, pos, opened, closed = '', 0, False, False
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(READ_CHUNK)
+                raw = decomp.decompress(chunk) if chunk else decomp.flush()
+                checksum.update(raw)
+                buf, pos = buf[pos:] + text.decode(raw, final=not chunk), 0
+                if not opened and buf:
+                    if buf[0] != '[':
+                        break
+                    opened, pos = True, 1
+                # 読めたところまでの項目を返す。途中で切れている項目は次の chunk と合わせて読む
+                while not closed and pos < len(buf):
+                    if buf[pos] == ']':
+                        closed = True
+                        break
+                    if buf[pos] == ',':
+                        pos += 1
+                    try:
+                        item, pos = decoder.raw_decode(buf, pos)
+                    except json.JSONDecodeError:
+                        break
+                    yield item
+                if not chunk:
+                    break
+        if not closed or checksum.hexdigest() != self.digest:
+            raise SnapshotError(f'オブジェクト {self.digest[:12]} のチェックサムが一致しません（破損しています）')
+
+
+class StoreWriter:
+    # SnapshotWriter と同じ使い方（add → close）でストアへ書き込む
+    def __init__(self, store: SnapshotStore, guild_id, meta: dict | None = None, created_at: float | None = None):
+        self.store = store
+        self.guild_id = str(guild_id)
+        self.meta = dict(meta or {})
+        self.created_at = created_at or time.time()
+        self.sections: dict[str, dict] = {}
+        self.new_objects = 0
+
+    def __enter__(self):
+        return self
+
+    def add(self, name: str, items) -> dict:
+        if name in self.sections:
+            raise SnapshotError(f'セクション {name} が重複しています')
+        digest, created = self.store.put_section(items, name)
+        self.new_objects += int(created)
+        entry = self.sections[name] = {'object': digest, 'count': len(items)}
+        return entry
+
+    def stream(self, name: str) -> SectionStream:
+        if name in self.sections:
+            raise SnapshotError(f'セクション {name} が重複しています')
+        return SectionStream(self.store, name)
+
+    def add_stream(self, stream: SectionStream) -> dict:
+        # stream を閉じてセクションとして載せる
+        if stream.name in INDEXED_SECTIONS:
+            raise SnapshotError(f'セクション {stream.name} は差分用の索引が必要なので add で書いてください')
+        digest, created = stream.close()
+        self.new_objects += int(created)
+        entry = self.sections[stream.name] = {'object': digest, 'count': stream.count}
+        return entry
+
+    def link(self, name: str, entry: dict) -> dict:
+        # 前回のスナップショットのセクションを、直列化し直さずにそのまま参照する
+        if name in self.sections:
+            raise SnapshotError(f'セクション {name} が重複しています')
+        if not self.store.retain(entry['object']):
+            raise SnapshotError(f'オブジェクト {entry["object"][:12]} が見つかりません')
+        linked = self.sections[name] = {'object': entry['object'], 'count': entry['count']}
+        return linked
+
+    def close(self) -> dict:
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.created_at))
+        content = hashlib.sha256(''.join(e['object'] for e in self.sections.values()).encode()).hexdigest()
+        entry = {
+            'id': f'{stamp}-{content[:6]}',
+            'created_at': self.created_at,
+            'meta': self.meta,
+            'sections': self.sections,
+            'new_objects': self.new_objects,
+        }
+        try:
+            self.store._commit(self.guild_id, entry)
+        finally:
+            self.store._release(e['object'] for e in self.sections.values())
+        return entry
+
+    def abort(self):
+        self.store._release(e['object'] for e in self.sections.values())
+        self.sections.clear()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='スナップショットストアの操作')
+    parser.add_argument('--root', default=backup_dir())
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('guilds', help='スナップショットのあるギルド一覧')
+    p = sub.add_parser('list', help='ギルドのスナップショット一覧（索引のみ読む）')
+    p.add_argument('guild_id')
+    p = sub.add_parser('export', help='スナップショットを単一ファイルに書き出す')
+    p.add_argument('guild_id')
+    p.add_argument('snapshot_id')
+    p.add_argument('out')
+    p = sub.add_parser('import', help='単一ファイルのスナップショットを取り込む')
+    p.add_argument('path')
+    p.add_argument('--guild-id')
+    p = sub.add_parser('diff', help='2 つのスナップショットの差分（ロール・チャンネル・権限上書き）')
+    p.add_argument('guild_id')
+    p.add_argument('a', help='比較元のスナップショット ID')
+    p.add_argument('b', nargs='?', help='比較先のスナップショット ID（省略時は最新）')
+    p.add_argument('--json', action='store_true', help='差分を JSON で出力する')
+    p = sub.add_parser('prune', help='保持ポリシーを適用して不要なスナップショットを消す')
+    p.add_argument('guild_id', nargs='?')
+    p.add_argument('--keep-last', type=int, default=KEEP_LAST)
+    p.add_argument('--keep-daily', type=int, default=KEEP_DAILY)
+    p.add_argument('--keep-weekly', type=int, default=KEEP_WEEKLY)
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(args.root)
+    try:
+        if args.command == 'guilds':
+            for guild_id in store.list_guilds():
+                print(f'{guild_id}  {len(store.list_snapshots(guild_id))} snapshots')
+        elif args.command == 'list':
+            for snap in store.list_snapshots(args.guild_id):
+                counts = ' '.join(f"{k}={v['count']}" for k, v in snap['sections'].items())
+                print(f"{snap['id']}  new_objects={snap.get('new_objects', 0)}  {counts}")
+        elif args.command == 'export':
+            store.export(args.guild_id, args.snapshot_id, args.out)
+            print(args.out)
+        elif args.command == 'import':
+            print(store.import_file(args.path, args.guild_id)['id'])
+        elif args.command == 'diff':
+            diff = store.diff(args.guild_id, args.a, args.b)
+            print(json.dumps(diff.to_dict(), ensure_ascii=False, indent=2) if args.json else diff.render(limit=None))
+        elif args.command == 'prune':
+            for guild_id in [args.guild_id] if args.guild_id else store.list_guilds():
+                removed = store.apply_retention(guild_id, args.keep_last, args.keep_daily, args.keep_weekly)
+                print(f'{guild_id}: removed {len(removed)}')
+    except SnapshotError as e:
+        print(f'エラー: {e}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
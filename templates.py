@@ -0,0 +1,87 @@
+import re
+
+import discord
+
+# Discord のサーバーテンプレート（https://discord.new/<コード>）との変換。
+# テンプレートはロール・チャンネルに連番の ID（@everyone が 0）を振った形式なので、
+# バックアップには ID を持たない旧形式（名前で対応付ける）として取り込む。
+# 書き出しはギルドのテンプレートを作成（既にあれば同期）するだけで、新しいサーバーは
+# Discord 側がテンプレートから一度に作る（リクエストを 1 件ずつ送るより速い）。
+
+TEMPLATE_NAME = 'DiscordBackUp'
+
+_CODE = re.compile(r'^(?:https?://)?(?:discord\.new/|(?:www\.)?discord(?:app)?\.com/template/|template:)([\w-]+)/?$')
+_KINDS = {0: 'text', 5: 'text', 2: 'voice', 4: 'categories', 15: 'forum'}
+
+
+def template_code(value: str) -> str | None:
+    # 'https://discord.new/abc' / 'template:abc' → 'abc'。テンプレートの指定でなければ None
+    m = _CODE.match(value.strip())
+    return m.group(1) if m else None
+
+
+def _overwrites(stored: list, role_names: dict) -> dict:
+    out = {}
+    for o in stored or []:
+        # テンプレートにはメンバー宛ての上書きは含まれない
+        if int(o.get('type', 0)) != 0:
+            continue
+        key = role_names.get(o.get('id'))
+        if key is None:
+            continue
+        out[key] = {'target_type': 'role', 'allow': int(o.get('allow') or 0), 'deny': int(o.get('deny') or 0)}
+    return out
+
+
+def template_to_backup(source: dict) -> dict:
+    # serialized_source_guild → バックアップのセクション
+    roles = source.get('roles') or []
+    role_names = {r['id']: ('@everyone' if r['id'] == 0 else r['name']) for r in roles}
+    backup = {'roles': [], 'categories': [], 'text': [], 'forum': [], 'voice': []}
+    # roles は下から順に並んでいる（先頭が @everyone）
+    for position, r in enumerate(roles):
+        if r['id'] == 0:
+            continue
+        backup['roles'].append({'name': r['name'], 'color': int(r.get('color') or 0), 'hoist': bool(r.get('hoist')),
+                                'mentionable': bool(r.get('mentionable')),
+                                'permissions': int(r.get('permissions') or 0), 'position': position})
+
+    channels = source.get('channels') or []
+    categories = {c['id']: c['name'] for c in channels if c.get('type') == 4}
+    for c in channels:
+        section = _KINDS.get(c.get('type'))
+        if section is None:
+            continue
+        item = {'name': c['name'], 'position': int(c.get('position') or 0),
+                'overwrites': _overwrites(c.get('permission_overwrites'), role_names)}
+        if section != 'categories':
+            item['category'] = categories.get(c.get('parent_id'))
+        if section in ('text', 'forum'):
+            item.update(nsfw=bool(c.get('nsfw')), topic=c.get('topic'))
+        if section == 'text':
+            item['slowmode_delay'] = int(c.get('rate_limit_per_user') or 0)
+        elif section == 'voice':
+            item.update(bitrate=c.get('bitrate'), user_limit=int(c.get('user_limit') or 0))
+        elif section == 'forum':
+            emoji = c.get('default_reaction_emoji') or {}
+            item.update(
+                default_thread_slowmode_delay=c.get('default_thread_rate_limit_per_user'),
+                default_reaction_emoji=emoji.get('emoji_name') if not emoji.get('emoji_id') else None,
+                available_tags=[{'name': t.get('name'), 'emoji': t.get('emoji_name'), 'moderated': bool(t.get('moderated'))}
+                                for t in c.get('available_tags') or []],
+            )
+        backup[section].append(item)
+    return backup
+
+
+async def fetch_template(client: discord.Client, code: str) -> dict:
+    # 変換に使う生の JSON が要るので discord.py の Template ではなく HTTP の結果をそのまま使う
+    return await client.http.get_template(code)
+
+
+async def export_template(guild: discord.Guild) -> discord.Template:
+    # Bot が作ったテンプレートがあれば現在の構成に同期し、無ければ作る（サーバー管理の権限が必要）
+    for template in await guild.templates():
+        if template.name == TEMPLATE_NAME:
+            return await template.sync()
+    return await guild.create_template(name=TEMPLATE_NAME, description=f'{guild.name} の構成')
@@ -0,0 +1,253 @@
+import asyncio
+import itertools
+import os
+from dataclasses import dataclass, field
+
+import discord
+
+from archive import iter_threads
+from codec import ThreadRecord
+from ratelimit import ROUTE_CHANNEL_EDIT, ROUTE_THREAD_CREATE
+from store import run_io
+
+# スレッド・フォーラム投稿のバックアップと復元。
+# スレッドは非同期ジェネレータで遅延列挙し、THREAD_PAGE_SIZE 件ずつまとめて処理する
+# （大きなフォーラムでも同時に抱えるスレッド・リクエストは 1 ページ分だけ）。
+
+THREAD_PAGE_SIZE = int(os.getenv('THREAD_PAGE_SIZE', '50'))
+
+
+async def _record(thread: discord.Thread) -> dict:
+    starter = None
+    if isinstance(thread.parent, discord.ForumChannel):
+        # フォーラム投稿の最初のメッセージは投稿と同じ ID
+        starter = thread.starter_message
+        if starter is None:
+            try:
+                starter = await thread.fetch_message(thread.id)
+            except discord.HTTPException:
+                starter = None
+    return ThreadRecord.from_thread(thread, starter).to_dict()
+
+
+async def iter_thread_pages(guild: discord.Guild, page_size: int = THREAD_PAGE_SIZE):
+    page = []
+    async for thread in iter_threads(guild):
+        page.append(thread)
+        if len(page) >= page_size:
+            yield await asyncio.gather(*(_record(t) for t in page))
+            page = []
+    if page:
+        yield await asyncio.gather(*(_record(t) for t in page))
+
+
+async def serialize_threads(guild: discord.Guild, page_size: int = THREAD_PAGE_SIZE, progress=None):
+    # レコードをページごとに返す（全件をリストに溜めない。受け取る側がストアへ書き進める）
+    done = 0
+    async for page in iter_thread_pages(guild, page_size):
+        done += len(page)
+        if progress is not None:
+            progress.update(f'🧵 スレッドをバックアップ中… {done} 件')
+        yield page
+
+
+def _pages(items, size: int):
+    # リストに限らず、イテレータも size 件ずつに区切る
+    items = iter(items)
+    while page := list(itertools.islice(items, size)):
+        yield page
+
+
+def _find_parent(guild: discord.Guild, record: dict, idmap=None):
+    kinds = discord.ForumChannel if record.get('parent_kind') == 'forum' else discord.TextChannel
+    # 元の親チャンネル ID（対応表 → 同じ ID）で引けなければ名前で探す
+    parent_id = record.get('parent_id')
+    if parent_id is not None:
+        mapped = idmap.get('channels', parent_id) if idmap is not None else None
+        for candidate in (mapped, parent_id):
+            channel = guild.get_channel(candidate) if candidate else None
+            if isinstance(channel, kinds):
+                return channel
+    candidates = [c for c in guild.channels if isinstance(c, kinds) and c.name == record.get('parent')]
+    for c in candidates:
+        if (c.category.name if c.category else None) == record.get('category'):
+            return c
+    return candidates[0] if candidates else None
+
+
+@dataclass
+class ThreadRestore:
+    created: int = 0
+    existing: int = 0
+    missing_parent: int = 0
+    # 元のスレッド ID → 復元先のスレッド（メッセージの再投稿先に使う）
+    thread_map: dict = field(default_factory=dict)
+    # 作成したスレッドのうち、最後にアーカイブ・ロック・ピン留めを戻すもの
+    pending: list = field(default_factory=list)
+    finalized: int = 0
+
+    def summary(self) -> str:
+        return (f'スレッド: 作成 {self.created} 件・既存 {self.existing} 件'
+                + (f'・親チャンネルが無い {self.missing_parent} 件' if self.missing_parent else ''))
+
+
+class _ExistingThreads:
+    # 親チャンネルの既存のスレッド。対応表にある・同名のスレッドは作り直さない。
+    # アーカイブ済みは探しているものが見つかるまで 1 ページずつ取得し、取得したぶんだけで照合する
+    def __init__(self, parent, page_size: int = THREAD_PAGE_SIZE):
+        self.by_id: dict[int, discord.Thread] = {}
+        # 名前 → スレッドの列（同名のスレッドが複数あることもある）
+        self.by_name: dict[str, list] = {}
+        for thread in parent.threads:
+            self._add(thread)
+        self.done = False
+        self._pages = self._archived(parent, page_size)
+        self._fetched = 0
+        self._lock = asyncio.Lock()
+
+    def _add(self, thread: discord.Thread):
+        if thread.id not in self.by_id:
+            self.by_id[thread.id] = thread
+            self.by_name.setdefault(thread.name, []).append(thread)
+
+    @staticmethod
+    async def _archived(parent, page_size: int):
+        privates = (False, True) if isinstance(parent, discord.TextChannel) else (False,)
+        for private in privates:
+            page = []
+            try:
+                async for thread in parent.archived_threads(limit=None, private=private):
+                    page.append(thread)
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+            except (discord.Forbidden, discord.NotFound):
+                pass
+            if page:
+                yield page
+
+    async def find(self, match):
+        # match() が既存のスレッドを返すか、アーカイブ済みを取り尽くすまで次のページを取得する
+        while True:
+            thread = match()
+            if thread is not None or self.done:
+                return thread
+            fetched = self._fetched
+            async with self._lock:
+                # 待っている間に他のレコードが次のページを取得していたら、先にそれで照合し直す
+                if fetched != self._fetched or self.done:
+                    continue
+                page = await anext(self._pages, None)
+                if page is None:
+                    self.done = True
+                else:
+                    for thread in page:
+                        self._add(thread)
+                    self._fetched += 1
+
+
+def _starter_content(record: dict) -> str:
+    starter = record.get('starter') or {}
+    content = starter.get('content') or ''
+    urls = starter.get('attachments') or []
+    if urls:
+        content = '\n'.join([content, *urls]) if content else '\n'.join(urls)
+    return (content or record['name'])[:2000]
+
+
+async def restore_threads(guild: discord.Guild, records, executor, progress=None,
+                          page_size: int = THREAD_PAGE_SIZE, idmap=None) -> ThreadRestore:
+    # records はリストでもイテレータでもよい（page_size 件ずつ取り出して処理する）
+    result = ThreadRestore()
+    existing: dict[int, _ExistingThreads] = {}
+    # 既存のスレッドは 1 つのレコードにだけ対応付ける。対応表で別のレコードのものになっているスレッドは名前では選ばない
+    claimed: set[int] = set()
+    reserved = idmap.targets('threads') if idmap is not None else frozenset()
+
+    async def _one(record: dict):
+        parent = _find_parent(guild, record, idmap)
+        if parent is None:
+            result.missing_parent += 1
+            return
+        if parent.id not in existing:
+            existing[parent.id] = _ExistingThreads(parent, page_size)
+        threads = existing[parent.id]
+        mapped = idmap.get('threads', record['id']) if idmap is not None else None
+
+        def _match():
+            thread = threads.by_id.get(mapped) if mapped is not None else None
+            if thread is None and mapped is not None and not threads.done:
+                # 対応表のスレッドがまだ取得していないページにあるかもしれないので、名前では選ばない
+                return None
+            if thread is None or thread.id in claimed:
+                thread = next((t for t in threads.by_name.get(record['name'], ())
+                               if t.id not in claimed and t.id not in reserved), None)
+            return thread
+
+        thread = await threads.find(_match)
+        if thread is not None:
+            claimed.add(thread.id)
+            result.existing += 1
+            result.thread_map[record['id']] = thread
+            if idmap is not None:
+                idmap.set('threads', record['id'], thread.id)
+            # 中断した復元で作ったまま、アーカイブ・ロックを戻せていないもの
+            if (record.get('archived') and not thread.archived) or (record.get('locked') and not thread.locked):
+                result.pending.append((record, thread))
+            return
+
+        label = f"#{record.get('parent')}/{record['name']}"
+        if isinstance(parent, discord.ForumChannel):
+            # タグは名前で、新しく作られたフォーラムの ForumTag（新しい ID）に対応付ける
+            tags = {t.name: t for t in parent.available_tags}
+            applied = [tags[name] for name in record.get('applied_tags') or [] if name in tags]
+            created = await executor.run(ROUTE_THREAD_CREATE, lambda: parent.create_thread(
+                name=record['name'][:100],
+                content=_starter_content(record),
+                applied_tags=applied,
+                auto_archive_duration=record.get('auto_archive_duration') or 1440,
+                slowmode_delay=record.get('slowmode_delay') or None,
+                reason='スレッドの復元',
+            ), label)
+            thread = created.thread
+        else:
+            thread_type = getattr(discord.ChannelType, record.get('type') or 'public_thread',
+                                  discord.ChannelType.public_thread)
+            thread = await executor.run(ROUTE_THREAD_CREATE, lambda: parent.create_thread(
+                name=record['name'][:100],
+                type=thread_type,
+                auto_archive_duration=record.get('auto_archive_duration') or 1440,
+                invitable=record.get('invitable', True),
+                slowmode_delay=record.get('slowmode_delay') or None,
+                reason='スレッドの復元',
+            ), label)
+        claimed.add(thread.id)
+        result.created += 1
+        result.thread_map[record['id']] = thread
+        if idmap is not None:
+            idmap.set('threads', record['id'], thread.id)
+        if record.get('archived') or record.get('locked') or record.get('pinned'):
+            result.pending.append((record, thread))
+
+    done = 0
+    # レコードの読み出し（ストアからの展開）はイベントループの外で 1 ページずつ行う
+    records = iter(records)
+    while page := await run_io(lambda: list(itertools.islice(records, page_size))):
+        await asyncio.gather(*(_one(r) for r in page), return_exceptions=True)
+        done += len(page)
+        if progress is not None:
+            progress.update(f'🧵 スレッドを復元中… {done} 件')
+    return result
+
+
+async def finalize_threads(result: ThreadRestore, executor, page_size: int = THREAD_PAGE_SIZE):
+    # メッセージの再投稿が終わってからアーカイブ・ロックする（投稿するとアーカイブが解除されるため）
+    async def _one(record: dict, thread: discord.Thread):
+        kwargs = {'archived': bool(record.get('archived')), 'locked': bool(record.get('locked'))}
+        if record.get('pinned') and record.get('parent_kind') == 'forum':
+            kwargs['pinned'] = True
+        await executor.run(ROUTE_CHANNEL_EDIT, lambda: thread.edit(**kwargs), f"#{thread.name}")
+        result.finalized += 1
+
+    for page in _pages(result.pending, page_size):
+        await asyncio.gather(*(_one(record, thread) for record, thread in page), return_exceptions=True)
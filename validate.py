@@ -0,0 +1,223 @@
+import os
+import re
+from dataclasses import dataclass, field
+
+import discord
+
+from codec import OverwriteCodec
+from planner import CREATE, EDIT, MOVE, SKIP, Op, diff_fields, ref_key
+
+# 復元の事前検証。リクエストを送る前に、計画した操作をバックアップとキャッシュ済みのギルドの状態だけで確かめ、
+# 送っても必ず失敗する操作（レート制限の枠を使ってから 400 / 403 で落ちるもの）を外すか、送れる形に直す。
+#   - 上限: チャンネル（カテゴリを含む）500・カテゴリ内 50・ロール 250 を超える作成は、後ろのものから外す
+#   - ロールの階層: Bot の一番上のロール以上のロールは編集できないので、編集しない
+#   - 権限: Bot が持っていない権限は、ロールの権限にも上書きの許可・拒否にも付けられないので外す
+#     （上書きの「権限の管理」は管理者でなければ付けられない）
+#   - フォーラム: このギルドに無いカスタム絵文字・絵文字として読めない文字列は外す（タグは 20 個まで）
+# 直した結果、現在のギルドと差分が無くなった編集はスキップにする。
+# RestorePlanner に渡すと、セクションを計画するたびに（clone では届いたセクションごとに）検証する。
+
+# Discord の上限（モックなど上限の無い相手に復元するときは .env で変えられる）
+MAX_CHANNELS = int(os.getenv('GUILD_MAX_CHANNELS', '500'))
+MAX_CATEGORY_CHANNELS = int(os.getenv('GUILD_MAX_CATEGORY_CHANNELS', '50'))
+MAX_ROLES = int(os.getenv('GUILD_MAX_ROLES', '250'))
+MAX_FORUM_TAGS = 20
+
+FINDING_LABELS = {
+    'channel_limit': f'チャンネル数の上限（{MAX_CHANNELS}）を超えるため作成しない',
+    'category_limit': f'カテゴリ内のチャンネル数の上限（{MAX_CATEGORY_CHANNELS}）を超えるため作成しない',
+    'role_limit': f'ロール数の上限（{MAX_ROLES}）を超えるため作成しない',
+    'no_manage_roles': 'Bot に「ロールの管理」が無いため実行しない',
+    'no_manage_channels': 'Bot に「チャンネルの管理」が無いため実行しない',
+    'hierarchy': 'Bot のロール以上の位置にあるため編集しない',
+    'role_permissions': 'Bot が持っていない権限を外したロール',
+    'overwrite_bits': 'Bot が持っていない権限を上書きから外したチャンネル',
+    'tag_emoji': '使えない絵文字を外したフォーラム',
+    'tag_limit': f'タグの上限（{MAX_FORUM_TAGS}）を超えた分を外したフォーラム',
+}
+# 報告に名前を並べる件数
+FINDING_SAMPLES = 5
+
+# 'thumbsup' や ':smile:'、ID の形が崩れた '<:name:1>' のように ASCII だけのものは Unicode の絵文字ではない
+_NOT_EMOJI = re.compile(r'[\w:<>~-]+', re.ASCII)
+_MANAGE_ROLES = discord.Permissions(manage_roles=True).value
+
+
+@dataclass
+class Validation:
+    # 理由 → 対象の名前
+    findings: dict = field(default_factory=dict)
+    # 外した・スキップにしたことで送らずに済んだリクエスト数
+    saved: int = 0
+
+    def add(self, reason: str, name: str):
+        self.findings.setdefault(reason, []).append(name)
+
+    def __bool__(self) -> bool:
+        return bool(self.findings)
+
+    def to_dict(self) -> dict:
+        return {'findings': self.findings, 'saved': self.saved}
+
+    def summary(self) -> str:
+        if not self.findings:
+            return '🛡️ 事前検証: 問題なし'
+        lines = [f'🛡️ 事前検証: 送っても失敗する操作を直しました（省いたリクエスト {self.saved} 件）']
+        for reason, names in self.findings.items():
+            more = f' ほか {len(names) - FINDING_SAMPLES} 件' if len(names) > FINDING_SAMPLES else ''
+            lines.append(f'- {FINDING_LABELS[reason]}: {len(names)} 件（{"、".join(names[:FINDING_SAMPLES])}{more}）')
+        return '\n'.join(lines)
+
+
+class _Slots:
+    # カテゴリ 1 つ分の空き（参照キー・現在の ID のどれからでも同じものを引く）
+    __slots__ = ('left',)
+
+    def __init__(self, left: int):
+        self.left = left
+
+
+class PlanValidator:
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self.report = Validation()
+        self.codec = OverwriteCodec()
+        me = guild.me
+        perms = me.guild_permissions
+        self.owner = guild.owner_id == me.id
+        admin = self.owner or perms.administrator
+        self.top_role = me.top_role
+        self.manage_roles = admin or perms.manage_roles
+        self.manage_channels = admin or perms.manage_channels
+        # 付けられる権限。ロールには自分の権限まで、上書きにはさらに「権限の管理」を除いたものまで（管理者は制限なし）
+        self.role_bits = -1 if admin else perms.value
+        self.overwrite_bits = self.role_bits if admin else perms.value & ~_MANAGE_ROLES
+        self.roles_left = MAX_ROLES - len(guild.roles)
+        self.channels_left = MAX_CHANNELS - len(guild.channels)
+        self.emoji_ids = {e.id for e in guild.emojis}
+        self.slots: dict = {}
+        for cat in guild.categories:
+            self.slots[('live', cat.id)] = _Slots(MAX_CATEGORY_CHANNELS - len(cat.channels))
+
+    def check(self, ops: list[Op], role_keys: dict) -> list[Op]:
+        # 検証済みの操作を返す（外したものは含まない。直したものは op.stored・action・changes を書き換える）
+        kept = []
+        for op in ops:
+            before = op.action != SKIP and (op.action == CREATE or bool(op.changes))
+            stored = op.stored
+            keep = self._role(op) if op.kind == 'role' else self._channel(op)
+            if keep and op.stored is not stored and op.action in (EDIT, MOVE):
+                # 直した内容で差分を取り直す（差分が無くなった編集は送らない）
+                op.changes = diff_fields(op.kind, op.stored, op.target, role_keys, self.codec)
+                if not op.changes and op.action == EDIT:
+                    op.action = SKIP
+            after = keep and op.action != SKIP and (op.action == CREATE or bool(op.changes))
+            self.report.saved += int(before and not after)
+            if keep:
+                kept.append(op)
+        return kept
+
+    def _skip(self, op: Op, reason: str) -> bool:
+        # 作成は外し、既にあるものはスキップにする
+        self.report.add(reason, op.name)
+        if op.action == CREATE:
+            return False
+        op.action, op.changes = SKIP, []
+        return True
+
+    def _role(self, op: Op) -> bool:
+        if op.action == SKIP:
+            return True
+        if not self.manage_roles:
+            return self._skip(op, 'no_manage_roles')
+        if op.action == CREATE:
+            if self.roles_left <= 0:
+                return self._skip(op, 'role_limit')
+            self.roles_left -= 1
+        elif not self.owner and op.target >= self.top_role:
+            return self._skip(op, 'hierarchy')
+        permissions = int(op.stored.get('permissions') or 0)
+        if permissions & ~self.role_bits:
+            self.report.add('role_permissions', op.name)
+            op.stored = dict(op.stored, permissions=permissions & self.role_bits)
+        return True
+
+    def _category_slots(self, op: Op):
+        if op.kind == 'category':
+            return None
+        key = ref_key(op.stored, 'category_id', 'category')
+        return self.slots.get(('ref', key)) if key else None
+
+    def _channel(self, op: Op) -> bool:
+        if op.kind == 'category' and op.action != CREATE:
+            # 子チャンネルの数え先。既にあるカテゴリは現在の子の数から
+            slots = self.slots.setdefault(('live', op.target.id), _Slots(MAX_CATEGORY_CHANNELS))
+            for key in (ref_key(op.stored, 'id', 'name'), op.name):
+                self.slots.setdefault(('ref', key), slots)
+        if op.action == SKIP:
+            return True
+        if not self.manage_channels:
+            return self._skip(op, 'no_manage_channels')
+        slots = self._category_slots(op)
+        if op.action == CREATE:
+            if self.channels_left <= 0:
+                return self._skip(op, 'channel_limit')
+            if slots is not None and slots.left <= 0:
+                return self._skip(op, 'category_limit')
+            self.channels_left -= 1
+            if op.kind == 'category':
+                slots = _Slots(MAX_CATEGORY_CHANNELS)
+                for key in (ref_key(op.stored, 'id', 'name'), op.name):
+                    self.slots.setdefault(('ref', key), slots)
+            elif slots is not None:
+                slots.left -= 1
+        elif op.action == MOVE:
+            # 移動は最後の一括並べ替えで反映される。空きの計算だけ移す
+            if slots is not None:
+                slots.left -= 1
+            old = self.slots.get(('live', op.target.category_id))
+            if old is not None:
+                old.left += 1
+
+        if op.action == CREATE or 'overwrites' in op.changes:
+            self._overwrites(op)
+        if op.kind == 'forum':
+            self._forum(op)
+        return True
+
+    def _overwrites(self, op: Op):
+        masked, changed = {}, False
+        for key, perm in (op.stored.get('overwrites') or {}).items():
+            allow, deny = int(perm.get('allow', 0)), int(perm.get('deny', 0))
+            if (allow | deny) & ~self.overwrite_bits:
+                changed = True
+                perm = dict(perm, allow=allow & self.overwrite_bits, deny=deny & self.overwrite_bits)
+            masked[key] = perm
+        if changed:
+            self.report.add('overwrite_bits', op.name)
+            op.stored = dict(op.stored, overwrites=masked)
+
+    def _emoji_ok(self, value) -> bool:
+        if not value:
+            return True
+        emoji = discord.PartialEmoji.from_str(value)
+        if emoji.id is not None:
+            return emoji.id in self.emoji_ids
+        return not _NOT_EMOJI.fullmatch(value)
+
+    def _forum(self, op: Op):
+        stored = op.stored
+        fixed = {}
+        tags = list(stored.get('available_tags') or [])
+        if len(tags) > MAX_FORUM_TAGS:
+            self.report.add('tag_limit', op.name)
+            tags = fixed['available_tags'] = tags[:MAX_FORUM_TAGS]
+        bad_tags = [t for t in tags if not self._emoji_ok(t.get('emoji'))]
+        if bad_tags:
+            fixed['available_tags'] = [dict(t, emoji=None) if not self._emoji_ok(t.get('emoji')) else t for t in tags]
+        if not self._emoji_ok(stored.get('default_reaction_emoji')):
+            fixed['default_reaction_emoji'] = None
+        if bad_tags or 'default_reaction_emoji' in fixed:
+            self.report.add('tag_emoji', op.name)
+        if fixed:
+            op.stored = dict(stored, **fixed)